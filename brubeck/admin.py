@@ -1,16 +1,27 @@
 from django.contrib import admin
+from django.db.models import Count
 
-from brubeck import models
+from brubeck import models, utils
 
 
 class TextAdmin(admin.ModelAdmin):
     """ Allows the convenient lookup of a snippet of text on each object """
+    def queryset(self, request):
+        """ Selects the snippet text and editor along with each object, rather
+            than looking them up row by row
+        """
+        qs = super(TextAdmin, self).queryset(request)
+        return utils.select_from_snippets(qs,
+            snippet_text="CASE WHEN s.proof_agent != '' THEN s.proof_text "
+                         "ELSE r.text END",
+            last_editor='u.username')
+
     def text(self, obj):
         """ Gets the text of the (first) snippet for `obj` """
-        return obj.snippets.all()[0].current_text()
+        return obj.snippet_text
 
     def last_revised_by(self, obj):
-        return obj.snippets.all()[0].revision.user
+        return obj.last_editor
 
 
 # Core objects
@@ -39,6 +50,10 @@ admin.site.register(models.Implication, ImplicationAdmin)
 class SnippetAdmin(admin.ModelAdmin):
     list_display = ('object', 'current_text', 'last_revised_by')
 
+    def queryset(self, request):
+        qs = super(SnippetAdmin, self).queryset(request)
+        return qs.select_related('revision__user')
+
     def last_revised_by(self, obj):
         return obj.revision.user
 admin.site.register(models.Snippet, SnippetAdmin)
@@ -47,7 +62,13 @@ admin.site.register(models.Snippet, SnippetAdmin)
 # Profiles
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('username', 'revisions')
+    list_select_related = True
+
+    def queryset(self, request):
+        qs = super(ProfileAdmin, self).queryset(request)
+        return qs.annotate(revision_count=Count('user__revision'))
 
     def revisions(self, profile):
-        return profile.user.revision_set.count()
+        return profile.revision_count
+    revisions.admin_order_field = 'revision_count'
 admin.site.register(models.Profile, ProfileAdmin)
@@ -0,0 +1,200 @@
+# Measures how the prover and formula engine scale, by filling the database
+# with random (but consistent) data and timing a set of standard scenarios.
+# See the `benchmark` management command, which runs these against a
+# throwaway database.
+import random
+import resource
+import sys
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import connection, reset_queries
+
+# The models must be loaded before brubeck.logic
+from brubeck.models import Space, Property, Trait, Implication, Value, \
+    Snippet
+from brubeck.logic import Formula, Prover
+from brubeck.logic.utils import get_full_proof, spaces_matching_formula
+from brubeck.utils import get_orphans
+
+
+DEFAULTS = {
+    'spaces': 50,
+    'properties': 30,
+    'implications': 40,
+    'formula_size': 2,
+    'depth': 3,
+    'traits': 3,
+    'samples': 10,
+    'seed': 0,
+}
+
+
+def _peak_rss():
+    """ The peak resident set size of this process, in kilobytes """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, but OS X reports bytes
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure(name, func, *args):
+    """ Runs `func(*args)`, recording its wall time, number of queries and
+        memory use. `func` may return a dict of extra figures to report.
+
+        The scenarios share one process, whose peak resident set size only
+        ever grows, so `process_peak_rss_kb` is the peak of everything run
+        so far. `peak_rss_growth_kb` is how far this scenario raised it: a
+        scenario that stays below an earlier peak reports 0.
+    """
+    debug, connection.use_debug_cursor = connection.use_debug_cursor, True
+    reset_queries()
+    peak = _peak_rss()
+    start = time.time()
+    try:
+        extra = func(*args) or {}
+    finally:
+        connection.use_debug_cursor = debug
+    seconds, rss = time.time() - start, _peak_rss()
+    result = {
+        'scenario': name,
+        'seconds': round(seconds, 6),
+        'queries': len(connection.queries),
+        'process_peak_rss_kb': rss,
+        'peak_rss_growth_kb': rss - peak,
+    }
+    result.update(extra)
+    return result
+
+
+class Benchmark(object):
+    """ Builds a random database from `params` (see DEFAULTS) and runs
+        scenarios against it. Properties are split into `depth` layers, and
+        each implication derives an atom of one layer from a conjunction of
+        `formula_size` atoms of the previous one, so that inserting a trait in
+        the first layer can cascade through all the others.
+    """
+    def __init__(self, **params):
+        self.params = dict(DEFAULTS, **params)
+        self.random = random.Random(self.params['seed'])
+        self.T = Value.objects.get(id=Value.TRUE)
+        self.F = Value.objects.get(id=Value.FALSE)
+
+    def _atom(self, property):
+        return Formula(property, self.random.choice([self.T, self.F]))
+
+    def _formula(self, properties, operator=Formula.AND):
+        size = min(self.params['formula_size'], len(properties))
+        atoms = [self._atom(p) for p in self.random.sample(properties, size)]
+        return reduce(lambda f, g: Formula._and_or_or(f, g, operator), atoms)
+
+    def setup(self):
+        """ Creates the spaces, properties and implications. This happens
+            before any traits exist, so no implication can be refuted.
+        """
+        p = self.params
+        self.spaces = [Space.objects.create(name='Space %s' % i)
+                       for i in range(p['spaces'])]
+        self.properties = [Property.objects.create(name='Property %s' % i)
+                           for i in range(p['properties'])]
+        depth = max(1, min(p['depth'], len(self.properties) - 1))
+        self.layers = [self.properties[i::depth + 1]
+                       for i in range(depth + 1)]
+        for i in range(p['implications']):
+            layer = i % depth
+            Implication.objects.create(
+                antecedent=self._formula(self.layers[layer]),
+                consequent=self._atom(
+                    self.random.choice(self.layers[layer + 1])))
+        return {'implications': Implication.objects.count()}
+
+    def trait_insert(self):
+        """ Gives each space `traits` random traits, letting the prover
+            derive whatever follows from each.
+        """
+        added = 0
+        for space in self.spaces:
+            known = set(space.trait_set.values_list('property_id', flat=True))
+            candidates = [q for q in self.properties if q.id not in known]
+            for q in self.random.sample(candidates,
+                    min(self.params['traits'], len(candidates))):
+                if space.trait_set.filter(property=q).exists():
+                    continue  # Proven by an earlier trait in this loop
+                Trait.objects.create(space=space, property=q,
+                    value=self.random.choice([self.T, self.F]))
+                added += 1
+        return {'inserted': added, 'traits': Trait.objects.count()}
+
+    def implication_insert(self):
+        """ Adds random implications, each of which is checked for
+            counterexamples and then applied to every space.
+        """
+        added = rejected = 0
+        before = Trait.objects.count()
+        for i in range(self.params['samples']):
+            q = self.random.choice(self.properties)
+            try:
+                Implication.objects.create(
+                    antecedent=self._formula([p for p in self.properties
+                                              if p != q]),
+                    consequent=self._atom(q))
+                added += 1
+            except ValidationError:
+                rejected += 1
+        return {'inserted': added, 'rejected': rejected,
+                'derived': Trait.objects.count() - before}
+
+    def delete_recovery(self):
+        """ Deletes random manually added traits along with everything proven
+            from them, then searches for proofs of what can be recovered (as
+            the delete view does).
+        """
+        ids = list(Trait.objects.exclude(id__in=self._derived()).values_list(
+            'id', flat=True))
+        deleted = 0
+        for t in Trait.objects.filter(id__in=self.random.sample(ids,
+                min(self.params['samples'], len(ids)))):
+            orphans = get_orphans(t)
+            for o in orphans:
+                o.delete()
+            t.delete()
+            deleted += 1 + len(orphans)
+        before = Trait.objects.count()
+        Prover._add_proofs()
+        return {'deleted': deleted,
+                'recovered': Trait.objects.count() - before}
+
+    def _derived(self):
+        """ The ids of traits added by the prover """
+        return list(Snippet.objects.filter(proof_agent=Prover.agent,
+            content_type__model='trait').values_list('object_id', flat=True))
+
+    def formula_search(self):
+        """ Finds the spaces matching random conjunctions and disjunctions """
+        matches = 0
+        for i in range(self.params['samples']):
+            operator = Formula.OR if i % 2 else Formula.AND
+            matches += len(list(spaces_matching_formula(
+                self._formula(self.properties, operator))))
+        return {'matches': matches}
+
+    def proof_rendering(self):
+        """ Renders full proofs and proof text for random derived traits """
+        ids = self._derived()
+        nodes = 0
+        for t in Trait.objects.filter(id__in=self.random.sample(ids,
+                min(self.params['samples'], len(ids)))):
+            nodes += len(get_full_proof(t))
+            t.snippet.render_html()
+        return {'nodes': nodes}
+
+    # The first two scenarios build the data the others work with, and always
+    # run. Each scenario runs on the data left by the ones before it.
+    SCENARIOS = ['setup', 'trait_insert', 'implication_insert',
+                 'formula_search', 'proof_rendering', 'delete_recovery']
+
+    def run(self, scenarios=None):
+        """ Runs the given scenarios, returning a list of results """
+        scenarios = set(scenarios or self.SCENARIOS)
+        scenarios.update(self.SCENARIOS[:2])
+        return [measure(name, getattr(self, name)) for name in self.SCENARIOS
+                if name in scenarios]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Completes partially typed formulae (e.g. "compact + ~hau") for the
+# formula-autocomplete widgets. Property and value names are kept in prefix
+# tries in memory, so completing a keystroke only reads the properties' and
+# values' Version stamps. The tries are rebuilt (lazily) whenever those change,
+# i.e. after a Property or Value is saved or deleted by any process.
+import re
+import unicodedata
+
+from django.db.models import Count
+
+from brubeck.models import Property, Value, Version
+
+
+# Number of completions kept for each prefix
+LIMIT = 10
+
+_SEPARATOR = re.compile(r'[+|]')
+_NEGATION = re.compile(r'^(~|not\s+)', re.IGNORECASE)
+
+
+def normalize(s):
+    """ Lowercases and removes accents, so that e.g. "Cech" matches "Čech" """
+    return u''.join(c for c in unicodedata.normalize('NFD', unicode(s))
+        if unicodedata.category(c) != 'Mn').lower()
+
+
+class Trie(object):
+    """ Maps every prefix of every key to the best (lowest ranked) completions
+        starting with it, so a lookup is just a walk down the trie.
+    """
+    def __init__(self, limit=LIMIT):
+        self.limit = limit
+        self.root = {}
+
+    def add(self, key, completion, rank):
+        node = self.root
+        entry = (rank, completion)
+        for char in normalize(key):
+            node = node.setdefault(char, {})
+            best = node.setdefault(None, [])
+            if completion not in [c for r, c in best]:
+                best.append(entry)
+                best.sort()
+                del best[self.limit:]
+
+    def complete(self, prefix):
+        node = self.root
+        for char in normalize(prefix):
+            node = node.get(char)
+            if node is None:
+                return []
+        return [c for r, c in node.get(None, [])]
+
+
+_tries = {}
+
+
+def _version():
+    """ The Version stamps the tries are built from, in one query """
+    return tuple(stamp for stamp, _ in Version.stamps('property', 'value'))
+
+
+def _build(version):
+    properties = Trie()
+    # Names rank above slugs, and better known properties above others
+    for p in Property.objects.annotate(traits=Count('trait')):
+        properties.add(p.name, p.name, (0, -p.traits, p.name.lower()))
+        properties.add(p.slug, p.name, (1, -p.traits, p.name.lower()))
+    values = Trie()
+    for name in set(Value.objects.values_list('name', flat=True)):
+        values.add(name, name, (0, name.lower()))
+    _tries.update(properties=properties, values=values, version=version)
+
+
+def complete(q):
+    """ Gets completions for the last atom of the partial formula `q`. Each
+        completion is the full text of that atom, including any negation or
+        value the user has typed.
+    """
+    version = _version()
+    if _tries.get('version') != version:
+        _build(version)
+    atom = _SEPARATOR.split(q)[-1].lstrip()
+    if '=' in atom:
+        prop, value = atom.split('=', 1)
+        return [u'%s=%s' % (prop.strip(), v)
+                for v in _tries['values'].complete(value.strip())]
+    negation = _NEGATION.match(atom)
+    prefix = negation.group(0) if negation else ''
+    term = atom[len(prefix):]
+    # An exact match goes first, however rarely it is used
+    names = sorted(_tries['properties'].complete(term),
+        key=lambda p: normalize(p) != normalize(term))
+    return [prefix + p for p in names]
@@ -0,0 +1,105 @@
+# Reads and writes a compact snapshot of the whole database: the space x
+# property value matrix, the tables needed to name its rows, columns and
+# entries, and every implication. Snapshots are numpy .npz archives, so they
+# can also be opened directly with `numpy.load`.
+import os
+
+import numpy as np
+from django.conf import settings
+
+from brubeck.logic.formula.fields import FormulaField
+from brubeck.logic.formula.utils import parse_formula
+from brubeck.logic.matrix import TraitMatrix
+from brubeck.models import Space, Property, Value, Implication
+
+
+# Bump this whenever the layout of the archive changes
+FORMAT_VERSION = 1
+
+
+def export_path():
+    """ Where the downloadable snapshot is kept """
+    return getattr(settings, 'BRUBECK_EXPORT_PATH',
+        os.path.join(settings.MEDIA_ROOT, 'brubeck', 'export.npz'))
+
+
+def _strings(l):
+    return np.array(l, dtype=np.unicode_)
+
+
+class Snapshot(object):
+    """ The contents of an export, as unsaved model instances plus the
+        TraitMatrix relating them.
+    """
+    def __init__(self, spaces, properties, values, implications, matrix):
+        self.spaces = spaces
+        self.properties = properties
+        self.values = values
+        self.implications = implications
+        self.matrix = matrix
+
+    @classmethod
+    def from_database(cls):
+        # The matrix is built for exactly the spaces and properties read, so
+        # that its rows and columns line up with their names
+        spaces = list(Space.objects.order_by('id'))
+        properties = list(Property.objects.order_by('id'))
+        return cls(
+            spaces=spaces,
+            properties=properties,
+            values=list(Value.objects.order_by('id')),
+            implications=list(Implication.objects.order_by('id')),
+            matrix=TraitMatrix.from_ids([s.id for s in spaces],
+                                        [p.id for p in properties]))
+
+    def save(self, file):
+        """ Writes this snapshot to `file` (a path or file-like object) """
+        to_string = FormulaField().get_prep_value
+        np.savez_compressed(file,
+            version=np.array([FORMAT_VERSION]),
+            space_ids=self.matrix.space_ids,
+            space_names=_strings([s.name for s in self.spaces]),
+            space_slugs=_strings([s.slug for s in self.spaces]),
+            space_defined=np.array([s.fully_defined for s in self.spaces],
+                dtype=np.bool_),
+            property_ids=self.matrix.property_ids,
+            property_names=_strings([p.name for p in self.properties]),
+            property_slugs=_strings([p.slug for p in self.properties]),
+            value_ids=np.array([v.id for v in self.values], dtype=np.int32),
+            value_names=_strings([v.name for v in self.values]),
+            traits=self.matrix.values,
+            implication_ids=np.array([i.id for i in self.implications],
+                dtype=np.int32),
+            antecedents=_strings([to_string(i.antecedent)
+                for i in self.implications]),
+            consequents=_strings([to_string(i.consequent)
+                for i in self.implications]),
+            reverses=np.array([i.reverses for i in self.implications],
+                dtype=np.bool_))
+
+    @classmethod
+    def load(cls, file):
+        """ Reads a snapshot written by `save` """
+        data = np.load(file, allow_pickle=False)
+        version = int(data['version'][0])
+        if version != FORMAT_VERSION:
+            raise ValueError('Unsupported export version: %s' % version)
+        spaces = [Space(id=int(id), name=name, slug=slug,
+                        fully_defined=bool(defined))
+                  for id, name, slug, defined in zip(data['space_ids'],
+                      data['space_names'], data['space_slugs'],
+                      data['space_defined'])]
+        properties = [Property(id=int(id), name=name, slug=slug)
+                      for id, name, slug in zip(data['property_ids'],
+                          data['property_names'], data['property_slugs'])]
+        values = [Value(id=int(id), name=name)
+                  for id, name in zip(data['value_ids'], data['value_names'])]
+        implications = [Implication(id=int(id), reverses=bool(rev),
+                            antecedent=parse_formula(ant),
+                            consequent=parse_formula(cons))
+                        for id, ant, cons, rev in zip(data['implication_ids'],
+                            data['antecedents'], data['consequents'],
+                            data['reverses'])]
+        matrix = TraitMatrix(data['space_ids'], data['property_ids'],
+            data['traits'])
+        return cls(spaces, properties, values, implications, matrix)
@@ -2,7 +2,8 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 
-from brubeck.logic import Prover
+from brubeck.logic import Formula, Prover
+from brubeck.logic.closure import get_closure
 from brubeck.logic.formula.utils import human_to_formula
 from brubeck.models import Space, Property, Trait, Implication, Value
 
@@ -30,19 +31,16 @@ class EditForm(forms.Form):
         help_text='<em><a href="http://en.wikipedia.org/wiki/Markdown">'
                   'Markdown</a> syntax is supported</em>')
 
-    def _get_snippet(self, obj):
-        return obj.snippets.all()[0]
-
     def __init__(self, *args, **kwargs):
         instance = kwargs.pop('instance')
         kwargs['initial'].update({
-            'description': self._get_snippet(instance).revision.text
+            'description': instance.description
         })
         super(EditForm, self).__init__(*args, **kwargs)
         self.instance = instance
 
     def save(self, *args, **kwargs):
-        self._get_snippet(self.instance).add_revision(
+        self.instance.snippet.add_revision(
             text=self.cleaned_data['description'],
             user=self.user
         )
@@ -153,6 +151,12 @@ class SearchForm(forms.Form):
                 res['f'] = f.__unicode__(lookup=True, link=True)
                 res['f_spaces'] = Space.objects.filter(
                     id__in=Prover.spaces_matching_formula(f))
+                # Conjunctions can also be matched approximately
+                atoms = [f] if f.is_atom() else f.sub
+                if (f.is_atom() or f.operator == Formula.AND) and \
+                        all(a.is_atom() for a in atoms):
+                    res['f_literals'] = [(int(a.property), int(a.value))
+                                         for a in atoms]
         except ValidationError as e:
             res['f_errors'] = e.messages
 
@@ -169,5 +173,37 @@ class SearchForm(forms.Form):
         return res
 
 
+class ImpliesForm(forms.Form):
+    """ A form for asking whether one atom implies another """
+    p = forms.CharField(label='If',
+        widget=forms.TextInput(attrs={'class': 'formula-autocomplete'}))
+    q = forms.CharField(label='then',
+        widget=forms.TextInput(attrs={'class': 'formula-autocomplete'}))
+
+    def _clean_atom(self, name):
+        f = human_to_formula(self.cleaned_data[name])
+        if not f.is_atom():
+            raise ValidationError('Please enter a single property, like '
+                                  '"compact" or "~connected"')
+        return f
+    clean_p = lambda self: self._clean_atom('p')
+    clean_q = lambda self: self._clean_atom('q')
+
+    def chain(self):
+        """ Gets the chain of implications proving q from p, as a list of
+            (Implication, Formula) steps, or None if there isn't one
+        """
+        p, q = self.cleaned_data['p'], self.cleaned_data['q']
+        steps = get_closure().chain((int(p.property), int(p.value)),
+                                    (int(q.property), int(q.value)))
+        if steps is None:
+            return None
+        implications = Implication.objects.in_bulk([id for id, _ in steps])
+        values = Value.objects.in_bulk([v for _, (_, v) in steps])
+        properties = Property.objects.in_bulk([p for _, (p, _) in steps])
+        return [(implications[id], Formula(properties[p], values[v]))
+                for id, (p, v) in steps]
+
+
 class DeleteForm(forms.Form):
     pass
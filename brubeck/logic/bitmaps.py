@@ -0,0 +1,541 @@
+# Keeps the set of spaces with each trait (each property and value) as a
+# compressed bitmap, in the style of Roaring bitmaps: ids are grouped by their
+# high 16 bits, and the low 16 bits of each group are kept in a container,
+# either a sorted uint16 array (if there are at most ARRAY_MAX of them) or a
+# 65536 bit bitset. Formulae are evaluated with set operations on these.
+#
+# The index is kept in a single file at the BRUBECK_BITMAP_INDEX setting (it
+# is disabled if that isn't set), which every process maps into memory rather
+# than building its own copy. The file is stamped with the Version stamps of
+# the spaces and traits it was built from. Spaces and traits change the
+# bitmaps in memory as they are saved or deleted, and the changes are written
+# to the file together once the request's transaction is committed (or,
+# outside of a transaction, at the end of the outermost `batch`, e.g. once the
+# prover has finished deriving from a new trait). A file stamped differently
+# from the database (changed without signals, or by two processes at once) is
+# dropped, and the next reader rebuilds it.
+import binascii
+import fcntl
+import operator
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from brubeck.logic import idsets
+from brubeck.logic.formula.core import Formula
+from brubeck.models.core import Value
+
+
+# Containers with more ids than this are kept as bitsets
+ARRAY_MAX = 4096
+
+# The key of the bitmap of every space
+ALL = (0, 0)
+
+# The Versions the file is stamped with
+VERSIONED = ('space', 'trait')
+
+# Layout of the file: a header of HEADER int64s (including two for each of the
+# VERSIONED stamps), a table of (property, value, first container) keys, a
+# table of (high bits, offset, size, is a bitset) containers, and then the
+# containers themselves.
+MAGIC = 0x4252554245434b32
+HEADER = 8
+ARRAY, BITSET = 0, 1
+
+
+def _is_bitset(container):
+    return container.dtype == np.uint8
+
+
+def _bits(container):
+    """ A container as a bitset """
+    if _is_bitset(container):
+        return container
+    bits = np.zeros(1 << 16, dtype=np.bool_)
+    bits[container] = True
+    return np.packbits(bits)
+
+
+def _lows(container):
+    """ A container as a sorted array """
+    if _is_bitset(container):
+        return np.flatnonzero(np.unpackbits(container)).astype(np.uint16)
+    return container
+
+
+def _cardinality(container):
+    if _is_bitset(container):
+        return int(np.unpackbits(container).sum())
+    return len(container)
+
+
+def _compact(bits):
+    """ A bitset as a container, which is an array if it is small enough """
+    return bits if _cardinality(bits) > ARRAY_MAX else _lows(bits)
+
+
+def _contains(container, lows):
+    """ A boolean array marking which of the sorted `lows` are in a
+        container
+    """
+    if _is_bitset(container):
+        shifts = (7 - (lows & 7)).astype(np.uint8)
+        return (container[lows >> 3] >> shifts) & 1 == 1
+    return idsets.contains(container, lows)
+
+
+def _and(a, b):
+    if not _is_bitset(a):
+        return a[_contains(b, a)]
+    if not _is_bitset(b):
+        return b[_contains(a, b)]
+    return _compact(a & b)
+
+
+def _or(a, b):
+    if _is_bitset(a) or _is_bitset(b):
+        return _bits(a) | _bits(b)
+    union = idsets.union([a, b])
+    return union if len(union) <= ARRAY_MAX else _bits(union)
+
+
+def _sub(a, b):
+    if not _is_bitset(a):
+        return a[~_contains(b, a)]
+    return _compact(a & ~_bits(b))
+
+
+class Bitmap(object):
+    """ A set of ids, as a dict of non-empty containers keyed by the high 16
+        bits of their ids
+    """
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        ids = idsets.make(ids)
+        bounds = np.flatnonzero(np.diff(ids >> 16)) + 1
+        containers = {}
+        for group in np.split(ids, bounds) if len(ids) else []:
+            lows = (group & 0xffff).astype(np.uint16)
+            containers[int(group[0] >> 16)] = lows \
+                if len(lows) <= ARRAY_MAX else _bits(lows)
+        return cls(containers)
+
+    def ids(self):
+        """ The ids as an id set (see `brubeck.logic.idsets`) """
+        if not self.containers:
+            return idsets.make()
+        return np.concatenate([(high << 16) +
+            _lows(self.containers[high]).astype(idsets.DTYPE)
+            for high in sorted(self.containers)])
+
+    def __len__(self):
+        return sum(_cardinality(c) for c in self.containers.values())
+
+    def _combine(self, other, highs, op):
+        containers = {}
+        for high in highs:
+            a, b = self.containers.get(high), other.containers.get(high)
+            c = a if b is None else b if a is None else op(a, b)
+            if len(c):
+                containers[high] = c
+        return Bitmap(containers)
+
+    def __and__(self, other):
+        highs = set(self.containers) & set(other.containers)
+        return self._combine(other, highs, _and)
+
+    def __or__(self, other):
+        highs = set(self.containers) | set(other.containers)
+        return self._combine(other, highs, _or)
+
+    def __sub__(self, other):
+        return self._combine(other, set(self.containers), _sub)
+
+
+class BitmapIndex(object):
+    """ The bitmaps in an index file, mapped into memory. Containers are
+        read straight from the mapping, without copying them.
+    """
+    def __init__(self, path):
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        header = data[:8 * HEADER].view(np.int64)
+        if len(header) < HEADER or header[0] != MAGIC:
+            raise ValueError('%s is not a bitmap index' % path)
+        self.version = _decode(header[1:5])
+        n_keys, n_containers = int(header[5]), int(header[6])
+        start = 8 * HEADER
+        keys = data[start:start + 8 * 3 * (n_keys + 1)].view(np.int64)
+        keys = keys.reshape(-1, 3)
+        start += keys.nbytes
+        self._containers = data[start:start + 8 * 4 * n_containers].view(
+            np.int64).reshape(-1, 4)
+        self._data = data[start + self._containers.nbytes:]
+        self._keys = {}
+        self._values = defaultdict(list)  # property id -> value ids
+        for row in range(n_keys):
+            p, v, first = (int(n) for n in keys[row])
+            self._keys[p, v] = first, int(keys[row + 1, 2])
+            self._values[p].append(v)
+
+    def keys(self):
+        """ The (property id, value id) of every Bitmap """
+        return self._keys.keys()
+
+    def get(self, property_id, value_id):
+        """ The Bitmap of spaces with a trait """
+        first, stop = self._keys.get((property_id, value_id), (0, 0))
+        containers = {}
+        for high, offset, size, kind in self._containers[first:stop]:
+            raw = self._data[offset:offset + size]
+            containers[int(high)] = raw if kind == BITSET else \
+                raw.view(np.uint16)
+        return Bitmap(containers)
+
+    def spaces(self):
+        """ The Bitmap of every space """
+        return self.get(*ALL)
+
+    def values(self, property_id):
+        """ The Bitmaps of spaces with each value of a property """
+        return [self.get(property_id, v) for v in self._values[property_id]]
+
+    def bitmaps(self):
+        """ Every Bitmap, keyed by (property id, value id) """
+        return dict((key, self.get(*key)) for key in self._keys)
+
+
+def _encode(version):
+    """ The (hexadecimal) stamps of `version` as int64s for the header """
+    raw = ''.join((stamp or '').rjust(32, '0') for stamp in version)
+    return np.frombuffer(binascii.unhexlify(raw), dtype=np.int64).tolist()
+
+
+def _decode(header):
+    """ The stamps written by `_encode` """
+    raw = binascii.hexlify(np.asarray(header, dtype=np.int64).tobytes())
+    return tuple(raw[i:i + 32].lstrip('0') and raw[i:i + 32]
+                 for i in range(0, len(raw), 32))
+
+
+def _write(path, version, bitmaps):
+    """ Replaces the index file, so that processes still reading the old one
+        can carry on
+    """
+    keys, containers, chunks, offset = [], [], [], 0
+    for key in sorted(bitmaps):
+        keys.append(key + (len(containers),))
+        for high, c in sorted(bitmaps[key].containers.items()):
+            raw = np.ascontiguousarray(c).view(np.uint8)
+            containers.append((high, offset, len(raw),
+                               BITSET if _is_bitset(c) else ARRAY))
+            chunks.append(raw)
+            offset += len(raw)
+    keys.append((-1, -1, len(containers)))
+    header = [MAGIC] + [0] * (HEADER - 1)
+    header[1:5] = _encode(version)
+    header[5:7] = len(keys) - 1, len(containers)
+    parts = [np.array(header, dtype=np.int64),
+             np.array(keys, dtype=np.int64),
+             np.array(containers, dtype=np.int64).reshape(-1, 4)] + chunks
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        for part in parts:
+            f.write(part.tobytes())
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, path)
+
+
+def index_path():
+    return getattr(settings, 'BRUBECK_BITMAP_INDEX', None)
+
+
+@contextmanager
+def _lock(path):
+    """ Holds an exclusive lock on the index file while it is changed """
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _stamp(path):
+    """ Changes whenever the file is replaced """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime, stat.st_size
+
+
+def _open(path):
+    """ Opens the index file, or returns None if there isn't a valid one """
+    stamp = _stamp(path)
+    try:
+        index = BitmapIndex(path)
+    except (IOError, OSError, ValueError):
+        return None
+    index.stamp = stamp
+    return index
+
+
+def database_version():
+    """ The Version stamps of the spaces and traits, in one query """
+    from brubeck.models import Version
+
+    return tuple(stamp for stamp, _ in Version.stamps(*VERSIONED))
+
+
+def build():
+    """ The Bitmaps of every trait (and of every space) in the database """
+    from brubeck.models import Space, Trait
+
+    ids = defaultdict(list)
+    for s, p, v in Trait.objects.values_list('space_id', 'property_id',
+                                             'value_id').iterator():
+        ids[p, v].append(s)
+    bitmaps = dict((key, Bitmap.from_ids(l)) for key, l in ids.items())
+    bitmaps[ALL] = Bitmap.from_ids(Space.objects.values_list('id',
+                                                             flat=True))
+    return bitmaps
+
+
+class Changes(object):
+    """ Changes to the Bitmaps made on this thread but not yet written to the
+        file, seen over the index they were made to. `base` has the stamp of
+        each kind of data changed before the first change, and `version` the
+        stamp after the latest.
+    """
+    def __init__(self, index):
+        self.index = index
+        self.bitmaps = {}
+        self.base, self.version = {}, {}
+
+    def stamped(self, name, stamps):
+        old, new = stamps
+        self.base.setdefault(name, old)
+        self.version[name] = new
+
+    def keys(self):
+        return set(self.index.keys()) | set(self.bitmaps)
+
+    def get(self, property_id, value_id):
+        key = property_id, value_id
+        if key in self.bitmaps:
+            return self.bitmaps[key]
+        return self.index.get(*key)
+
+    def spaces(self):
+        return self.get(*ALL)
+
+    def values(self, property_id):
+        return [self.get(*key) for key in sorted(self.keys())
+                if key[0] == property_id and key != ALL]
+
+    def add(self, key, ids):
+        self.bitmaps[key] = self.get(*key) | Bitmap.from_ids(ids)
+
+    def remove(self, key, ids):
+        self.bitmaps[key] = self.get(*key) - Bitmap.from_ids(ids)
+
+
+# The index last opened by this process, keyed by its path
+_shared = {}
+
+# The Changes not yet written by this thread, whether the file has been
+# checked against the database during this request, and how deeply batches
+# are nested
+_local = threading.local()
+
+
+def get_index():
+    """ Gets the BitmapIndex (with any changes this thread hasn't yet
+        written), or None if the index is disabled. The file is checked
+        against the database once per request, and rebuilt if it doesn't
+        match. It is reopened whenever another process replaces it.
+    """
+    path = index_path()
+    if not path:
+        return None
+    changes = getattr(_local, 'changes', None)
+    if changes is not None:
+        return changes
+    index = _shared.get(path)
+    if index is not None and index.stamp != _stamp(path):
+        index = _open(path)
+    if index is None or not getattr(_local, 'checked', False):
+        version = database_version()
+        if index is None or index.version != version:
+            with _lock(path):
+                index = _open(path)
+                if index is None or index.version != version:
+                    _write(path, version, build())
+                    index = _open(path)
+        _local.checked = True
+    _shared.clear()
+    _shared[path] = index
+    return index
+
+
+def rebuild():
+    """ Rebuilds the index file from scratch """
+    invalidate()
+    return get_index()
+
+
+@contextmanager
+def batch():
+    """ Holds back writing changes to the file until the outermost batch
+        ends. Within a managed transaction, they are held until `flush` is
+        called once it has been committed.
+    """
+    _local.depth = getattr(_local, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+    if not _local.depth and not transaction.is_managed():
+        flush()
+
+
+def _changes(name, stamps):
+    """ The Changes pending on this thread, noting that the Version stamp of
+        `name` went from the first of `stamps` to the second
+    """
+    changes = get_index()
+    if not isinstance(changes, Changes):
+        changes = _local.changes = Changes(changes)
+    changes.stamped(name, stamps)
+    return changes
+
+
+def trait_saved(trait, stamps):
+    """ Notes a new or changed trait, given the traits' old and new Version
+        stamps
+    """
+    if not index_path():
+        return
+    with batch():
+        changes = _changes('trait', stamps)
+        key = trait.property_id, trait.value_id
+        for other in changes.keys():
+            if other[0] == key[0] and other not in (key, ALL):
+                changes.remove(other, [trait.space_id])
+        changes.add(key, [trait.space_id])
+
+
+def trait_deleted(trait, stamps):
+    """ Notes a deleted trait, given the traits' old and new Version stamps """
+    if not index_path():
+        return
+    with batch():
+        _changes('trait', stamps).remove((trait.property_id, trait.value_id),
+                                         [trait.space_id])
+
+
+def space_saved(space, created, stamps):
+    """ Notes a new (or changed) space, given the spaces' old and new Version
+        stamps
+    """
+    if not index_path():
+        return
+    with batch():
+        changes = _changes('space', stamps)
+        if created:
+            changes.add(ALL, [space.id])
+
+
+def space_deleted(space, stamps):
+    """ Notes a deleted space, given the spaces' old and new Version stamps.
+        Its traits are deleted (and noted) along with it.
+    """
+    if not index_path():
+        return
+    with batch():
+        _changes('space', stamps).remove(ALL, [space.id])
+
+
+def flush(**kwargs):
+    """ Writes the changes made on this thread to the file, as a signal
+        handler for the end of a request. The file is dropped instead if
+        anything else has changed the same data since it was read.
+    """
+    changes = getattr(_local, 'changes', None)
+    _local.changes = None
+    path = index_path()
+    if changes is None or not path:
+        return
+    with _lock(path):
+        index = _open(path)
+        if index is None:
+            pass  # It is built when next needed
+        elif any(index.version[VERSIONED.index(name)] != stamp
+                 for name, stamp in changes.base.items()):
+            os.remove(path)
+        else:
+            version = dict(zip(VERSIONED, index.version))
+            version.update(changes.version)
+            bitmaps = index.bitmaps()
+            bitmaps.update(changes.bitmaps)
+            _write(path, tuple(version[name] for name in VERSIONED),
+                   bitmaps)
+    _shared.clear()
+
+
+def discard(**kwargs):
+    """ Forgets the changes made on this thread, as a signal handler for
+        requests whose transaction is rolled back
+    """
+    _local.changes = None
+
+
+def request_started(**kwargs):
+    """ Has the next reader check the file against the database """
+    _local.checked = False
+
+
+def invalidate(**kwargs):
+    """ Drops the index file (and this process' copy), e.g. after traits are
+        written without signals
+    """
+    path = index_path()
+    if path:
+        with _lock(path):
+            if os.path.exists(path):
+                os.remove(path)
+    _shared.clear()
+    _local.changes = None
+
+
+def evaluate(index, formula, evaluates_to=True):
+    """ The Bitmap of spaces for which the given formula evaluates to the
+        given value, as for `brubeck.logic.utils.spaces_matching_formula`
+    """
+    if formula.is_atom():
+        p, v = formula.property, formula.value
+        if not p or not v:
+            return Bitmap()
+        p, v = int(p), int(v)
+        if evaluates_to:
+            return index.get(p, v)
+        elif evaluates_to is None:
+            return index.spaces() - reduce(operator.or_, index.values(p),
+                                           Bitmap())
+        return index.get(p, Value.NOT[v])
+    subs = [evaluate(index, sf, evaluates_to) for sf in formula.sub]
+    # An &'d formula is True if every subformula is, and an |'d formula is
+    # False (or unknown) if every subformula is
+    if (formula.operator == Formula.AND) == bool(evaluates_to):
+        return reduce(operator.and_, subs)
+    return reduce(operator.or_, subs)
@@ -0,0 +1,152 @@
+# Answers "does P imply Q?" for atoms, from the implications simple enough to
+# chain by hand: those whose antecedent is an atom (or a disjunction of atoms)
+# and whose consequent is an atom (or a conjunction of atoms). Each of these
+# amounts to a set of literal -> literal rules, along with their
+# contrapositives. The transitive closure of the rules is kept as a bit
+# matrix, with a row for each literal marking every literal it implies. New
+# implications are added by OR-ing rows together rather than rebuilding.
+from collections import defaultdict, deque
+
+import numpy as np
+
+from brubeck.logic.formula.core import Formula
+from brubeck.logic.saturation import implications_version
+from brubeck.models.core import Value
+
+
+def _atoms(formula, operator):
+    """ The (property id, value id) literals of an atom or of an `operator`
+        of atoms, or None if the formula is anything else
+    """
+    subs = [formula] if formula.is_atom() else formula.sub
+    if not formula.is_atom() and formula.operator != operator or \
+            not all(sf.is_atom() for sf in subs):
+        return None
+    return [(int(sf.property), int(sf.value)) for sf in subs]
+
+
+def rules(implication):
+    """ The literal -> literal rules equivalent to `implication`, including
+        contrapositives, or [] if it has none
+    """
+    sources = _atoms(implication.antecedent, Formula.OR)
+    targets = _atoms(implication.consequent, Formula.AND)
+    if not (sources and targets):
+        return []
+    found = [(a, c) for a in sources for c in targets]
+    return found + [((c[0], Value.NOT[c[1]]), (a[0], Value.NOT[a[1]]))
+                    for a, c in found
+                    if a[1] in Value.NOT and c[1] in Value.NOT]
+
+
+class Closure(object):
+    """ The transitive closure of the rules of a set of implications. Row i of
+        `reach` is a packed bitset of the literals implied by literal i (which
+        include literal i itself).
+    """
+    def __init__(self, implications=()):
+        self.literals = []
+        self.index = {}  # literal -> row
+        self.edges = defaultdict(dict)  # row -> {row: implication id}
+        self.reach = np.zeros((0, 0), dtype=np.uint8)
+        for i in implications:
+            self.add(i)
+
+    def _bit(self, j):
+        return j >> 3, np.uint8(0x80 >> (j & 7))
+
+    def _row(self, literal):
+        """ Gets the row for `literal`, adding one if needed """
+        if literal not in self.index:
+            n = self.index[literal] = len(self.literals)
+            self.literals.append(literal)
+            if n == len(self.reach):
+                # Grow by doubling, so adding literals is cheap on average
+                size = max(16, 2 * n)
+                reach = np.zeros((size, size // 8), dtype=np.uint8)
+                reach[:n, :self.reach.shape[1]] = self.reach
+                self.reach = reach
+            byte, mask = self._bit(n)
+            self.reach[n, byte] |= mask
+        return self.index[literal]
+
+    def add(self, implication):
+        """ Adds the rules of an implication """
+        for a, c in rules(implication):
+            u, v = self._row(a), self._row(c)
+            self.edges[u].setdefault(v, implication.id)
+            # Everything implying a now implies everything c does
+            byte, mask = self._bit(u)
+            rows = np.flatnonzero(self.reach[:, byte] & mask)
+            self.reach[rows] |= self.reach[v]
+
+    def implies(self, p, q):
+        """ Whether literal `p` implies literal `q` """
+        if p not in self.index or q not in self.index:
+            return p == q
+        byte, mask = self._bit(self.index[q])
+        return bool(self.reach[self.index[p], byte] & mask)
+
+    def consequences(self, p):
+        """ The literals implied by literal `p`, other than itself """
+        if p not in self.index:
+            return []
+        bits = np.unpackbits(self.reach[self.index[p]])[:len(self.literals)]
+        return [self.literals[j] for j in np.flatnonzero(bits)
+                if self.literals[j] != p]
+
+    def chain(self, p, q):
+        """ A shortest chain of rules from literal `p` to literal `q`, as a
+            list of (implication id, literal) steps, or None if there is none
+        """
+        if not self.implies(p, q):
+            return None
+        start, end = self.index.get(p), self.index.get(q)
+        previous = {start: None}
+        queue = deque([start])
+        while end not in previous:
+            u = queue.popleft()
+            for v in self.edges[u]:
+                if v not in previous:
+                    previous[v] = u
+                    queue.append(v)
+        steps = []
+        while previous[end] is not None:
+            u = previous[end]
+            steps.append((self.edges[u][end], self.literals[end]))
+            end = u
+        return steps[::-1]
+
+
+# The Closure of every saved implication, kept up to date as implications are
+# added (see `implication_saved`) and rebuilt after anything else changes
+_shared = {}
+
+
+def get_closure():
+    """ Gets the Closure of all saved implications """
+    from brubeck.models import Implication
+
+    version = implications_version()
+    if 'closure' not in _shared or _shared['version'] != version:
+        _shared['closure'] = Closure(Implication.objects.all())
+        _shared['version'] = version
+    return _shared['closure']
+
+
+def implication_saved(instance, created, old, new):
+    """ Adds a new implication to the shared Closure, given the Version stamps
+        of the implications from before and after it was saved. The Closure is
+        dropped instead if an implication was edited or deleted, or if it
+        was out of date anyway.
+    """
+    if created and 'closure' in _shared and _shared['version'] == old:
+        _shared['closure'].add(instance)
+        _shared['version'] = new
+    else:
+        _shared.clear()
+
+
+def invalidate(**kwargs):
+    """ Signal handler dropping the shared Closure """
+    _shared.clear()
@@ -0,0 +1,60 @@
+# Set algebra on sets of ids, each kept as a sorted NumPy array of distinct
+# int32s. Intersections look up each id of the smallest set in the others by
+# binary search, so they cost little when one set is much smaller than the
+# rest. Unions merge the (already sorted) runs and drop repeats. Every result
+# is again sorted and free of duplicates.
+import numpy as np
+
+
+DTYPE = np.int32
+
+
+def make(ids=()):
+    """ Builds a set from any iterable of ids """
+    ids = np.fromiter(ids, dtype=DTYPE) if not isinstance(ids, np.ndarray) \
+        else ids.astype(DTYPE, copy=False)
+    return _distinct(np.sort(ids, kind='mergesort'))
+
+
+def _distinct(ids):
+    """ Drops the repeats from a sorted array """
+    if len(ids) < 2:
+        return ids
+    keep = np.empty(len(ids), dtype=np.bool_)
+    keep[0] = True
+    np.not_equal(ids[1:], ids[:-1], out=keep[1:])
+    return ids if keep.all() else ids[keep]
+
+
+def contains(s, ids):
+    """ A boolean array marking which of the sorted `ids` are in `s` """
+    at = np.searchsorted(s, ids)
+    found = np.zeros(len(ids), dtype=np.bool_)
+    inside = at < len(s)
+    found[inside] = s[at[inside]] == ids[inside]
+    return found
+
+
+def intersection(sets):
+    """ The ids in every one of `sets` (there must be at least one) """
+    sets = sorted(sets, key=len)
+    result = sets[0]
+    for s in sets[1:]:
+        if not len(result):
+            break
+        result = result[contains(s, result)]
+    return result
+
+
+def union(sets):
+    """ The ids in any of `sets` """
+    sets = [s for s in sets if len(s)]
+    if len(sets) < 2:
+        return sets[0] if sets else make()
+    # A stable sort finds the sorted runs, so merging them is cheap
+    return _distinct(np.sort(np.concatenate(sets), kind='mergesort'))
+
+
+def difference(a, b):
+    """ The ids in `a` but not in `b` """
+    return a[~contains(b, a)] if len(a) and len(b) else a
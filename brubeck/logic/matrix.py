@@ -0,0 +1,122 @@
+# Provides a dense, in-memory view of the Trait table for code that needs to
+# reason about every space at once (exports, audits, comparisons ...)
+import numpy as np
+
+from brubeck.logic.formula.core import Formula
+from brubeck.models import Space, Property, Trait, Value
+
+
+# Marks an unknown trait in the matrix. Value ids start at 1.
+UNKNOWN = 0
+
+# Marks an atomic subformula in a compiled formula (see `compile`)
+ATOM = '='
+
+
+def evaluate(compiled, values):
+    """ Evaluates a compiled formula against every row of `values` at once.
+        Returns a pair of boolean arrays, marking the rows where the formula
+        is known to hold and known to fail. This matches
+        `brubeck.logic.utils.spaces_matching_formula`.
+    """
+    if compiled[0] == ATOM:
+        _, column, value = compiled
+        if column is None:
+            unknown = np.zeros(len(values), dtype=np.bool_)
+            return unknown, unknown
+        column = values[:, column]
+        holds = column == value
+        if value in Value.NOT:
+            fails = column == Value.NOT[value]
+        else:
+            fails = (column != UNKNOWN) & ~holds
+        return holds, fails
+    operator, subs = compiled
+    results = [evaluate(sub, values) for sub in subs]
+    holds = np.array([h for h, f in results])
+    fails = np.array([f for h, f in results])
+    if operator == Formula.AND:
+        return holds.all(axis=0), fails.any(axis=0)
+    return holds.any(axis=0), fails.all(axis=0)
+
+
+class TraitMatrix(object):
+    """ A (space x property) array of Value ids, with UNKNOWN wherever a Space
+        has no Trait for a Property. Rows and columns are ordered by id.
+    """
+    def __init__(self, space_ids, property_ids, values):
+        self.space_ids = np.asarray(space_ids, dtype=np.int32)
+        self.property_ids = np.asarray(property_ids, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.int16).reshape(
+            len(self.space_ids), len(self.property_ids))
+
+    @classmethod
+    def from_database(cls, spaces=None):
+        """ Loads the matrix in three queries. `spaces` optionally restricts
+            the rows to a queryset of Spaces.
+        """
+        if spaces is None:
+            spaces = Space.objects.all()
+        space_ids = np.fromiter(spaces.order_by('id').values_list('id',
+            flat=True), dtype=np.int32)
+        property_ids = np.fromiter(Property.objects.order_by('id')
+            .values_list('id', flat=True), dtype=np.int32)
+        return cls.from_ids(space_ids, property_ids,
+                            Trait.objects.filter(space__in=spaces))
+
+    @classmethod
+    def from_ids(cls, space_ids, property_ids, traits=None):
+        """ Loads the matrix for the given (sorted) Space and Property ids in
+            one query, from the `traits` queryset (by default every Trait).
+            Traits of any other spaces or properties, such as ones added since
+            the ids were read, are left out.
+        """
+        if traits is None:
+            traits = Trait.objects.all()
+        space_ids = np.asarray(space_ids, dtype=np.int32)
+        property_ids = np.asarray(property_ids, dtype=np.int32)
+        traits = np.array(list(traits.values_list('space_id', 'property_id',
+            'value_id')), dtype=np.int32).reshape(-1, 3)
+        traits = traits[np.in1d(traits[:, 0], space_ids) &
+                        np.in1d(traits[:, 1], property_ids)]
+
+        values = np.zeros((len(space_ids), len(property_ids)), dtype=np.int16)
+        values[np.searchsorted(space_ids, traits[:, 0]),
+               np.searchsorted(property_ids, traits[:, 1])] = traits[:, 2]
+        return cls(space_ids, property_ids, values)
+
+    def _index(self, ids, id):
+        i = np.searchsorted(ids, id)
+        if i == len(ids) or ids[i] != id:
+            raise KeyError(id)
+        return i
+
+    def space_index(self, space_id):
+        """ Gets the row holding the given Space's traits """
+        return self._index(self.space_ids, space_id)
+
+    def property_index(self, property_id):
+        """ Gets the column holding the given Property's traits """
+        return self._index(self.property_ids, property_id)
+
+    def compile(self, formula):
+        """ Converts a Formula into nested tuples of column indices, which
+            `evaluate` can use (and which can be pickled, unlike Formulae).
+            Atoms on properties outside the matrix are always unknown.
+        """
+        if formula.is_atom():
+            try:
+                column = self.property_index(int(formula.property))
+            except KeyError:
+                column = None
+            return (ATOM, column, int(formula.value))
+        return (formula.operator, [self.compile(sf) for sf in formula.sub])
+
+    def evaluate(self, formula):
+        """ Finds where `formula` holds and fails; see `evaluate` """
+        return evaluate(self.compile(formula), self.values)
+
+    def get(self, space_id, property_id):
+        """ Gets the Value id for a single trait (or UNKNOWN) """
+        return int(self.values[self.space_index(space_id),
+                               self.property_index(property_id)])
@@ -0,0 +1,331 @@
+# Matches implications against every space through a network of shared
+# conditions, in the style of a Rete network. Each distinct condition in the
+# antecedents and consequents is a node, built only once. Conjunctions and
+# disjunctions are built up one condition at a time, most common conditions
+# first, so implications that share some of their conditions share the nodes
+# for those too (A & B & C and A & B & D both use the node for A & B).
+#
+# A Memory holds whether each node is known to hold or fail for each space.
+# It is evaluated for every space at once, and afterwards each new trait only
+# updates the nodes above its atom, and only for its own space. One Memory of
+# every saved implication is shared by the signal handlers, which update it as
+# traits and spaces are saved and deleted, and match each new trait through it
+# before propagating (see `get_memory`).
+import heapq
+from collections import defaultdict
+
+import numpy as np
+
+from brubeck.logic.formula.core import Formula
+from brubeck.logic.matrix import ATOM, UNKNOWN, TraitMatrix, evaluate
+
+
+def _key(formula):
+    """ A hashable (and sortable) description of a condition """
+    if formula.is_atom():
+        return (ATOM, int(formula.property), int(formula.value))
+    return (formula.operator, tuple(sorted(set(_key(sf)
+                                               for sf in formula.sub))))
+
+
+def _properties(key):
+    """ The ids of the properties a condition mentions """
+    if key[0] == ATOM:
+        return set([key[1]])
+    return set().union(*[_properties(sub) for sub in key[1]])
+
+
+class Network(object):
+    """ The nodes for the conditions of a set of implications. Each node is
+        either an atom (ATOM, property id, value id) or a join
+        (operator, left node, right node), and comes after its children.
+    """
+    def __init__(self, implications):
+        self.implications = implications = list(implications)
+        self.nodes = []
+        self.parents = []
+        self.index = {}  # key -> node
+        self.atoms = defaultdict(list)  # property id -> atom nodes
+
+        # How often each condition appears within a larger one
+        self.frequency = defaultdict(int)
+        for i in implications:
+            for f in (i.antecedent, i.consequent):
+                self._count(_key(f))
+
+        # (implication id, antecedent node, consequent node)
+        self.productions = []
+        self.watching = defaultdict(list)  # node -> production indices
+        mentions = defaultdict(list)  # property id -> production indices
+        for i in implications:
+            keys = _key(i.antecedent), _key(i.consequent)
+            a, c = self._build(keys[0]), self._build(keys[1])
+            self.watching[a].append(len(self.productions))
+            self.watching[c].append(len(self.productions))
+            for p in _properties(keys[0]) | _properties(keys[1]):
+                mentions[p].append(len(self.productions))
+            self.productions.append((i.id, a, c))
+        self.mentions = dict((p, np.array(l)) for p, l in mentions.items())
+        self.antecedents = np.array([a for id, a, c in self.productions],
+                                    dtype=np.intp)
+        self.consequents = np.array([c for id, a, c in self.productions],
+                                    dtype=np.intp)
+
+    def _count(self, key):
+        if key[0] != ATOM:
+            for sub in key[1]:
+                self.frequency[sub] += 1
+                self._count(sub)
+
+    def _node(self, key):
+        """ Gets the node for `key`, adding it if needed """
+        if key not in self.index:
+            self.index[key] = node = len(self.nodes)
+            self.nodes.append(key)
+            self.parents.append([])
+            if key[0] == ATOM:
+                self.atoms[key[1]].append(node)
+            else:
+                self.parents[key[1]].append(node)
+                self.parents[key[2]].append(node)
+        return self.index[key]
+
+    def _build(self, key):
+        """ Gets the node for a condition, joining the nodes for its parts
+            left to right from the most common
+        """
+        if key[0] == ATOM:
+            return self._node(key)
+        subs = sorted(key[1], key=lambda k: (-self.frequency[k], k))
+        node = self._build(subs[0])
+        for sub in subs[1:]:
+            node = self._node((key[0], node, self._build(sub)))
+        return node
+
+    def match(self, matrix):
+        """ Evaluates every node against a TraitMatrix """
+        return Memory(self, matrix)
+
+
+class Memory(object):
+    """ The state of every node of a Network for every space (row) of a
+        TraitMatrix, as arrays of shape (nodes, spaces). The matrix is
+        updated along with the memory.
+    """
+    def __init__(self, network, matrix):
+        self.network = network
+        self.matrix = matrix
+        shape = (len(network.nodes), len(matrix.space_ids))
+        self.holds = np.zeros(shape, dtype=np.bool_)
+        self.fails = np.zeros(shape, dtype=np.bool_)
+        for node in range(len(network.nodes)):
+            self._evaluate(node, slice(None))
+
+    def _evaluate(self, node, rows):
+        """ Recomputes a node for a slice of rows from its children, returning
+            whether anything changed
+        """
+        key = self.network.nodes[node]
+        if key[0] == ATOM:
+            try:
+                column = self.matrix.property_index(key[1])
+            except KeyError:
+                column = None
+            holds, fails = evaluate((ATOM, column, key[2]),
+                                    self.matrix.values[rows])
+        elif key[0] == Formula.AND:
+            holds = self.holds[key[1], rows] & self.holds[key[2], rows]
+            fails = self.fails[key[1], rows] | self.fails[key[2], rows]
+        else:
+            holds = self.holds[key[1], rows] | self.holds[key[2], rows]
+            fails = self.fails[key[1], rows] & self.fails[key[2], rows]
+        changed = np.any(self.holds[node, rows] != holds) or \
+            np.any(self.fails[node, rows] != fails)
+        self.holds[node, rows], self.fails[node, rows] = holds, fails
+        return changed
+
+    def row(self, space_id):
+        """ Gets the row of a space, raising a KeyError if it has none """
+        return self.matrix.space_index(int(space_id))
+
+    def add_space(self, space_id):
+        """ Adds a row for a new space. It has no traits, so no node is known
+            to hold or fail for it.
+        """
+        matrix = self.matrix
+        row = np.searchsorted(matrix.space_ids, space_id)
+        matrix.space_ids = np.insert(matrix.space_ids, row, space_id)
+        matrix.values = np.insert(matrix.values, row, UNKNOWN, axis=0)
+        self.holds = np.insert(self.holds, row, False, axis=1)
+        self.fails = np.insert(self.fails, row, False, axis=1)
+
+    def remove_space(self, space_id):
+        """ Removes the row of a deleted space """
+        matrix = self.matrix
+        row = self.row(space_id)
+        matrix.space_ids = np.delete(matrix.space_ids, row)
+        matrix.values = np.delete(matrix.values, row, axis=0)
+        self.holds = np.delete(self.holds, row, axis=1)
+        self.fails = np.delete(self.fails, row, axis=1)
+
+    def active(self, row, production):
+        """ Whether a production could prove something new for a space: its
+            antecedent holds and consequent is unknown, or (for the
+            contrapositive) the other way round
+        """
+        id, a, c = self.network.productions[production]
+        holds, fails = self.holds[:, row], self.fails[:, row]
+        unknown = lambda n: not (holds[n] or fails[n])
+        return bool(holds[a] and unknown(c) or fails[c] and unknown(a))
+
+    def activations(self):
+        """ All (row, production) pairs that are active """
+        holds, fails = self.holds, self.fails
+        found = []
+        for production, (id, a, c) in enumerate(self.network.productions):
+            unknown_a = ~(holds[a] | fails[a])
+            unknown_c = ~(holds[c] | fails[c])
+            rows = np.flatnonzero(holds[a] & unknown_c | fails[c] & unknown_a)
+            found.extend((int(row), production) for row in rows)
+        return sorted(found)
+
+    def could_prove(self, row, property_id):
+        """ Whether any production mentioning a property might prove
+            something for the space in `row`: its antecedent holds and its
+            consequent doesn't, or the other way round for the contrapositive.
+            Whenever a clause of the implication becomes unit (see
+            `brubeck.logic.saturation`), this is the case.
+        """
+        productions = self.network.mentions.get(int(property_id))
+        if productions is None:
+            return False
+        holds, fails = self.holds[:, row], self.fails[:, row]
+        a = self.network.antecedents[productions]
+        c = self.network.consequents[productions]
+        return bool(np.any(holds[a] & ~holds[c] | fails[c] & ~fails[a]))
+
+    def assign(self, row, property_id, value_id):
+        """ Records a new trait (or with UNKNOWN, a deleted one) for the space
+            in `row`, updating the nodes above its atoms. Returns the
+            productions that became active.
+        """
+        property_id = int(property_id)
+        try:
+            column = self.matrix.property_index(property_id)
+        except KeyError:
+            return []  # A new property, which no implication mentions yet
+        self.matrix.values[row, column] = int(value_id)
+        dirty = list(self.network.atoms[property_id])
+        heapq.heapify(dirty)
+        seen, changed = set(dirty), set()
+        # Nodes come after their children, so this visits each node once
+        while dirty:
+            node = heapq.heappop(dirty)
+            if not self._evaluate(node, slice(row, row + 1)):
+                continue
+            changed.add(node)
+            for parent in self.network.parents[node]:
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(dirty, parent)
+        return sorted(set(p for node in changed
+                          for p in self.network.watching.get(node, ())
+                          if self.active(row, p)))
+
+
+
+# The Memory of every saved implication (apart from those known to be
+# redundant) for every space, shared by the signal handlers. Its `version`
+# has the Version stamps it matches, which are moved on as traits and spaces
+# saved by this process are recorded in it. It is dropped when it misses a
+# change, and rebuilt when next needed.
+_shared = {}
+
+VERSIONED = ('implication', 'space', 'trait')
+
+
+def database_version():
+    """ The Version stamps the Memory depends on, in one query """
+    from brubeck.models import Version
+
+    return dict((name, stamp) for name, (stamp, _) in
+                zip(VERSIONED, Version.stamps(*VERSIONED)))
+
+
+def get_memory():
+    """ Gets the shared Memory, rebuilding it if anything has changed that
+        it hasn't recorded
+    """
+    from brubeck.models import Implication
+
+    version = database_version()
+    memory = _shared.get('memory')
+    if memory is None or memory.version != version:
+        network = Network(Implication.objects.filter(redundant=False))
+        memory = network.match(TraitMatrix.from_database())
+        memory.version = version
+        _shared['memory'] = memory
+    return memory
+
+
+def _updating(name, stamps):
+    """ The shared Memory, if it is current apart from the change that moved
+        the Version stamp of `name` from the first of `stamps` to the second.
+        It is dropped (and None returned) if not.
+    """
+    memory = _shared.get('memory')
+    if memory is None:
+        return None
+    old, new = stamps
+    if memory.version[name] != old:
+        _shared.clear()
+        return None
+    memory.version[name] = new
+    return memory
+
+
+def trait_saved(trait, stamps):
+    """ Records a new or changed trait, given the traits' old and new Version
+        stamps
+    """
+    memory = _updating('trait', stamps)
+    if memory is not None:
+        try:
+            memory.assign(memory.row(trait.space_id), trait.property_id,
+                          trait.value_id)
+        except KeyError:
+            _shared.clear()  # A space it hasn't seen
+
+
+def trait_deleted(trait, stamps):
+    """ Records a deleted trait, given the traits' old and new Version
+        stamps
+    """
+    memory = _updating('trait', stamps)
+    if memory is not None:
+        try:
+            memory.assign(memory.row(trait.space_id), trait.property_id,
+                          UNKNOWN)
+        except KeyError:
+            _shared.clear()
+
+
+def space_saved(space, created, stamps):
+    """ Records a new (or changed) space, given the spaces' old and new
+        Version stamps
+    """
+    memory = _updating('space', stamps)
+    if memory is not None and created:
+        memory.add_space(space.id)
+
+
+def space_deleted(space, stamps):
+    """ Records a deleted space, given the spaces' old and new Version
+        stamps. Its traits are deleted (and recorded) along with it.
+    """
+    memory = _updating('space', stamps)
+    if memory is not None:
+        try:
+            memory.remove_space(space.id)
+        except KeyError:
+            _shared.clear()
@@ -0,0 +1,173 @@
+# Records where the prover spends its time. Work done inside a `Recorder`
+# (started explicitly from scripts, by the ProverProfileMiddleware, or for
+# each trait or implication save when BRUBECK_PROFILE_PROVER is set) is
+# broken down into phases - one per instrumented function - with call counts,
+# elapsed time and SQL query counts for each.
+#
+#     with Recorder('import') as stats:
+#         ...
+#     print stats.summary()
+#
+# Instrumented functions cost a single thread-local lookup when nothing is
+# being recorded.
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def current():
+    """ Gets the Stats being recorded on this thread, if any """
+    return getattr(_local, 'stats', None)
+
+
+def enabled():
+    """ Whether every save should be recorded """
+    return getattr(settings, 'BRUBECK_PROFILE_PROVER', False)
+
+
+class _Off(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def recording(name):
+    """ A Recorder for `name` if something is already being recorded or
+        profiling is enabled, and otherwise a context that does nothing
+    """
+    return Recorder(name) if current() or enabled() else _Off()
+
+
+class Stats(object):
+    """ Totals for one top-level operation. `phases` maps each phase name to
+        [calls, seconds, queries]. Time and queries are only counted for the
+        outermost call of a phase, so recursion isn't counted twice.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self.derived = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self._depth = {}
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'seconds': round(self.seconds, 6),
+            'queries': self.queries,
+            'derived': self.derived,
+            'phases': dict((name, {'calls': c, 'seconds': round(s, 6),
+                                   'queries': q})
+                           for name, (c, s, q) in self.phases.items())
+        }
+
+    def summary(self):
+        """ A one line description, with the most expensive phases first """
+        phases = sorted(self.phases.items(), key=lambda p: -p[1][1])
+        return '%s: %.3fs, %s queries, %s derived [%s]' % (self.name,
+            self.seconds, self.queries, self.derived, ', '.join(
+                '%s x%s %.3fs %sq' % (name, c, s, q)
+                for name, (c, s, q) in phases))
+
+
+class Recorder(object):
+    """ Records prover activity until stopped. A Recorder started while
+        another is active on the same thread is counted as a phase of the
+        outer one.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.stats = None
+        self.phase = None
+
+    def start(self):
+        if current():
+            self.phase = Phase(self.name)
+            self.phase.start()
+            return current()
+        self.stats = _local.stats = Stats(self.name)
+        # Count queries even when DEBUG is off, discarding them afterwards
+        self._debug = connection.use_debug_cursor
+        self._keep = self._debug or (self._debug is None and settings.DEBUG)
+        connection.use_debug_cursor = True
+        self._queries = len(connection.queries)
+        self._start = time.time()
+        return self.stats
+
+    def stop(self):
+        if self.phase:
+            self.phase.stop()
+            return
+        stats = self.stats
+        try:
+            stats.seconds = time.time() - self._start
+            stats.queries = len(connection.queries) - self._queries
+            if not self._keep:
+                del connection.queries[self._queries:]
+        finally:
+            connection.use_debug_cursor = self._debug
+            _local.stats = None
+        logger.debug(stats.summary())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class Phase(object):
+    """ Adds the time and queries between `start` and `stop` to the named
+        phase of the current Stats
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def start(self):
+        stats = self.stats = current()
+        self.entry = stats.phases.setdefault(self.name, [0, 0.0, 0])
+        self.entry[0] += 1
+        self.depth = stats._depth.get(self.name, 0)
+        stats._depth[self.name] = self.depth + 1
+        self._queries = len(connection.queries)
+        self._start = time.time()
+
+    def stop(self):
+        if not self.depth:
+            self.entry[1] += time.time() - self._start
+            self.entry[2] += len(connection.queries) - self._queries
+        self.stats._depth[self.name] = self.depth
+
+
+def instrumented(func):
+    """ Records each call of `func` as a phase, named after the function """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if current() is None:
+            return func(*args, **kwargs)
+        phase = Phase(func.__name__)
+        phase.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            phase.stop()
+    return wrapper
+
+
+def count_derived(n=1):
+    """ Notes that the prover has added `n` new traits """
+    stats = current()
+    if stats:
+        stats.derived += n
@@ -5,6 +5,8 @@ from django.contrib.auth.models import User
 from django.utils.safestring import mark_safe
 
 from brubeck.logic import Formula, utils
+from brubeck.logic.profiling import count_derived, instrumented
+from brubeck.logic.saturation import Contradiction, get_saturation
 from brubeck.models.snippets import Snippet
 
 
@@ -29,6 +31,7 @@ class BaseProver(object):
         self.agent = agent
 
     # Text / html rendering methods
+    @instrumented
     def _render(self, proof, html, space=True):
         """ Renders a proof string (as generated by this prover). If `html`
             is True, the output should include links to any other assumptions
@@ -40,7 +43,8 @@ class BaseProver(object):
         for s in proof.split(',')[:-1]:
             type, id = s[0], s[1:]
             if type == 't':
-                obj = Trait.objects.get(id=id)
+                obj = Trait.objects.select_related('space', 'property',
+                    'value').get(id=id)
                 name = obj.__unicode__(space=space)
             else:  # type == 'i'
                 obj = Implication.objects.get(id=id)
@@ -133,6 +137,7 @@ class BaseProver(object):
         return Snippet.objects.filter(proof_agent=self.agent)
 
     # Creation methods
+    @instrumented
     def _force_match(self, formula, space, proof_steps):
         """ Forces the given Space to match the formula by adding Traits as
             needed.
@@ -173,6 +178,7 @@ class BaseProver(object):
                 raise AssertionError(u'Tried to force OR statement with '
                                      u'no unknowns (%s)' % formula)
 
+    @instrumented
     def _add_proof(self, space, property_id, value_id, proof_steps):
         """ A proof is simply a series of Traits or Implications formatted as:
             t<id>,t<id>,i<id>,t<id>,t<id>,...
@@ -185,12 +191,22 @@ class BaseProver(object):
                 proof_string += 't%s,' % s.id
             else:  # s is an Implication
                 proof_string += 'i%s,' % s.id
+        self._add_trait(space, property_id, value_id, proof_string)
+
+    @instrumented
+    def _add_trait(self, space, property_id, value_id, proof_string):
+        """ Saves a new Trait, with `proof_string` as its proof """
+        from brubeck.models import Trait
+
         t = Trait(space=space)
         t.property_id, t.value_id = property_id, value_id
         t.save()
         self._add_snippet(object=t, text=proof_string)
+        count_derived()
         logger.debug('Added trait "%s" with proof "%s"' % (t, proof_string))
+        return t
 
+    @instrumented
     def _add_snippet(self, object, text):
         """ Adds a new snippet for the given `object`, setting `text` as its
             initial revision. Also sets proof_agent and user metadata.
@@ -212,6 +228,7 @@ class BaseProver(object):
         brubeck, _ = User.objects.get_or_create(username='brubeck')
         snippet.add_revision(text=text, user=brubeck)
 
+    @instrumented
     def apply(self, implication, space):
         # Try applying the forward directions
         try:
@@ -232,6 +249,49 @@ class BaseProver(object):
         except AssertionError as e:
             pass
 
+    @instrumented
+    def propagate(self, space, property_ids):
+        """ Adds every trait that follows from the traits of `space` for
+            `property_ids`, assuming that everything following from its other
+            traits is already known. Only the clauses watching the literals
+            the new traits make false are looked at (see
+            `brubeck.logic.saturation`). Returns the new Traits.
+        """
+        values, ids = {}, {}
+        for p, v, id in space.trait_set.values_list('property_id', 'value_id',
+                                                    'id'):
+            values[p], ids[p] = v, id
+        derived = get_saturation().propagate(space.id, values, property_ids,
+                                             strict=False)
+        added = []
+        for p, steps in derived:
+            t = self._add_trait(space, p, values[p], ''.join(
+                '%s%s,' % (kind, ids[id] if kind == 't' else id)
+                for kind, id in steps))
+            ids[p] = t.id
+            added.append(t)
+        return added
+
+    @instrumented
+    def hypothesize(self, assumptions):
+        """ Works out what follows from `assumptions` (a dict of property id
+            to value id) for a space with exactly those traits, in memory and
+            without touching the database. Returns a list of (property id,
+            value id, proof steps) for each derived trait, where the steps are
+            ('t', property id) and ('i', implication id) pairs.
+
+            Raises a Contradiction (see `brubeck.logic.saturation`) if the
+            assumptions are inconsistent with the implications. Its `derived`
+            holds what was derived before the contradiction.
+        """
+        values = dict((int(p), int(v)) for p, v in assumptions.items())
+        try:
+            derived = get_saturation().saturate(values)
+        except Contradiction as e:
+            e.derived = [(p, values[p], steps) for p, steps in e.derived]
+            raise
+        return [(p, values[p], steps) for p, steps in derived]
+
     def _add_proofs(self):
         """ Searches the entire database for new proofs """
         # TODO: this is (currently) only used post-delete. Is there any way to
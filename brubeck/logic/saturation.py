@@ -0,0 +1,298 @@
+# Derives everything that follows from a set of traits, in memory. Each
+# implication (A => B) is converted into clauses (~A | B in conjunctive normal
+# form), and traits are propagated through them with two watched literals, as
+# a SAT solver does. An Assignment holds the values of a space and, for each
+# clause not yet satisfied, two of its literals that are not false, with a
+# watch list of the clauses watching each literal. When a literal becomes
+# false only the clauses on its watch list are visited: each either moves the
+# watch to another literal that isn't false or, with a single literal left,
+# proves that literal, with the other (false) literals and the implication as
+# its proof - the same proofs the Prover writes. Values are only ever added to
+# an Assignment, so the Saturation keeps those of the last spaces it
+# propagated between calls (see `Saturation.propagate`).
+from collections import defaultdict, OrderedDict
+
+from brubeck.models.core import Value
+
+
+class Contradiction(Exception):
+    """ Raised when the implications prove a property to have two values """
+    def __init__(self, property_id, steps):
+        self.property_id = property_id
+        self.steps = steps
+        self.derived = []
+        super(Contradiction, self).__init__(
+            'Contradiction proving property %s' % property_id)
+
+
+def _normal_form(formula, operator):
+    """ Converts a Formula to a list of lists of literals (a (property id,
+        value id) pair). With `operator` AND this is conjunctive normal form:
+        the formula holds exactly when every list has a true literal. With OR
+        it is disjunctive normal form: the formula holds exactly when every
+        literal of some list is true.
+    """
+    if formula.is_atom():
+        return [[(int(formula.property), int(formula.value))]]
+    subs = [_normal_form(sf, operator) for sf in formula.sub]
+    if formula.operator == operator:
+        return sum(subs, [])
+    terms = [[]]
+    for sub in subs:
+        terms = [t + u for t in terms for u in sub]
+    return terms
+
+
+def _cnf(formula):
+    return _normal_form(formula, formula.AND)
+
+
+def _dnf(formula):
+    return _normal_form(formula, formula.OR)
+
+
+def holds(formula, values):
+    """ Whether `formula` is known to hold given `values` (a dict of property
+        id to value id)
+    """
+    if formula.is_atom():
+        return values.get(int(formula.property)) == int(formula.value)
+    if formula.operator == formula.AND:
+        return all(holds(sf, values) for sf in formula.sub)
+    return any(holds(sf, values) for sf in formula.sub)
+
+
+class Assignment(object):
+    """ The values of one space (a dict of property id to value id), and the
+        literals watched by the clauses that aren't satisfied yet
+    """
+    def __init__(self, values):
+        self.values = values
+        self.watched = {}                  # clause index -> its two watches
+        self.watching = defaultdict(list)  # literal -> clause indices
+
+
+class Saturation(object):
+    """ The clauses of a set of implications, indexed by literal. This can be
+        shared by any number of `saturate` and `propagate` calls.
+    """
+    # How many spaces to keep the Assignment of between `propagate` calls
+    KEEP = 100
+
+    def __init__(self, implications):
+        # Ids of implications to ignore
+        self.disabled = set()
+        self.clauses = []
+        self.literals = defaultdict(set)      # property -> its literals
+        self.mentions = defaultdict(set)      # property -> implication ids
+        self.assignments = OrderedDict()      # space id -> Assignment
+        for i in implications:
+            for clause in _cnf(i.antecedent.negate() | i.consequent):
+                clause = sorted(set(clause))
+                if any((p, Value.NOT.get(v)) in clause for p, v in clause):
+                    continue  # Always true
+                for literal in clause:
+                    self.literals[literal[0]].add(literal)
+                    self.mentions[literal[0]].add(i.id)
+                self.clauses.append((i.id, clause))
+
+    def saturate(self, values, strict=True):
+        """ Adds everything that follows from `values` (a dict of property id
+            to value id, updated in place). Returns a list of (property id,
+            proof steps) for each derived trait in the order it was derived,
+            where the steps are ('t', property id) and ('i', implication id)
+            pairs.
+
+            Raises a Contradiction if the traits are inconsistent, unless
+            `strict` is False, in which case clashing conclusions are skipped
+            (as the Prover does).
+        """
+        return self._run(Assignment(values), None, strict)
+
+    def propagate(self, space_id, values, new, strict=True):
+        """ Like `saturate`, for the values of a space which are assumed to be
+            saturated already apart from those for the properties in `new`.
+
+            If the Assignment kept from the last call for the space holds the
+            same values apart from `new`, only the new values are assigned,
+            and only the clauses watching the literals they make false are
+            visited. Otherwise (or if the space isn't one of the last `KEEP`)
+            its Assignment is rebuilt from `values`.
+        """
+        new = [p for p in set(new) if p in values]
+        assignment = self.assignments.pop(space_id, None)
+        if assignment is None or assignment.values != dict(
+                (p, v) for p, v in values.items() if p not in new):
+            assignment = Assignment(dict(values))
+            derived = self._run(assignment, None, strict)
+        else:
+            assignment.values.update((p, values[p]) for p in new)
+            derived = self._run(assignment, new, strict)
+        values.update(assignment.values)
+        self.assignments[space_id] = assignment
+        while len(self.assignments) > self.KEEP:
+            self.assignments.popitem(last=False)
+        return derived
+
+    def follows(self, implication):
+        """ Whether `implication` can be derived from the other (enabled)
+            implications: assuming each way its antecedent can hold, either
+            its consequent is derived or the assumptions are contradictory.
+            Returns the ids of the implications that fired, or None if it
+            can't be derived this way.
+        """
+        disabled = implication.id in self.disabled
+        self.disabled.add(implication.id)
+        used = set()
+        try:
+            for term in _dnf(implication.antecedent):
+                values = {}
+                if any(values.setdefault(p, v) != v for p, v in term):
+                    continue  # Never holds
+                try:
+                    derived = self.saturate(values)
+                except Contradiction as e:
+                    derived = e.derived + [(None, e.steps)]
+                else:
+                    if not holds(implication.consequent, values):
+                        return None
+                used.update(id for p, steps in derived
+                            for kind, id in steps if kind == 'i')
+            return used
+        finally:
+            if not disabled:
+                self.disabled.discard(implication.id)
+
+    def _run(self, assignment, new, strict):
+        """ Propagates the values for the properties in `new` through
+            `assignment`, or if `new` is None gives every clause its watches
+            first and propagates whatever that derives
+        """
+        derived = []
+        queue = list(new or ())
+        try:
+            if new is None:
+                for index in xrange(len(self.clauses)):
+                    self._watch(assignment, index, derived, queue, strict)
+            while queue:
+                property = queue.pop()
+                value = assignment.values[property]
+                for literal in self.literals.get(property, ()):
+                    if literal[1] == value:
+                        continue  # This literal just became true, not false
+                    kept = []
+                    for index in assignment.watching.pop(literal, ()):
+                        if self._visit(assignment, index, literal, derived,
+                                       queue, strict):
+                            kept.append(index)
+                    if kept:
+                        assignment.watching[literal] = kept
+        except Contradiction as e:
+            # Keep what was derived on the way, which the steps may refer to
+            e.derived = derived
+            raise
+        return derived
+
+    def _watch(self, assignment, index, derived, queue, strict):
+        """ Gives a clause two watched literals that are not false, unless it
+            is satisfied already or has fewer left
+        """
+        id, clause = self.clauses[index]
+        if id in self.disabled:
+            return
+        candidates = []
+        for p, v in clause:
+            current = assignment.values.get(p)
+            if current == v:
+                return  # Satisfied
+            if current is None:
+                candidates.append((p, v))
+        if len(candidates) < 2:
+            self._conclude(assignment, index, candidates, derived, queue,
+                           strict)
+            return
+        assignment.watched[index] = candidates[:2]
+        for literal in candidates[:2]:
+            assignment.watching[literal].append(index)
+
+    def _visit(self, assignment, index, false, derived, queue, strict):
+        """ Updates a clause watching `false` after it became false. Returns
+            whether the clause still watches it.
+        """
+        watched = assignment.watched.get(index)
+        if watched is None:
+            return False  # Satisfied since, through its other watch
+        id, clause = self.clauses[index]
+        if id in self.disabled:
+            return True
+        values = assignment.values
+        other = watched[1] if watched[0] == false else watched[0]
+        if values.get(other[0]) == other[1]:
+            del assignment.watched[index]  # Satisfied for good
+            return False
+        for p, v in clause:
+            current = values.get(p)
+            if current == v:
+                del assignment.watched[index]
+                return False
+            if current is None and (p, v) != other:
+                assignment.watched[index] = [other, (p, v)]
+                assignment.watching[(p, v)].append(index)
+                return False
+        # All but `other` are false
+        candidates = [other] if values.get(other[0]) is None else []
+        self._conclude(assignment, index, candidates, derived, queue, strict)
+        return False
+
+    def _conclude(self, assignment, index, candidates, derived, queue,
+                  strict):
+        """ Proves the last literal of a clause that isn't false (or finds a
+            contradiction if there is none)
+        """
+        assignment.watched.pop(index, None)
+        id, clause = self.clauses[index]
+        steps = [('t', p) for p, v in clause if (p, v) not in candidates]
+        steps.append(('i', id))
+        if not candidates:
+            if strict:
+                raise Contradiction(None, steps)
+            return
+        p, v = candidates[0]
+        assignment.values[p] = v
+        derived.append((p, steps))
+        queue.append(p)
+
+
+# The Saturation of every saved implication, shared by the trait signal
+# handlers. It is dropped whenever an implication is saved or deleted in this
+# process, and rebuilt if the implications' Version stamp has changed (as it
+# will after another process changes any of them).
+_shared = {}
+
+
+def implications_version():
+    """ The Version stamp of the implications, which changes whenever one is
+        added, edited or deleted (or marked redundant)
+    """
+    from brubeck.models import Version
+
+    return Version.current('implication') or ''
+
+
+def get_saturation():
+    """ Gets the Saturation of all saved implications, apart from those known
+        to be redundant
+    """
+    from brubeck.models import Implication
+
+    version = implications_version()
+    if 'saturation' not in _shared or _shared['version'] != version:
+        _shared['saturation'] = Saturation(
+            Implication.objects.filter(redundant=False))
+        _shared['version'] = version
+    return _shared['saturation']
+
+
+def invalidate(**kwargs):
+    """ Signal handler dropping the shared Saturation """
+    _shared.clear()
@@ -0,0 +1,192 @@
+# Finds the spaces most like a given space (or most nearly satisfying a
+# conjunction of traits). Each space is a pair of packed bitsets, marking the
+# properties it is known to have and known not to have. The distance between
+# two spaces is the number of properties on which they are known to disagree
+# (a Hamming distance that ignores unknown traits), with the number they
+# agree on breaking ties. Distances are counted for many spaces at once with
+# bitwise operations and a popcount table.
+#
+# The index is built by the rebuild_similarity_index command (e.g. nightly)
+# and kept in a file at the BRUBECK_SIMILARITY_INDEX setting, so pages only
+# load it. There are no similar spaces if the setting isn't set, and spaces
+# added since the last build have none.
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+from brubeck.logic.matrix import TraitMatrix
+from brubeck.models import Space, Value
+
+
+# Number of set bits in each byte
+POPCOUNT = np.array([bin(b).count('1') for b in range(256)], dtype=np.uint8)
+
+# Rows compared at once by `all_nearest`, which bounds its memory use
+BATCH_SIZE = 256
+
+
+def _popcount(a):
+    """ Counts the set bits along the last axis of a uint8 array """
+    return POPCOUNT[a].sum(axis=-1, dtype=np.int32)
+
+
+def _strings(l):
+    return np.array(l, dtype=np.unicode_)
+
+
+class SimilarityIndex(object):
+    """ Packed (space x property) bitsets of known true and known false
+        traits, with rows ordered by space id, and the name and slug of each
+        space to link to it by
+    """
+    FIELDS = ('space_ids', 'property_ids', 'true', 'false', 'names', 'slugs')
+
+    def __init__(self, space_ids, property_ids, true, false, names, slugs):
+        self.space_ids = space_ids
+        self.property_ids = property_ids
+        self.true = true
+        self.false = false
+        self.names = names
+        self.slugs = slugs
+
+    @classmethod
+    def from_database(cls):
+        matrix = TraitMatrix.from_database()
+        spaces = dict((id, (name, slug)) for id, name, slug in
+                      Space.objects.values_list('id', 'name', 'slug'))
+        names, slugs = [_strings([spaces.get(id, ('', ''))[i]
+                                  for id in matrix.space_ids])
+                        for i in (0, 1)]
+        return cls(matrix.space_ids, matrix.property_ids,
+                   np.packbits(matrix.values == Value.TRUE, axis=1),
+                   np.packbits(matrix.values == Value.FALSE, axis=1),
+                   names, slugs)
+
+    def save(self, path):
+        """ Replaces the file at `path`, so that processes still reading the
+            old one can carry on
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **dict((name, getattr(self, name))
+                               for name in self.FIELDS))
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads an index written by `save` """
+        data = np.load(path, allow_pickle=False)
+        try:
+            return cls(*[data[name] for name in cls.FIELDS])
+        finally:
+            data.close()
+
+    def with_spaces(self, ranked):
+        """ Replaces the space ids in (space id, distance, agreements) triples
+            with (unsaved) Spaces, without querying
+        """
+        rows = np.searchsorted(self.space_ids, [id for id, _, _ in ranked])
+        return [(Space(id=id, name=unicode(self.names[row]),
+                       slug=unicode(self.slugs[row])), d, a)
+                for row, (id, d, a) in zip(rows, ranked)]
+
+    def compare(self, true, false):
+        """ Compares rows of packed query bitsets against every space.
+            Returns (distances, agreements) arrays of shape (queries, spaces).
+        """
+        true, false = true[:, np.newaxis, :], false[:, np.newaxis, :]
+        distances = _popcount(true & self.false | false & self.true)
+        agreements = _popcount(true & self.true | false & self.false)
+        return distances, agreements
+
+    def _rank(self, distances, agreements, exclude=None, k=5):
+        """ The `k` best (space id, distance, agreements) for one query """
+        order = np.lexsort((self.space_ids, -agreements, distances))
+        if exclude is not None:
+            order = order[order != exclude]
+        return [(int(self.space_ids[i]), int(distances[i]),
+                 int(agreements[i])) for i in order[:k]]
+
+    def nearest(self, space_id, k=5):
+        """ The `k` spaces nearest to a space, as (space id, distance,
+            agreements), nearest first
+        """
+        row = np.searchsorted(self.space_ids, space_id)
+        if row == len(self.space_ids) or self.space_ids[row] != space_id:
+            raise KeyError(space_id)
+        distances, agreements = self.compare(self.true[row:row + 1],
+                                             self.false[row:row + 1])
+        return self._rank(distances[0], agreements[0], exclude=row, k=k)
+
+    def closest_to(self, literals, k=5):
+        """ The `k` spaces closest to having every (property id, value id) in
+            `literals`, as (space id, atoms contradicted, atoms satisfied)
+        """
+        true = np.zeros((1, len(self.property_ids)), dtype=np.bool_)
+        false = np.zeros_like(true)
+        for p, v in literals:
+            column = np.searchsorted(self.property_ids, p)
+            if column < len(self.property_ids) and \
+                    self.property_ids[column] == p:
+                (true if v == Value.TRUE else false)[0, column] = True
+        distances, agreements = self.compare(np.packbits(true, axis=1),
+                                             np.packbits(false, axis=1))
+        return self._rank(distances[0], agreements[0], k=k)
+
+    def all_nearest(self, k=5):
+        """ The `k` nearest neighbours of every space at once, as an array of
+            row indices of shape (spaces, k), nearest first. Ties are broken
+            by agreements.
+        """
+        n = len(self.space_ids)
+        k = min(k, n - 1)
+        result = np.zeros((n, max(k, 0)), dtype=np.int32)
+        for start in range(0, n, BATCH_SIZE):
+            stop = min(start + BATCH_SIZE, n)
+            distances, agreements = self.compare(self.true[start:stop],
+                                                 self.false[start:stop])
+            # Distances dominate, and agreements are at most the number of
+            # properties, so both fit in one sort key
+            key = distances.astype(np.int64) * (len(self.property_ids) + 1) \
+                - agreements
+            rows = np.arange(stop - start)
+            key[rows, start + rows] = np.iinfo(np.int64).max  # Not itself
+            result[start:stop] = np.argsort(key, axis=1, kind='mergesort')[
+                :, :k]
+        return result
+
+
+def index_path():
+    return getattr(settings, 'BRUBECK_SIMILARITY_INDEX', None)
+
+
+# The index last loaded by this process, and the file it was loaded from
+_shared = {}
+
+
+def get_index():
+    """ Gets the SimilarityIndex last built by `rebuild`, or None if there
+        isn't one. It is reloaded whenever the file is replaced.
+    """
+    path = index_path()
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        stat = None
+    if stat is None:
+        return None
+    stamp = path, stat.st_ino, stat.st_mtime, stat.st_size
+    if _shared.get('stamp') != stamp:
+        _shared['index'] = SimilarityIndex.load(path)
+        _shared['stamp'] = stamp
+    return _shared['index']
+
+
+def rebuild():
+    """ Builds the index from the database and writes it to the file """
+    index = SimilarityIndex.from_database()
+    index.save(index_path())
+    return index
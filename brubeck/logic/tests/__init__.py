@@ -1,2 +1,4 @@
 from .formula import *
 from .prover import *
+from .idsets import *
+from .bitmaps import *
@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from brubeck.logic import Formula, bitmaps
+from brubeck.logic.bitmaps import Bitmap
+from brubeck.logic.formula.utils import human_to_formula
+from brubeck.logic.utils import spaces_matching_formula
+from brubeck.models import Space, Property, Trait, Implication, Value
+
+
+class Unmanaged(object):
+    """ Stands in for django.db.transaction outside of a transaction """
+    def is_managed(self, using=None):
+        return False
+
+
+class BitmapTests(TestCase):
+    """ Tests set operations on compressed bitmaps """
+    def setUp(self):
+        # Spanning several containers, the first of them a bitset
+        self.a = set(range(0, 70000, 3))
+        self.b = set(range(0, 140000, 5)) | set([65537])
+
+    def check(self, bitmap, ids):
+        self.assertEqual(bitmap.ids().tolist(), sorted(ids))
+        self.assertEqual(len(bitmap), len(ids))
+
+    def test_containers(self):
+        a = Bitmap.from_ids(self.a)
+        assert bitmaps._is_bitset(a.containers[0])
+        assert not bitmaps._is_bitset(a.containers[1])
+        self.check(a, self.a)
+        self.check(Bitmap.from_ids([]), [])
+
+    def test_operations(self):
+        a, b = Bitmap.from_ids(self.a), Bitmap.from_ids(self.b)
+        self.check(a & b, self.a & self.b)
+        self.check(a | b, self.a | self.b)
+        self.check(a - b, self.a - self.b)
+        self.check(b - a, self.b - self.a)
+        small = Bitmap.from_ids([3, 4, 65539])
+        self.check(a & small, [3])
+        self.check(small - a, [4, 65539])
+
+
+class BitmapIndexTests(TestCase):
+    """ Tests that formulae are evaluated from the bitmap index, and that the
+        index follows changes to the traits
+    """
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'bitmaps')
+        self.settings = override_settings(BRUBECK_BITMAP_INDEX=self.path)
+        self.settings.enable()
+        bitmaps.invalidate()
+        self.T = Value.objects.get(name='True')
+        self.F = Value.objects.get(name='False')
+        self.A, self.B = [Property.objects.create(name=n) for n in 'AB']
+        self.spaces = [Space.objects.create(name='s%s' % i)
+                       for i in range(4)]
+        for space, a, b in zip(self.spaces, 'TTF', 'TF '):
+            self.add(space, self.A, a)
+            self.add(space, self.B, b)
+        bitmaps.flush()
+
+    def tearDown(self):
+        bitmaps.invalidate()
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    def add(self, space, property, value):
+        if value.strip():
+            Trait.objects.create(space=space, property=property,
+                value=getattr(self, value))
+
+    def matches(self, formula, evaluates_to=True):
+        return [s.name for s in Space.objects.filter(
+            id__in=spaces_matching_formula(human_to_formula(formula),
+                                           evaluates_to)).order_by('id')]
+
+    def check_formulae(self):
+        """ Checks that the index matches querying the database """
+        for formula in ['A', 'B', '~A', 'A + B', 'A | B', 'A + ~B']:
+            for evaluates_to in (True, False, None):
+                expected = self.matches(formula, evaluates_to)
+                with override_settings(BRUBECK_BITMAP_INDEX=None):
+                    self.assertEqual(self.matches(formula, evaluates_to),
+                                     expected)
+
+    def test_evaluate(self):
+        self.assertEqual(self.matches('A + B'), ['s0'])
+        self.assertEqual(self.matches('A | B'), ['s0', 's1'])
+        self.assertEqual(self.matches('B', None), ['s2', 's3'])
+        self.check_formulae()
+        # The Bitmaps are mapped from the file
+        assert os.path.exists(self.path)
+
+    def test_updates(self):
+        """ Tests that new traits and spaces are seen at once and written to
+            the file when flushed, and that deletions drop it
+        """
+        index = bitmaps.get_index()
+        self.add(self.spaces[3], self.A, 'F')
+        Space.objects.create(name='s4')
+        self.assertEqual(self.matches('A', False), ['s2', 's3'])
+        self.assertEqual(self.matches('A', None), ['s4'])
+        # Not written until the transaction is committed
+        self.assertEqual(bitmaps._stamp(self.path), index.stamp)
+        bitmaps.flush()
+        self.assertNotEqual(bitmaps._stamp(self.path), index.stamp)
+        self.assertEqual(bitmaps._open(self.path).version,
+                         bitmaps.database_version())
+        self.assertEqual(self.matches('A', None), ['s4'])
+        self.check_formulae()
+
+        # A changed value moves the space to the new value's bitmap
+        trait = Trait.objects.get(space=self.spaces[2], property=self.A)
+        trait.value = self.T
+        trait.save()
+        self.assertEqual(self.matches('A'), ['s0', 's1', 's2'])
+        bitmaps.flush()
+        self.check_formulae()
+
+        # Deletions are applied to the bitmaps too
+        stamp = bitmaps._stamp(self.path)
+        Trait.objects.filter(space=self.spaces[0], property=self.B).delete()
+        self.assertEqual(self.matches('A + B'), [])
+        bitmaps.flush()
+        self.assertNotEqual(bitmaps._stamp(self.path), stamp)
+        self.check_formulae()
+        self.spaces[1].delete()
+        bitmaps.flush()
+        self.assertEqual(self.matches('A'), ['s0', 's2'])
+        self.assertEqual(self.matches('A', None), ['s4'])
+        self.check_formulae()
+        self.assertEqual(bitmaps._open(self.path).version,
+                         bitmaps.database_version())
+
+    def test_batched(self):
+        """ Tests that the file is written once for a trait and everything
+            derived from it, and isn't checked against the database on each
+            evaluation
+        """
+        properties = [Property.objects.create(name='C%s' % i)
+                      for i in range(10)]
+        for p, q in zip([self.A] + properties, properties):
+            Implication.objects.create(antecedent=Formula(p.id, self.T.id),
+                                       consequent=Formula(q.id, self.T.id))
+        bitmaps.flush()
+        writes = []
+        write = bitmaps._write
+        bitmaps._write = lambda *args: writes.append(args) or write(*args)
+        try:
+            self.add(self.spaces[3], self.A, 'T')
+            bitmaps.flush()
+            self.assertEqual(len(writes), 1)
+            # Outside of a transaction, written as soon as the prover is done
+            bitmaps.transaction = Unmanaged()
+            try:
+                self.add(self.spaces[2], properties[0], 'T')
+            finally:
+                bitmaps.transaction = transaction
+        finally:
+            bitmaps._write = write
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(self.matches('C9'), ['s0', 's1', 's2', 's3'])
+        self.check_formulae()
+
+        bitmaps.request_started()
+        formula = human_to_formula('A + C9')
+        spaces_matching_formula(formula)
+        with self.assertNumQueries(0):
+            for i in range(3):
+                spaces_matching_formula(formula)
+
+    def test_rollback(self):
+        """ Tests that changes are forgotten if the transaction isn't
+            committed
+        """
+        index = bitmaps.get_index()
+        self.add(self.spaces[3], self.A, 'T')
+        bitmaps.discard()
+        bitmaps.flush()
+        self.assertEqual(bitmaps._stamp(self.path), index.stamp)
+
+    def test_stale(self):
+        """ Tests that a file that doesn't match the database is rebuilt """
+        bitmaps.get_index()
+        Trait.objects.filter(space=self.spaces[0]).update(value=self.F)
+        self.assertEqual(self.matches('~A'), ['s2'])
+        # Changed without signals, so the index can't know until rebuilt
+        call_command('rebuild_bitmap_index')
+        self.assertEqual(self.matches('~A'), ['s0', 's2'])
+        self.check_formulae()
+
+    def test_conditions(self):
+        """ Tests matching among some of the spaces """
+        formula = human_to_formula('A')
+        spaces = Space.objects.filter(name__in=['s1', 's2'])
+        self.assertEqual(spaces_matching_formula(formula, spaces=spaces),
+                         [self.spaces[1].id])
+        self.assertEqual(
+            spaces_matching_formula(Formula(self.B.id, self.T.id), None,
+                                    spaces=spaces),
+            [self.spaces[2].id])
@@ -0,0 +1,38 @@
+from django.test import TestCase
+
+from brubeck.logic import idsets
+
+
+class IdSetTests(TestCase):
+    """ Tests set algebra on sorted id arrays """
+    def setUp(self):
+        self.a = idsets.make([5, 1, 3, 3, 9])
+        self.b = idsets.make(range(0, 10, 3))
+        self.empty = idsets.make()
+
+    def test_make(self):
+        """ Tests that sets are sorted and free of duplicates """
+        self.assertEqual(self.a.tolist(), [1, 3, 5, 9])
+        self.assertEqual(self.a.dtype, idsets.DTYPE)
+        self.assertEqual(len(self.empty), 0)
+
+    def test_intersection(self):
+        self.assertEqual(idsets.intersection([self.a, self.b]).tolist(),
+                         [3, 9])
+        self.assertEqual(idsets.intersection([self.a]).tolist(), [1, 3, 5, 9])
+        self.assertEqual(
+            len(idsets.intersection([self.a, self.empty, self.b])), 0)
+
+    def test_union(self):
+        """ Tests that unions (even of a set with itself) have no repeats """
+        self.assertEqual(idsets.union([self.a, self.b, self.a]).tolist(),
+                         [0, 1, 3, 5, 6, 9])
+        self.assertEqual(idsets.union([self.empty, self.b]).tolist(),
+                         [0, 3, 6, 9])
+        self.assertEqual(len(idsets.union([])), 0)
+
+    def test_difference(self):
+        self.assertEqual(idsets.difference(self.a, self.b).tolist(), [1, 5])
+        self.assertEqual(idsets.difference(self.a, self.empty).tolist(),
+                         [1, 3, 5, 9])
+        self.assertEqual(len(idsets.difference(self.empty, self.a)), 0)
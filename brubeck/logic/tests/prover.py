@@ -1,12 +1,20 @@
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.models import Model
 from django.test import TestCase
 from django.test.client import Client
 
-from brubeck.logic import Formula
-from brubeck.logic.utils import verify_match, get_full_proof
+from brubeck.logic import Formula, Prover
+from brubeck.logic.closure import get_closure
+from brubeck.logic.matrix import TraitMatrix
+from brubeck.logic.network import Network, get_memory
+from brubeck.logic.profiling import Recorder, current
+from brubeck.logic.saturation import Saturation, get_saturation
+from brubeck.logic.utils import verify_match, get_full_proof, \
+    spaces_matching_formula
 from brubeck.logic.formula.utils import human_to_formula
-from brubeck.models import Space, Property, Trait, Implication, Value
+from brubeck.models import Space, Property, Trait, Implication, Value, \
+    ValueSet, Version
 from brubeck.utils import get_orphans, check_consistency
 
 
@@ -82,6 +90,22 @@ class ProverTests(TestCase):
         verify_match(Formula(self.A, self.F), self.space)
         assert self.space.trait_set.count() == 3
 
+    def test_matching(self):
+        """ Tests that spaces matching several parts of a formula are only
+            listed once
+        """
+        other = Space.objects.create(name='other')
+        for space in (self.space, other):
+            Trait.objects.create(space=space, property=self.A, value=self.T)
+        Trait.objects.create(space=self.space, property=self.B, value=self.T)
+        self.assertEqual(spaces_matching_formula(human_to_formula('A | B')),
+                         [self.space.id, other.id])
+        self.assertEqual(spaces_matching_formula(human_to_formula('A + B')),
+                         [self.space.id])
+        a, b = Formula(self.A, self.T), Formula(self.B, self.T)
+        self.assertEqual(spaces_matching_formula((a | b) & a),
+                         [self.space.id, other.id])
+
     def test_full_proof_trace(self):
         """ Tests that ~A, ~A => B, B => ~C generates ~C and examines the full
             proof trace.
@@ -127,3 +151,177 @@ class ProverTests(TestCase):
             Implication(antecedent=ant, consequent=cons)
         ])
         assert len(check_consistency()) == 1
+        report = check_consistency(processes=2)
+        self.assertEqual([(i.name(), spaces)
+            for i, spaces in report.counterexamples],
+            [(Implication.objects.get().name(), [self.space.id])])
+
+    def test_consistency_report(self):
+        """ Checks that traits with invalid values or broken proofs are
+            reported
+        """
+        implication = Implication.objects.create(
+            antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B'))
+        Trait.objects.create(space=self.space, property=self.A, value=self.T)
+        derived = self.space.trait_set.get(property=self.B)
+        other = ValueSet.objects.create(name='Other')
+        wrong = Trait.objects.create(space=self.space, property=self.C,
+            value=Value.objects.create(name='Other', value_set=other))
+        self.assertEqual(check_consistency().as_dict(), {
+            'counterexamples': [], 'contradictions': [wrong.id],
+            'unsupported': []})
+
+        Implication.objects.filter(id=implication.id).delete()
+        self.assertEqual(check_consistency().unsupported, [derived.id])
+
+    def test_propagation(self):
+        """ Tests that a new trait is propagated through chains of
+            implications, in either direction, with proofs citing the traits
+            and implications used
+        """
+        D = Property.objects.create(name='D')
+        i1 = Implication.objects.create(antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B | C'))
+        i2 = Implication.objects.create(antecedent=human_to_formula('B'),
+            consequent=human_to_formula('D'))
+        c = Trait.objects.create(space=self.space, property=self.C,
+            value=self.F)
+        self.assertEqual(self.space.trait_set.count(), 1)
+
+        a = Trait.objects.create(space=self.space, property=self.A,
+            value=self.T)
+        b = self.space.trait_set.get(property=self.B)
+        d = self.space.trait_set.get(property=D)
+        self.assertEqual(b.value, self.T)
+        self.assertEqual(d.value, self.T)
+        self.assertEqual(b.snippet.revision.text,
+            't%s,t%s,i%s,' % (a.id, c.id, i1.id))
+        self.assertEqual(d.snippet.revision.text, 't%s,i%s,' % (b.id, i2.id))
+
+        # Contrapositives
+        other = Space.objects.create(name='other')
+        Trait.objects.create(space=other, property=D, value=self.F)
+        self.assertEqual(dict(other.trait_set.values_list('property__name',
+            'value__name')), {'D': 'False', 'B': 'False'})
+
+    def test_edited_elsewhere(self):
+        """ Tests that an implication edited by another process is picked up,
+            even though the number of implications and their ids are the same
+        """
+        i = Implication.objects.create(antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B'))
+        get_saturation()
+        self.assertEqual(get_closure().consequences((self.A.id, Value.TRUE)),
+                         [(self.B.id, Value.TRUE)])
+        # As the other process would, without signals in this one
+        Implication.objects.filter(id=i.id).update(
+            consequent=human_to_formula('C'))
+        Version.bump('implication')
+        Trait.objects.create(space=self.space, property=self.A, value=self.T)
+        self.assertEqual(set(self.space.trait_set.values_list(
+            'property__name', flat=True)), set(['A', 'C']))
+        self.assertEqual(get_closure().consequences((self.A.id, Value.TRUE)),
+                         [(self.C.id, Value.TRUE)])
+
+    def test_watched_literals(self):
+        """ Tests that a new trait only visits the clauses watching the
+            literals it makes false, and that a space keeps its watches
+            between inserts
+        """
+        D = Property.objects.create(name='D')
+        Implication.objects.create(antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B'))
+        i2 = Implication.objects.create(antecedent=human_to_formula('C'),
+            consequent=human_to_formula('D'))
+        Trait.objects.create(space=self.space, property=self.A, value=self.T)
+        saturation = get_saturation()
+        assignment = saturation.assignments[self.space.id]
+
+        visited = []
+        def visit(assignment, index, *args):
+            visited.append(saturation.clauses[index][0])
+            return Saturation._visit(saturation, assignment, index, *args)
+        saturation._visit = visit
+        try:
+            Trait.objects.create(space=self.space, property=self.C,
+                value=self.T)
+        finally:
+            del saturation._visit
+        self.assertEqual(visited, [i2.id])
+        self.assertTrue(saturation.assignments[self.space.id] is assignment)
+        self.assertEqual(set(self.space.trait_set.values_list(
+            'property__name', flat=True)), set(['A', 'B', 'C', 'D']))
+
+    def test_network(self):
+        """ Tests that implications share the nodes for common conditions,
+            that new traits only activate the implications they affect, and
+            that the shared Memory records new traits and spaces
+        """
+        D = Property.objects.create(name='D')
+        Trait.objects.create(space=self.space, property=self.A, value=self.T)
+        i1 = Implication.objects.create(antecedent=human_to_formula('A + B'),
+            consequent=human_to_formula('C'))
+        i2 = Implication.objects.create(
+            antecedent=human_to_formula('B + A + C'),
+            consequent=human_to_formula('~D'))
+        network = Network([i1, i2])
+        # A, B, C, D=False, A + B and A + B + C
+        self.assertEqual(len(network.nodes), 6)
+
+        memory = network.match(TraitMatrix.from_database())
+        self.assertEqual(memory.activations(), [])
+        self.assertEqual(memory.assign(0, self.B.id, Value.TRUE), [0])
+        self.assertEqual(memory.assign(0, self.C.id, Value.TRUE), [1])
+        self.assertEqual(memory.assign(0, D.id, Value.FALSE), [])
+        self.assertEqual(memory.activations(), [])
+
+        shared = get_memory()
+        E = Property.objects.create(name='E')
+        other = Space.objects.create(name='other')
+        with Recorder('script') as stats:
+            Trait.objects.create(space=other, property=self.B, value=self.T)
+            Trait.objects.create(space=other, property=E, value=self.T)
+        # Nothing could be proved, so neither was propagated
+        self.assertFalse('propagate' in stats.phases)
+        Trait.objects.create(space=other, property=self.A, value=self.T)
+        self.assertTrue(other.trait_set.filter(property=self.C).exists())
+        self.assertTrue(get_memory() is shared)
+        row = shared.row(other.id)
+        self.assertEqual(shared.matrix.get(other.id, self.C.id), Value.TRUE)
+        self.assertFalse(shared.could_prove(row, self.A.id))
+
+    def test_add_proofs(self):
+        """ Tests that proofs lost when traits are deleted are recovered """
+        Implication.objects.create(antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B'))
+        Implication.objects.create(antecedent=human_to_formula('B'),
+            consequent=human_to_formula('C'))
+        Trait.objects.create(space=self.space, property=self.A, value=self.T)
+        Trait.objects.exclude(property=self.A).delete()
+        Prover._add_proofs()
+        self.assertEqual(set(self.space.trait_set.values_list('property__name',
+            flat=True)), set(['A', 'B', 'C']))
+
+    def test_profiling(self):
+        """ Tests that prover work is broken down by phase, with nested
+            operations counted as phases of the outermost
+        """
+        queries = len(connection.queries)
+        with Recorder('script') as stats:
+            Implication.objects.create(
+                antecedent=human_to_formula('A'),
+                consequent=human_to_formula('B'))
+            Trait.objects.create(space=self.space, property=self.A,
+                value=self.T)
+        self.assertEqual(stats.derived, 1)
+        # The derived trait is saved while propagating, so it doesn't
+        # propagate again
+        self.assertEqual(stats.phases['trait_post_save'][0], 1)
+        self.assertEqual(stats.phases['implication_post_save'][0], 1)
+        self.assertEqual(stats.phases['_add_trait'][0], 1)
+        assert stats.queries >= stats.phases['trait_post_save'][2] > 0
+        assert 'propagate' in stats.summary()
+        # Queries are only counted, not kept, when DEBUG is off
+        self.assertEqual(len(connection.queries), queries)
+        assert current() is None
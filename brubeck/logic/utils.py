@@ -1,26 +1,14 @@
 # Provides several utilities for working with formulae
 from django.core.exceptions import ObjectDoesNotExist
 
-from brubeck.logic import Formula
+from brubeck.logic import Formula, bitmaps, idsets
+from brubeck.logic.profiling import instrumented
 from brubeck.models import Space, Value
 
 BRUBECK_AGENT = 'brubeck.logic.prover.Prover'
 
 
-def _intersection(ls):
-    """ (Efficiently?) finds the intersection of a list of lists """
-    # The python implementation of set intersection uses hashes, so this should
-    # be relatively fast, but could probably made faster using the assumption
-    # that each list in ls is already sorted
-    return sorted(list(reduce(set.intersection, (set(l) for l in ls))))
-
-
-def _union(ls):
-    """ (Efficiently?) finds the union of a list of lists """
-    from heapq import merge
-    return merge(*ls)
-
-
+@instrumented
 def spaces_matching_formula(formula, evaluates_to=True,
                             spaces=Space.objects.all()):
     """ Finds the ids of Spaces for which the given formula evaluates to the
@@ -28,13 +16,35 @@ def spaces_matching_formula(formula, evaluates_to=True,
 
         `spaces` is a queryset of Spaces from which to filter.
     """
+    return _matching(formula, evaluates_to, spaces).tolist()
+
+
+def _matching(formula, evaluates_to, spaces):
+    """ Finds the ids for `spaces_matching_formula` as an id set (see
+        `brubeck.logic.idsets`), from the bitmap index if it is enabled
+    """
+    index = bitmaps.get_index()
+    if index is None:
+        return _query(formula, evaluates_to, spaces)
+    ids = bitmaps.evaluate(index, formula, evaluates_to).ids()
+    if spaces.query.where:
+        # Only some of the spaces
+        ids = idsets.intersection([ids,
+            idsets.make(spaces.values_list('id', flat=True))])
+    return ids
+
+
+def _query(formula, evaluates_to, spaces):
+    """ Finds the ids for `_matching` from the database, querying on each
+        atom
+    """
     # For convenience (and to avoid ridiculous nested SQL queries), we only
     # query on the atoms and build the result in python.
     if formula.is_atom():
         p, v = formula.property, formula.value
         if not p or not v:
-            return []
-        spaces = spaces.order_by('id').values('id')
+            return idsets.make()
+        spaces = spaces.order_by('id').values_list('id', flat=True)
         if evaluates_to:
             spaces = spaces.filter(trait__property__id=p, trait__value__id=v)
         elif evaluates_to is None:
@@ -42,38 +52,36 @@ def spaces_matching_formula(formula, evaluates_to=True,
         else:
             spaces = spaces.filter(trait__property__id=p,
                 trait__value__id=Value.NOT[v])
-        return [d['id'] for d in spaces]
+        return idsets.make(spaces)
     else:
-        subs = (spaces_matching_formula(sf, evaluates_to, spaces)
-            for sf in formula.sub)
+        subs = [_query(sf, evaluates_to, spaces) for sf in formula.sub]
         if formula.operator == Formula.AND:
             if evaluates_to:
                 # An &'d formula evaluates to True if every subformula is True
-                spaces = _intersection(subs)
+                spaces = idsets.intersection(subs)
             else:
                 # An &'d formula evaluates to False if any subformula is False
                 # (and so is unknown if any is unknown)
-                spaces = _union(subs)
+                spaces = idsets.union(subs)
         elif formula.operator == Formula.OR:
             if evaluates_to:
                 # An |'d formula evaluates to True if any subformula is True
-                spaces = _union(subs)
+                spaces = idsets.union(subs)
             else:
             # An |'d formula evaluates to True if any subformula is True
-                spaces = _intersection(subs)
+                spaces = idsets.intersection(subs)
     return spaces
 
 
+@instrumented
 def _find_spaces(implication, ant_val, cons_val, spaces):
     """ Utility function for finding spaces with various relations to an
         implication.
     """
-    return Space.objects.filter(id__in=_intersection((
-        spaces_matching_formula(implication.antecedent, spaces=spaces,
-            evaluates_to=ant_val),
-        spaces_matching_formula(implication.consequent, spaces=spaces,
-            evaluates_to=cons_val)
-        )))
+    return Space.objects.filter(id__in=idsets.intersection((
+        _matching(implication.antecedent, ant_val, spaces),
+        _matching(implication.consequent, cons_val, spaces)
+        )).tolist())
 
 
 def find_proofs(implication, spaces=Space.objects.all()):
@@ -100,6 +108,7 @@ def counterexamples(implication, spaces=Space.objects.all()):
     return _find_spaces(implication, True, False, spaces)
 
 
+@instrumented
 def verify_match(formula, space):
     """ Verifies that the given formula evaluates to True on the given Space,
         and returns a list of Traits demonstrating such. Raises an
@@ -143,6 +152,7 @@ def verify_match(formula, space):
 node_count = 0
 
 
+@instrumented
 def get_full_proof(trait):
     from brubeck.models import Trait, Snippet
 
@@ -182,9 +192,8 @@ def get_full_proof(trait):
                      'url': trait.get_absolute_url()}
         })
     else:
-        snippets = trait.snippets.all()
         # Every live object *should* have at least one snippet
-        text = snippets[0].current_text() if snippets.exists() else \
+        text = trait.snippet.current_text() if trait.snippet else \
             '(No text available)'
         data[0].update({
             'data': {'text': text,
@@ -194,6 +203,7 @@ def get_full_proof(trait):
     return data
 
 
+@instrumented
 def _add_proofs(Prover):
     """ Utility function to extrapolate new Traits from existing data.
 
@@ -201,11 +211,18 @@ def _add_proofs(Prover):
         if the database is in an `incomplete` state (like if Traits have just
         been deleted).
     """
-    from brubeck.models import Implication
-
-    for i in Implication.objects.all():
-        for s in list(find_proofs(i)) + list(find_proofs(i.contrapositive())):
-            try:
-                Prover.apply(implication=i, space=s)
-            except AssertionError:
-                pass
+    from brubeck.logic.network import get_memory
+
+    # Every implication has been matched against every space in the shared
+    # Memory, so only the pairs that could prove something are followed up
+    memory = get_memory()
+    activations = memory.activations()
+    space_ids = memory.matrix.space_ids
+    spaces = Space.objects.in_bulk(set(int(space_ids[row])
+                                       for row, _ in activations))
+    for row, production in activations:
+        # The traits proved so far have been recorded by their signals
+        if not memory.active(row, production):
+            continue  # Settled by an earlier proof
+        Prover.apply(implication=memory.network.implications[production],
+                     space=spaces[int(space_ids[row])])
@@ -0,0 +1,72 @@
+# Benchmarks the prover against a randomly generated throwaway database
+import json
+import os
+import shutil
+import tempfile
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from brubeck.benchmark import Benchmark, DEFAULTS
+from brubeck.logic import bitmaps
+
+
+class Command(BaseCommand):
+    args = '[scenario ...]'
+    help = 'Times the prover on random data, in a temporary test database, ' \
+           'and writes the results as JSON. Scenarios: %s' % \
+           ', '.join(Benchmark.SCENARIOS)
+    option_list = BaseCommand.option_list + tuple(
+        make_option('--%s' % name.replace('_', '-'), type='int', dest=name,
+            default=default, help='Default: %s' % default)
+        for name, default in sorted(DEFAULTS.items())) + (
+        make_option('--output', dest='output', default=None,
+            help='Write results to this file instead of stdout'),
+    )
+
+    def handle(self, *scenarios, **options):
+        unknown = set(scenarios) - set(Benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenario(s): %s' % ', '.join(unknown))
+        params = dict((name, options[name]) for name in DEFAULTS)
+
+        # Build the test database as the test runner would
+        try:
+            from south.management.commands import patch_for_test_db_setup
+            patch_for_test_db_setup()
+        except ImportError:
+            pass
+        old_name = settings.DATABASES[connection.alias]['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        # Keep the random data out of the real indexes
+        directory = tempfile.mkdtemp()
+        files = dict((name, os.path.join(directory, filename)) for name,
+            filename in [('BRUBECK_SEARCH_INDEX', 'search.sqlite3'),
+                         ('BRUBECK_BITMAP_INDEX', 'bitmaps'),
+                         ('BRUBECK_SIMILARITY_INDEX', 'similarity.npz'),
+                         ('BRUBECK_SUGGESTIONS_PATH', 'suggestions.json')])
+        try:
+            with override_settings(**files):
+                try:
+                    call_command('loaddata', 'values.json', verbosity=0)
+                    results = Benchmark(**params).run(scenarios)
+                finally:
+                    bitmaps.invalidate()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(directory)
+
+        report = json.dumps({
+            'parameters': params,
+            'database': connection.vendor,
+            'results': results
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+        else:
+            self.stdout.write(report + '\n')
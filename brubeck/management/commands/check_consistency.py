@@ -0,0 +1,30 @@
+# Audits the whole database, e.g. after a deploy or a bulk import
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brubeck.utils import check_consistency
+
+
+class Command(BaseCommand):
+    help = 'Checks every implication against every space, and every trait ' \
+           'for a valid value and proof. Fails if any problems are found.'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', default=1,
+            help='Number of processes to evaluate implications with'),
+        make_option('--json', action='store_true', dest='json',
+            default=False, help='Print the full report as JSON'),
+    )
+
+    def handle(self, *args, **options):
+        report = check_consistency(processes=options['processes'])
+        if options['json']:
+            self.stdout.write(json.dumps(report.as_dict(), indent=2,
+                sort_keys=True) + '\n')
+        if report:
+            raise CommandError('%s implication(s) with counterexamples, %s '
+                'contradictory trait(s), %s unsupported trait(s)' % (
+                len(report.counterexamples), len(report.contradictions),
+                len(report.unsupported)))
+        self.stdout.write('No problems found\n')
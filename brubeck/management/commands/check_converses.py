@@ -0,0 +1,27 @@
+# Records which implications have converses with no known counterexample
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from brubeck.models import Implication
+from brubeck.utils import check_converses
+
+
+class Command(BaseCommand):
+    help = 'Checks the converse of each implication for counterexamples, ' \
+           'for the list of those needing one. Only implications never ' \
+           'checked (e.g. saved before an upgrade) are, unless --all is ' \
+           'given; the rest are kept current as data changes.'
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all',
+            default=False, help='Check every implication again'),
+    )
+
+    def handle(self, *args, **options):
+        implications = Implication.objects.exclude(reverses=True)
+        if not options['all']:
+            implications = implications.filter(open_converse=None)
+        count = implications.count()
+        found = check_converses(implications)
+        self.stdout.write('Checked %s implication(s), %s with open '
+            'converses\n' % (count, found))
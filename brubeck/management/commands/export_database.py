@@ -0,0 +1,25 @@
+# Writes a downloadable snapshot of the whole database
+import os
+
+from django.core.management.base import BaseCommand
+
+from brubeck.export import Snapshot, export_path
+
+
+class Command(BaseCommand):
+    args = '[path]'
+    help = 'Exports the trait matrix and implications as a single .npz file'
+
+    def handle(self, *args, **options):
+        path = args[0] if args else export_path()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Write to a temporary file first, so the download never sees a
+        # partially written snapshot
+        tmp = '%s.tmp' % path
+        with open(tmp, 'wb') as f:
+            Snapshot.from_database().save(f)
+        os.rename(tmp, path)
+        self.stdout.write('Exported database to %s\n' % path)
@@ -0,0 +1,39 @@
+# Marks the implications that follow from others, which the prover skips
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from brubeck.logic.saturation import invalidate
+from brubeck.models import Implication, Version
+from brubeck.utils import find_redundant_implications
+
+
+class Command(BaseCommand):
+    help = 'Finds the implications that can be derived from the others and ' \
+           'marks them as redundant, so that the prover skips them. They ' \
+           'are still shown as usual.'
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+            default=False, help='List the redundant implications without '
+                                'marking them'),
+    )
+
+    def handle(self, *args, **options):
+        found = find_redundant_implications()
+        for i, used in found:
+            self.stdout.write((u'%s: %s follows from %s\n' % (i.id, i.name(),
+                ', '.join(str(id) for id in used))).encode('utf-8'))
+        if not options['dry_run']:
+            self._mark([i.id for i, _ in found])
+        self.stdout.write('%s %s of %s implication(s) as redundant\n' % (
+            'Found' if options['dry_run'] else 'Marked', len(found),
+            Implication.objects.count()))
+
+    @transaction.commit_on_success
+    def _mark(self, ids):
+        Implication.objects.exclude(id__in=ids).update(redundant=False)
+        Implication.objects.filter(id__in=ids).update(redundant=True)
+        # So that every process rebuilds its Saturation without them
+        Version.bump('implication')
+        invalidate()
@@ -0,0 +1,184 @@
+# Imports traits in bulk, deriving their consequences in a single pass
+import csv
+import json
+from collections import defaultdict
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from brubeck import search
+from brubeck.logic import Prover, bitmaps
+from brubeck.logic.saturation import Contradiction, get_saturation
+from brubeck.models import Space, Property, Trait, Value, Snippet, Version
+from brubeck.utils import check_converses, implications_mentioning
+
+
+# Number of traits written per insert
+BATCH_SIZE = 100
+
+
+def _lookup(model):
+    """ Maps the (lowercased) names and slugs of every object to its id """
+    table = {}
+    for id, name, slug in model.objects.values_list('id', 'name', 'slug'):
+        table[name.lower()] = table[slug] = id
+    return table
+
+
+def read_rows(f, format):
+    """ Yields (space, property, value, description) from a file. CSV files
+        either have a space,property,value[,description] header or are a
+        grid, with spaces down the first column and properties across the
+        first row. JSON files hold a list of objects with those keys.
+    """
+    if format == 'json':
+        for row in json.load(f):
+            yield (row['space'], row['property'], row['value'],
+                   row.get('description', ''))
+        return
+    reader = csv.reader(f)
+    header = [h.decode('utf-8').strip() for h in next(reader)]
+    if [h.lower() for h in header[:3]] == ['space', 'property', 'value']:
+        for row in reader:
+            row = [c.decode('utf-8') for c in row]
+            if not any(c.strip() for c in row):
+                continue
+            if len(row) < 3:
+                raise CommandError('Line %s: expected a space, property and '
+                    'value' % reader.line_num)
+            yield row[0], row[1], row[2], row[3] if len(row) > 3 else ''
+    else:
+        for row in reader:
+            row = [c.decode('utf-8').strip() for c in row]
+            for property, value in zip(header[1:], row[1:]):
+                if value:
+                    yield row[0], property, value, ''
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = 'Imports traits from a CSV or JSON file. Everything is checked ' \
+           'against the existing traits and implications first, and the ' \
+           'traits they imply are added in one pass afterwards.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+            help='csv or json (default: guessed from the file name)'),
+        make_option('--user', dest='user', default='brubeck',
+            help='Username to record as the author of the descriptions'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+            default=False, help='Check the file without saving anything'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: import_traits %s' % self.args)
+        format = options['format'] or \
+            ('json' if args[0].endswith('.json') else 'csv')
+        with open(args[0], 'rb') as f:
+            rows = list(read_rows(f, format))
+
+        new, descriptions = self._resolve(rows)
+        known = defaultdict(dict)
+        for s, p, v in Trait.objects.filter(space__in=new.keys())\
+                .values_list('space_id', 'property_id', 'value_id'):
+            known[s][p] = v
+        derived = self._check(new, known)
+
+        count = sum(len(traits) for traits in new.values())
+        if not options['dry_run']:
+            user, _ = User.objects.get_or_create(username=options['user'])
+            self._save(new, derived, descriptions, user)
+            search.flush()  # Now that the descriptions are committed
+        self.stdout.write('%s %s trait(s) and %s derived trait(s) in %s '
+            'space(s)\n' % ('Checked' if options['dry_run'] else 'Imported',
+            count, sum(len(d) for d in derived.values()), len(new)))
+
+    def _resolve(self, rows):
+        """ Maps each row onto ids, grouping the new traits by space """
+        spaces, properties = _lookup(Space), _lookup(Property)
+        values = {'+': Value.TRUE, '-': Value.FALSE}
+        for id, name in Value.objects.values_list('id', 'name'):
+            values[name.lower()] = id
+
+        new, descriptions, errors = defaultdict(dict), {}, []
+        for i, (space, property, value, description) in enumerate(rows):
+            s = spaces.get(space.strip().lower())
+            p = properties.get(property.strip().lower())
+            v = values.get(value.strip().lower())
+            if s is None or p is None or v is None:
+                errors.append('Row %s: could not find %s' % (i + 1,
+                    ', '.join(repr(k) for k, id in [(space, s),
+                        (property, p), (value, v)] if id is None)))
+            elif new[s].setdefault(p, v) != v:
+                errors.append('Row %s: conflicting values for %s: %s' %
+                    (i + 1, space, property))
+            elif description:
+                descriptions[s, p] = description
+        if errors:
+            raise CommandError('\n'.join(errors[:20]))
+        return new, descriptions
+
+    def _check(self, new, known):
+        """ Drops traits that are already known and saturates each space in
+            memory, failing if anything contradicts what is known.
+        """
+        saturation = get_saturation()
+        derived, errors = {}, []
+        names = dict(Space.objects.filter(id__in=new.keys())
+            .values_list('id', 'name'))
+        properties = dict(Property.objects.values_list('id', 'name'))
+        for s, traits in new.items():
+            values = dict(known[s])
+            for p, v in traits.items():
+                if values.setdefault(p, v) != v:
+                    errors.append('%s: contradicts the existing trait for '
+                        '%s' % (names[s], properties[p]))
+                elif p in known[s]:
+                    del traits[p]
+            try:
+                derived[s] = [(p, values[p], steps)
+                              for p, steps in saturation.saturate(values)]
+            except Contradiction as e:
+                errors.append('%s: contradicts an implication (from %s)' %
+                    (names[s], ', '.join(properties[id] if kind == 't' else
+                        'implication %s' % id for kind, id in e.steps)))
+        if errors:
+            raise CommandError('\n'.join(errors[:20]))
+        return derived
+
+    @transaction.commit_on_success
+    def _save(self, new, derived, descriptions, user):
+        """ Writes the imported and derived traits in one insert, then adds
+            the description or proof of each.
+        """
+        rows = [Trait(space_id=s, property_id=p, value_id=v)
+                for s, traits in new.items() for p, v in traits.items()] + \
+               [Trait(space_id=s, property_id=p, value_id=v)
+                for s, steps in derived.items() for p, v, _ in steps]
+        # Some backends limit the number of parameters in a single query
+        for i in range(0, len(rows), BATCH_SIZE):
+            Trait.objects.bulk_create(rows[i:i + BATCH_SIZE])
+        # bulk_create sends no signals
+        Version.bump('trait')
+        bitmaps.invalidate()
+        traits = dict(((t.space_id, t.property_id), t) for t in
+            Trait.objects.filter(space__in=new.keys()))
+
+        for s, properties in new.items():
+            for p in properties:
+                snippet = Snippet.objects.create(object=traits[s, p])
+                snippet.add_revision(text=descriptions.get((s, p), ''),
+                    user=user)
+        for s, steps in derived.items():
+            for p, _, proof in steps:
+                Prover._add_snippet(object=traits[s, p], text=''.join(
+                    '%s%s,' % (kind, traits[s, id].id if kind == 't' else id)
+                    for kind, id in proof))
+
+        # New traits may be counterexamples to converses thought to be open
+        mentioned = set(t.property_id for t in rows)
+        if mentioned:
+            check_converses(implications_mentioning(mentioned).filter(
+                open_converse=True))
@@ -0,0 +1,28 @@
+# Mines the trait matrix for the suggested implications page
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from brubeck.mining import DEFAULTS, save_suggestions, suggestions_path
+
+
+class Command(BaseCommand):
+    help = 'Finds implications with no known counterexample and stores ' \
+           'them for the suggested implications page'
+    option_list = BaseCommand.option_list + (
+        make_option('--min-support', dest='min_support', type='int',
+            default=DEFAULTS['min_support'],
+            help='Spaces in which both sides must hold'),
+        make_option('--max-size', dest='max_size', type='int',
+            default=DEFAULTS['max_size'],
+            help='Atoms in the antecedent'),
+        make_option('--limit', dest='limit', type='int',
+            default=DEFAULTS['limit'],
+            help='Number of implications to keep'),
+    )
+
+    def handle(self, *args, **options):
+        candidates = save_suggestions(**dict((name, options[name])
+            for name in DEFAULTS))
+        self.stdout.write('Stored %s suggestion(s) at %s\n' %
+            (len(candidates), suggestions_path()))
@@ -0,0 +1,14 @@
+# Rebuilds the bitmap index of traits from the database
+from django.core.management.base import BaseCommand, CommandError
+
+from brubeck.logic.bitmaps import index_path, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the bitmap index used to search for spaces by trait'
+
+    def handle(self, *args, **options):
+        if not index_path():
+            raise CommandError('BRUBECK_BITMAP_INDEX is not set')
+        rebuild()
+        self.stdout.write('Rebuilt bitmap index at %s\n' % index_path())
@@ -0,0 +1,14 @@
+# Rebuilds the full text search index from the current snippets
+from django.core.management.base import BaseCommand, CommandError
+
+from brubeck.search import index_path, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Re-indexes every snippet for full text search'
+
+    def handle(self, *args, **options):
+        if not index_path():
+            raise CommandError('BRUBECK_SEARCH_INDEX is not set')
+        rebuild_index()
+        self.stdout.write('Rebuilt search index at %s\n' % index_path())
@@ -0,0 +1,14 @@
+# Rebuilds the index of spaces by their traits used to find similar spaces
+from django.core.management.base import BaseCommand, CommandError
+
+from brubeck.logic.similarity import index_path, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the index used to find similar spaces'
+
+    def handle(self, *args, **options):
+        if not index_path():
+            raise CommandError('BRUBECK_SIMILARITY_INDEX is not set')
+        rebuild()
+        self.stdout.write('Rebuilt similarity index at %s\n' % index_path())
@@ -0,0 +1,49 @@
+# Backfills the pre-rendered html stored on each Revision
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from brubeck.models import Revision
+from brubeck.templatetags.brubeck_tags import smarkdown
+
+
+class Command(BaseCommand):
+    help = 'Renders and stores the html for Revisions missing it. Several ' \
+           'copies can be run in parallel using --shard and --shards.'
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Re-render every Revision, not just those missing html'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=500, help='Number of Revisions to load at a time'),
+        make_option('--shard', type='int', dest='shard', default=0,
+            help='Only render Revisions with id %% shards == shard'),
+        make_option('--shards', type='int', dest='shards', default=1,
+            help='Total number of shards being run'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size, shard, shards = options['batch_size'], \
+            options['shard'], options['shards']
+        if batch_size < 1 or shards < 1 or not 0 <= shard < shards:
+            raise CommandError('Invalid batch or shard settings')
+
+        qs = Revision.objects.order_by('id')
+        if not options['all']:
+            qs = qs.filter(html='')
+        if shards > 1:
+            qs = qs.extra(where=['brubeck_revision.id %% %s = %s'],
+                params=[shards, shard])
+
+        # Walk the table by id rather than by offset, since rendered rows
+        # drop out of the `html=''` filter as we go
+        count, last = 0, 0
+        while True:
+            batch = list(qs.filter(id__gt=last).values_list('id', 'text')[
+                :batch_size])
+            if not batch:
+                break
+            for id, text in batch:
+                Revision.objects.filter(id=id).update(html=smarkdown(text))
+            count += len(batch)
+            last = batch[-1][0]
+        self.stdout.write('Rendered %s revision(s)\n' % count)
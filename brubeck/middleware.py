@@ -0,0 +1,43 @@
+# Optional middleware. Add to MIDDLEWARE_CLASSES (after
+# AuthenticationMiddleware) to enable.
+from django.conf import settings
+
+from brubeck.logic.profiling import Recorder, enabled
+
+
+class ProverProfileMiddleware(object):
+    """ Summarizes the prover's work on each request in an X-Brubeck-Prover
+        header (and the debug log), e.g. to find which saves are slow. Only
+        requests sent with an X-Brubeck-Profile header by staff (or by
+        anyone, with DEBUG on) are recorded, unless BRUBECK_PROFILE_PROVER is
+        set.
+    """
+    def _requested(self, request):
+        if 'HTTP_X_BRUBECK_PROFILE' not in request.META:
+            return False
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or bool(user and user.is_staff)
+
+    def process_request(self, request):
+        if enabled() or self._requested(request):
+            request._prover_recorder = Recorder('%s %s' % (request.method,
+                request.path))
+            request._prover_recorder.start()
+
+    def _stop(self, request):
+        recorder = getattr(request, '_prover_recorder', None)
+        if recorder:
+            del request._prover_recorder
+            recorder.stop()
+        return recorder
+
+    def process_exception(self, request, exception):
+        # process_response may not run, and the recording must not outlive
+        # the request
+        self._stop(request)
+
+    def process_response(self, request, response):
+        recorder = self._stop(request)
+        if recorder and recorder.stats:
+            response['X-Brubeck-Prover'] = recorder.stats.summary()
+        return response
@@ -0,0 +1,182 @@
+# Proposes new implications by mining the trait matrix for association rules:
+# conjunctions of (boolean) traits that are always followed by another trait
+# in the spaces where both are known. Every candidate is scored over all
+# spaces at once, with counts taken as matrix products of 0/1 arrays of
+# shape (spaces x literals), where a literal is a property and a value.
+#
+# Mining takes a pass over the whole matrix, so it is run by the
+# mine_implications command (e.g. nightly), which stores the candidates for
+# the suggestions page to read.
+import json
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+# The models must be loaded before brubeck.logic
+from brubeck.models import Implication, Property, Value
+from brubeck.logic import Formula
+from brubeck.logic.formula import atomize
+from brubeck.logic.matrix import TraitMatrix, UNKNOWN
+from brubeck.logic.saturation import get_saturation
+
+
+DEFAULTS = {
+    'min_support': 3,  # Spaces in which the antecedent and consequent hold
+    'max_size': 2,     # Atoms in the antecedent
+    'limit': 50,
+}
+
+
+class Candidate(object):
+    """ A proposed implication from a conjunction of literals (property id,
+        value id) to a single literal, with
+        - support: the number of spaces in which both sides hold
+        - settles: the number of unknown traits it would prove
+    """
+    def __init__(self, antecedent, consequent, support, settles):
+        self.antecedent = antecedent
+        self.consequent = consequent
+        self.support = support
+        self.settles = settles
+
+    def implication(self):
+        """ Builds the (unsaved) Implication """
+        atoms = [Formula(p, v) for p, v in self.antecedent]
+        return Implication(antecedent=reduce(lambda f, g: f & g, atoms),
+                           consequent=Formula(*self.consequent))
+
+    def text(self, names):
+        """ The antecedent and consequent as they would be typed into a form,
+            given a dict of property names
+        """
+        atom = lambda literal: atomize(names[literal[0]], literal[1])
+        return ' + '.join(atom(a) for a in self.antecedent), \
+            atom(self.consequent)
+
+
+def mine(matrix=None, **params):
+    """ Finds candidate implications with no counterexample in `matrix` (by
+        default, the whole database), which would settle at least one unknown
+        trait and can't already be derived from the known implications.
+        Returns the best `limit` Candidates, those settling the most traits
+        first. See DEFAULTS for the other parameters.
+    """
+    params = dict(DEFAULTS, **params)
+    if matrix is None:
+        matrix = TraitMatrix.from_database()
+    values = matrix.values
+    n = len(matrix.property_ids)
+    literals = [(int(p), v) for v in (Value.TRUE, Value.FALSE)
+                for p in matrix.property_ids]
+    # Column l of `holds` marks the spaces where literal l holds, and of
+    # `fails` where it is known not to. Literals l and l + n are negations.
+    holds = np.hstack([values == Value.TRUE, values == Value.FALSE])
+    fails = np.hstack([values == Value.FALSE, values == Value.TRUE])
+    unknown = np.hstack([values == UNKNOWN] * 2)
+    H, F, U = [a.astype(np.float32) for a in (holds, fails, unknown)]
+
+    found = []  # (settles, support, antecedent literals, consequent)
+
+    def collect(antecedents, support, counterexamples, settles):
+        same = np.zeros(settles.shape, dtype=np.bool_)
+        for row, lits in enumerate(antecedents):
+            for l in lits:
+                same[row, l % n] = same[row, l % n + n] = True
+        ok = (counterexamples == 0) & (support >= params['min_support']) & \
+            (settles > 0) & ~same
+        for row, c in zip(*np.nonzero(ok)):
+            found.append((int(settles[row, c]), int(support[row, c]),
+                          antecedents[row], int(c)))
+
+    # Single literals, counting the contrapositive too: wherever the
+    # consequent fails and the antecedent is unknown
+    counterexamples = H.T.dot(F)
+    collect([(a,) for a in range(2 * n)], H.T.dot(H), counterexamples,
+            H.T.dot(U) + U.T.dot(F))
+
+    if params['max_size'] >= 2:
+        # Pairs of literals (a, b), skipping those where either is enough
+        # on its own. The contrapositive of a + b => c proves ~b wherever a
+        # holds and c fails.
+        known = counterexamples == 0
+        for a in range(2 * n):
+            b = np.arange(a + 1, 2 * n)
+            b = b[b % n != a % n]
+            if not len(b):
+                continue
+            both = H[:, a:a + 1] * H[:, b]
+            half = H[:, a:a + 1] * U[:, b] + U[:, a:a + 1] * H[:, b]
+            cx = both.T.dot(F)
+            cx[known[a] | known[b]] = 1
+            collect([(a, int(l)) for l in b], both.T.dot(H), cx,
+                    both.T.dot(U) + half.T.dot(F))
+
+    found.sort(key=lambda f: (-f[0], -f[1], f[2], f[3]))
+    saturation = get_saturation()
+    candidates, seen = [], set()
+    for settles, support, antecedent, consequent in found:
+        # a + b => c is the same as a + ~c => ~b, so only keep the first
+        clause = frozenset([(l + n) % (2 * n) for l in antecedent] +
+                           [consequent])
+        if clause in seen:
+            continue
+        seen.add(clause)
+        c = Candidate([literals[l] for l in antecedent], literals[consequent],
+                      support, settles)
+        if saturation.follows(c.implication()) is None:
+            candidates.append(c)
+            if len(candidates) == params['limit']:
+                break
+    return candidates
+
+
+def suggestions_path():
+    """ Where the candidates found by `save_suggestions` are kept """
+    return getattr(settings, 'BRUBECK_SUGGESTIONS_PATH',
+        os.path.join(tempfile.gettempdir(), 'brubeck-suggestions.json'))
+
+
+def save_suggestions(**params):
+    """ Mines the database (see `mine`) and stores the Candidates for
+        `suggestions`, replacing the file so that readers never see it half
+        written. Returns the Candidates.
+    """
+    candidates = mine(**params)
+    path = suggestions_path()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        json.dump([{'antecedent': c.antecedent, 'consequent': c.consequent,
+                    'support': c.support, 'settles': c.settles}
+                   for c in candidates], f)
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, path)
+    return candidates
+
+
+def suggestions():
+    """ Lists the Candidates stored by `save_suggestions` as dicts for
+        display, with the text to fill in the implication form. Candidates
+        that can be derived from the implications added since are left out.
+    """
+    try:
+        with open(suggestions_path(), 'rb') as f:
+            stored = json.load(f)
+    except IOError:
+        return []  # Not mined yet
+    names = dict(Property.objects.values_list('id', 'name'))
+    saturation = get_saturation()
+    rows = []
+    for row in stored:
+        c = Candidate([tuple(l) for l in row['antecedent']],
+                      tuple(row['consequent']), row['support'],
+                      row['settles'])
+        literals = c.antecedent + [c.consequent]
+        if any(p not in names for p, v in literals) or \
+                saturation.follows(c.implication()) is not None:
+            continue
+        antecedent, consequent = c.text(names)
+        rows.append({'antecedent': antecedent, 'consequent': consequent,
+                     'support': c.support, 'settles': c.settles})
+    return rows
@@ -14,3 +14,4 @@ from .provable import *
 from .wiki import *
 from .snippets import *
 from .profile import *
+from .version import *
@@ -55,7 +55,31 @@ class Value(models.Model):
         raise NotImplementedError('Negate is only defined for boolean values')
 
 
-class _BasicMixin(models.Model):
+class _DescribedMixin(object):
+    """ Gives access to the Snippets describing an object """
+    @property
+    def snippets(self):
+        # workaround for this bug: http://code.djangoproject.com/ticket/12728
+        # replies = generic.GenericRelation(ThreadedComment)
+        from brubeck.models.snippets import snippets_for
+        return snippets_for(self)
+
+    @property
+    def snippet(self):
+        """ The first Snippet describing this object. This is looked up once
+            per instance, or for many at once with `prefetch_snippets`.
+        """
+        if not hasattr(self, '_snippet'):
+            snippets = self.snippets.select_related('revision').order_by('pk')
+            self._snippet = snippets[0] if snippets else None
+        return self._snippet
+
+    @property
+    def description(self):
+        return self.snippet.revision.text if self.snippet else ''
+
+
+class _BasicMixin(_DescribedMixin, models.Model):
     name = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(unique=True)
 
@@ -96,20 +120,6 @@ class _BasicMixin(models.Model):
         return 'admin:brubeck_%s_change' % self.__class__.__name__.lower(), \
             (self.id,), {}
 
-    @property
-    def snippets(self):
-        # workaround for this bug: http://code.djangoproject.com/ticket/12728
-        # replies = generic.GenericRelation(ThreadedComment)
-        from django.contrib.contenttypes.models import ContentType
-        from brubeck.models.snippets import Snippet
-        type = ContentType.objects.get_for_model(self)
-        return Snippet.objects.filter(content_type__pk=type.id,
-            object_id=self.id)
-
-    @property
-    def description(self):
-        return self.snippets.get().revision.text
-
 
 class DefinedManager(models.Manager):
     """ Limits results to Spaces that are fully defined """
@@ -1,33 +1,30 @@
 # -*- encoding: utf-8 -*-
+import threading
+
 from django.core.exceptions import ValidationError
+from django.core.signals import got_request_exception, request_finished, \
+    request_started
 from django.db import models
-from django.db.models.query_utils import Q
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
-from brubeck.logic import Prover
+from brubeck.logic import Prover, bitmaps, closure, utils
+from brubeck.logic.profiling import recording
+from brubeck.logic.saturation import get_saturation, invalidate
 from brubeck.logic.formula import FormulaField, atomize
+from brubeck.search import note_rename, reindex_object
 from brubeck.models import Space, Property
+from brubeck.models.core import _DescribedMixin
 
 
-class _ProvesTraitMixin(models.Model):
+class _ProvesTraitMixin(_DescribedMixin, models.Model):
     traits = lambda o: Prover.implied_traits(o)
     traits_desc = 'Related Traits'
 
     class Meta:
         abstract = True
 
-    @property
-    def snippets(self):
-        # workaround for this bug: http://code.djangoproject.com/ticket/12728
-        # replies = generic.GenericRelation(ThreadedComment)
-        from django.contrib.contenttypes.models import ContentType
-        from brubeck.models.snippets import Snippet
-        type = ContentType.objects.get_for_model(self)
-        return Snippet.objects.filter(content_type__pk=type.id,
-            object_id=self.id)
-
 
 class Trait(_ProvesTraitMixin):
     """ A Trait records whether a Space has a particular Property """
@@ -76,20 +73,114 @@ class Trait(_ProvesTraitMixin):
         return 'admin:brubeck_trait_change', (self.id,), {}
 
 
+# Set while the Prover saves the traits derived from a new trait, so that
+# saving those doesn't start another round of propagation
+_local = threading.local()
+
+
+def trait_changed(sender, instance, signal, **kwargs):
+    """ Gives the traits a new Version stamp, and notes the change in the
+        bitmap index and the shared Memory of the implications
+    """
+    from brubeck.logic import network
+    from brubeck.models import Version
+
+    stamps = Version.bump('trait')
+    if signal is post_save:
+        bitmaps.trait_saved(instance, stamps)
+        network.trait_saved(instance, stamps)
+    else:
+        bitmaps.trait_deleted(instance, stamps)
+        network.trait_deleted(instance, stamps)
+post_delete.connect(trait_changed, Trait)
+
+
 def trait_post_save(sender, instance, created, **kwargs):
-    """ Checks all implications involving this property for new proofs. """
-    if created:
-        # TODO: improve formula field lookups. This is overly broad, e.g.
-        #       `contains='1='` matches '31=True' as well.
-        # TODO: factor in to Prover class
-        pid = '%s=' % instance.property.id
-        candidate_imps = Implication.objects.filter(
-            Q(antecedent__contains=pid) | Q(consequent__contains=pid))
-        for i in candidate_imps:
-            Prover.apply(implication=i, space=instance.space)
+    """ Notes the change (see `trait_changed`), so that it is in the bitmap
+        index while the trait is propagated, and adds the traits that follow
+        from this one. The new trait is matched through the shared Memory
+        first, and only propagated if an implication mentioning its property
+        could prove something. The index is written once everything has been
+        derived. A changed value may also open or close converses involving
+        its property.
+    """
+    with bitmaps.batch():
+        trait_changed(sender, instance, signal=post_save)
+        if not created:
+            from brubeck.utils import check_converses, \
+                implications_mentioning
+
+            implications = implications_mentioning([instance.property_id])
+            close_converses(implications, instance.space)
+            check_converses(implications.filter(open_converse=False))
+        elif not getattr(_local, 'propagating', False):
+            from brubeck.logic.network import get_memory
+
+            with recording('trait_post_save'):
+                memory = get_memory()
+                traits = [instance]
+                if memory.could_prove(memory.row(instance.space_id),
+                                      instance.property_id):
+                    _local.propagating = True
+                    try:
+                        traits += Prover.propagate(
+                            space=instance.space,
+                            property_ids=[instance.property_id])
+                    finally:
+                        _local.propagating = False
+                mentions = get_saturation().mentions
+                close_converses(Implication.objects.filter(
+                    id__in=set().union(*[mentions[t.property_id]
+                                         for t in traits])), instance.space)
 post_save.connect(trait_post_save, Trait)
 
 
+def close_converses(implications, space):
+    """ Marks the converses of `implications` as closed if `space` is now a
+        counterexample. Only `space` is checked, so this is cheap enough to
+        run for every new Trait.
+    """
+    spaces = Space.objects.filter(id=space.id)
+    closed = [i.id for i in implications if i.open_converse and
+        utils.counterexamples(i.converse(), spaces=spaces).exists()]
+    if closed:
+        Implication.objects.filter(id__in=closed).update(open_converse=False)
+
+
+def trait_post_delete(sender, instance, **kwargs):
+    """ Deleting a Trait may remove the only counterexample to a converse, so
+        any closed converses involving its property are re-checked.
+    """
+    from brubeck.utils import check_converses, implications_mentioning
+
+    check_converses(implications_mentioning([instance.property_id]).filter(
+        open_converse=False))
+post_delete.connect(trait_post_delete, Trait)
+
+
+def space_changed(sender, instance, created=False, **kwargs):
+    """ Gives the spaces a new Version stamp, and notes the change in the
+        bitmap index and the shared Memory of the implications
+    """
+    from brubeck.logic import network
+    from brubeck.models import Version
+
+    stamps = Version.bump('space')
+    if kwargs.get('signal') is post_save:
+        bitmaps.space_saved(instance, created, stamps)
+        network.space_saved(instance, created, stamps)
+    else:
+        bitmaps.space_deleted(instance, stamps)
+        network.space_deleted(instance, stamps)
+post_save.connect(space_changed, Space)
+post_delete.connect(space_changed, Space)
+# Changes to the bitmap index are written once a request is committed, and
+# the index is checked against the database once per request
+request_started.connect(bitmaps.request_started)
+request_finished.connect(bitmaps.flush)
+got_request_exception.connect(bitmaps.discard)
+
+
 class Implication(_ProvesTraitMixin):
     """ An Implication allows us to deduce new properties from old ones. """
     antecedent = FormulaField()
@@ -100,6 +191,14 @@ class Implication(_ProvesTraitMixin):
     # to find converses? Don't forget that A + B != B + A for formulae
     reverses = models.BooleanField(default=False)
 
+    # Whether the converse has no known counterexamples, or None if that has
+    # never been checked. See `brubeck.utils.get_open_converses`.
+    open_converse = models.NullBooleanField()
+
+    # Whether this implication follows from the others, so that the prover
+    # can skip it. See `brubeck.utils.find_redundant_implications`.
+    redundant = models.BooleanField(default=False)
+
     class Meta:
         app_label = 'brubeck'
 
@@ -107,6 +206,14 @@ class Implication(_ProvesTraitMixin):
         if kwargs.get('commit', True) and self.counterexamples().exists():
             raise ValidationError('Cannot save implication with known '
                 'counterexamples: %s' % self.counterexamples())
+        # The formulae may have changed, so the converse must be re-checked
+        self.open_converse = not self.converse().counterexamples().exists()
+        if self.id:
+            # As must the implications this may have been used to derive
+            from brubeck.utils import recheck_redundant_implications
+
+            self.redundant = False
+            recheck_redundant_implications(changed=self)
         super(Implication, self).save(*args, **kwargs)
 
     def __unicode__(self, **kwargs):
@@ -164,12 +271,41 @@ class Implication(_ProvesTraitMixin):
 def implication_post_save(sender, instance, created, **kwargs):
     """ Checks all implications involving this property for new proofs. """
     if created:
-        for s in instance.find_proofs():
-            Prover.apply(implication=instance, space=s)
-        for s in instance.contrapositive().find_proofs():
-            Prover.apply(implication=instance, space=s)
+        with recording('implication_post_save'), bitmaps.batch():
+            for s in instance.find_proofs():
+                Prover.apply(implication=instance, space=s)
+            for s in instance.contrapositive().find_proofs():
+                Prover.apply(implication=instance, space=s)
+
+
+def implication_changed(sender, instance, created=False, **kwargs):
+    """ Gives the implications a new Version stamp, and updates the shared
+        Saturation and Closure to match
+    """
+    from brubeck.models import Version
+
+    old, new = Version.bump('implication')
+    invalidate()
+    closure.implication_saved(instance, created, old, new)
+# This must happen before anything is derived from a new implication
+post_save.connect(implication_changed, Implication)
+post_delete.connect(implication_changed, Implication)
 post_save.connect(implication_post_save, Implication)
 
+
+def implication_post_delete(sender, instance, **kwargs):
+    """ Implications which followed from a deleted one may not any more """
+    from brubeck.utils import recheck_redundant_implications
+
+    recheck_redundant_implications()
+post_delete.connect(implication_post_delete, Implication)
+
+# The search index holds the name of the object each snippet describes
+for model in (Space, Property):
+    pre_save.connect(note_rename, model)
+for model in (Space, Property, Implication):
+    post_save.connect(reindex_object, model)
+
 # TODO: allow post_save options to be asynchronous (w/ celery)
 # TODO: improve post-delete handling (delete revisions from index, related
 #       traits, etc.)
@@ -1,12 +1,14 @@
 import logging
+from collections import defaultdict
 
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from django.core.signals import got_request_exception, request_finished
 from django.db import models
 
 from brubeck.fields import SetField
 from brubeck.models.wiki import Document, Revision
-#from brubeck.search import index_revision
+from brubeck.search import discard, flush, index_snippet, unindex_snippet
 
 
 logger = logging.getLogger(__name__)
@@ -44,6 +46,16 @@ class Snippet(Document):
         return self.proof_text if self.is_proof() else \
             getattr(self.revision, 'text', '')
 
+    def current_html(self):
+        """ Like `current_text`, but rendered for display. Revision text is
+            rendered once when the revision is saved, so this is usually just
+            a lookup.
+        """
+        if self.is_proof():
+            from brubeck.templatetags.brubeck_tags import smarkdown
+            return smarkdown(self.proof_text)
+        return rendered_html(self.revision) if self.revision else ''
+
     def _get_prover(self):
         """ Gets a Prover object that can reason about this proof and the way
             it was generated.
@@ -74,6 +86,72 @@ class Snippet(Document):
         super(Snippet, self).save(*args, **kwargs)
 
 
+def snippets_for(obj):
+    """ Gets the Snippets describing `obj` """
+    ct = ContentType.objects.get_for_model(obj)
+    return Snippet.objects.filter(content_type__pk=ct.id, object_id=obj.id)
+
+
+def prefetch_snippets(objects):
+    """ Attaches the primary Snippet (and its current Revision) to each of
+        `objects`, so that their `snippet` and `description` need no further
+        queries. Takes one query per model among the objects.
+    """
+    by_model = defaultdict(lambda: defaultdict(list))
+    for obj in objects:
+        by_model[obj.__class__][obj.id].append(obj)
+    for model, objs in by_model.items():
+        ct = ContentType.objects.get_for_model(model)
+        found = {}
+        # Later rows overwrite earlier ones, leaving the first Snippet created
+        for snippet in Snippet.objects.filter(content_type__pk=ct.id,
+                object_id__in=objs.keys()).select_related('revision')\
+                .order_by('-pk'):
+            found[snippet.object_id] = snippet
+        for id, instances in objs.items():
+            for obj in instances:
+                obj._snippet = found.get(id)
+                if obj._snippet:
+                    obj._snippet._object_cache = obj
+    return objects
+
+
+def prefetch_objects(snippets):
+    """ Loads the objects described by `snippets`, in one query per content
+        type, so that `snippet.object` needs no further queries.
+    """
+    by_type = defaultdict(list)
+    for snippet in snippets:
+        by_type[snippet.content_type_id].append(snippet)
+    for ct_id, group in by_type.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        objects = model.objects.in_bulk([s.object_id for s in group])
+        for snippet in group:
+            snippet._object_cache = objects.get(snippet.object_id)
+    return snippets
+
+
+def rendered_html(revision):
+    """ Gets the stored html for `revision`, rendering it on the fly for
+        rows that haven't been backfilled yet (see `render_revisions`).
+    """
+    from django.utils.safestring import mark_safe
+    from brubeck.templatetags.brubeck_tags import smarkdown
+
+    if revision.html or not revision.text:
+        return mark_safe(revision.html)
+    return smarkdown(revision.text)
+
+
+def render_revision(sender, instance, raw, **kwargs):
+    """ Renders the markdown for a Revision as it is written, so that pages
+        displaying it don't have to.
+    """
+    if not raw and not instance.html:
+        from brubeck.templatetags.brubeck_tags import smarkdown
+        instance.html = smarkdown(instance.text)
+
+
 def update_proof(sender, instance, created, raw, **kwargs):
     """ After saving a new Revision for a proof, we'd like to update the stored
         `proof_text`
@@ -90,5 +168,15 @@ def update_proof(sender, instance, created, raw, **kwargs):
             logger.debug('Error updating proof for %s: %s' % (instance, e))
 
 
-#models.signals.post_save.connect(index_revision, Revision)
+models.signals.pre_save.connect(render_revision, Revision)
 models.signals.post_save.connect(update_proof, Revision)
+# A Snippet is saved (directly, or as a Document) whenever its current
+# revision changes
+models.signals.post_save.connect(index_snippet, Snippet)
+models.signals.post_save.connect(index_snippet, Document)
+models.signals.post_delete.connect(unindex_snippet, Snippet)
+# As are those of an object whose name changes (see
+# `brubeck.models.provable`)
+# The index is only updated once the request's transaction is committed
+request_finished.connect(flush)
+got_request_exception.connect(discard)
@@ -0,0 +1,79 @@
+import uuid
+
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from brubeck.models.core import Property, Value
+from brubeck.models.wiki import Document
+from brubeck.models.snippets import Snippet
+
+
+class Version(models.Model):
+    """ A stamp for each kind of data (named after its model, or as it is
+        cached), replaced on every write to it. Caches in any process compare
+        stamps to tell whether they are still current.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    stamp = models.CharField(max_length=32)
+    modified = models.DateTimeField()
+
+    class Meta:
+        app_label = 'brubeck'
+
+    __unicode__ = lambda o: u'%s: %s' % (o.name, o.stamp)
+
+    @classmethod
+    def bump(cls, name):
+        """ Gives `name` a new stamp, one never used before (even if this
+            transaction is rolled back). Returns the old and new stamps.
+        """
+        new = {'stamp': uuid.uuid4().hex, 'modified': timezone.now()}
+        while True:
+            old = cls.current(name)
+            if old is None:
+                sid = transaction.savepoint()
+                try:
+                    cls.objects.create(name=name, **new)
+                    transaction.savepoint_commit(sid)
+                    return '', new['stamp']
+                except IntegrityError:
+                    # Created by another process in the meantime
+                    transaction.savepoint_rollback(sid)
+            elif cls.objects.filter(name=name, stamp=old).update(**new):
+                return old, new['stamp']
+
+    @classmethod
+    def current(cls, name):
+        """ The current stamp for `name`, or None if it has never had one """
+        stamps = cls.objects.filter(name=name).values_list('stamp',
+                                                           flat=True)
+        return stamps[0] if stamps else None
+
+    @classmethod
+    def stamps(cls, *names):
+        """ The (stamp, time modified) of each of `names`, in one query """
+        found = dict((v.name, (v.stamp, v.modified))
+                     for v in cls.objects.filter(name__in=names))
+        return [found.get(name, ('', None)) for name in names]
+
+
+def bump_version(sender, **kwargs):
+    """ Signal handler giving the sender's model a new Version stamp """
+    Version.bump(sender.__name__.lower())
+
+
+def bump_documents(sender, **kwargs):
+    """ Signal handler giving the descriptions a new Version stamp. Saving a
+        Snippet doesn't send the signals for its Document, so both connect.
+    """
+    Version.bump('document')
+
+# Spaces, traits and implications are bumped in `brubeck.models.provable`,
+# before the caches that depend on them are updated
+for model in (Property, Value):
+    post_save.connect(bump_version, model)
+    post_delete.connect(bump_version, model)
+for model in (Document, Snippet):
+    post_save.connect(bump_documents, model)
+    post_delete.connect(bump_documents, model)
@@ -44,6 +44,9 @@ class Revision(models.Model):
     """
     page = models.ForeignKey('Document', related_name='revisions')
     text = models.TextField()
+    # Rendered copy of `text`. Revisions are never edited once created, so
+    # this is filled in once (by whichever app knows the markup) and reused.
+    html = models.TextField(blank=True)
     # Commit information
     user = models.ForeignKey(User)
     comment = models.TextField()
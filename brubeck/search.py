@@ -1,117 +1,265 @@
-# Temporarily disabling elastic search for performance reasons
-#
-#import logging
-#import sys
-#
-#from django.conf import settings
-#from django.core.paginator import Paginator, Page
-#
-#from pyelasticsearch import ElasticSearch
-#
-#
-#class SearchPaginator(Paginator):
-#    def __init__(self, query, per_page, **kwargs):
-#        self.query = query
-#        super(SearchPaginator, self).__init__([], per_page, **kwargs)
-#
-#    def page(self, number):
-#        number = self.validate_number(number)
-#        bottom = (number - 1) * self.per_page
-#        result = client.search(self.query,
-#            **{'from': bottom, 'size': self.per_page})
-#        try:
-#            objects = result['hits']['hits']
-#        except KeyError:
-#            objects = []
-#        return Page(objects, number, self)
-#
-#    def _get_count(self):
-#        if self._count is None:
-#            try:
-#                self._count = client.search(
-#                    self.query, **{'from': 0, 'size': 1})['hits']['total']
-#            except KeyError:
-#                self._count = 0
-#        return self._count
-#    count = property(_get_count)
-#
-#
-#class BrubeckSearch(ElasticSearch):
-#    def __init__(self):
-#        super(BrubeckSearch, self).__init__(settings.BONSAI_URL)
-#        self._index = settings.BONSAI_INDEX
-#
-#    def get(self, doc_type, id):
-#        """ Retrieves the specified document """
-#        return super(BrubeckSearch, self).get(self._index, doc_type, id)
-#
-#    def index(self, doc, doc_type, id=None):
-#        """ Adds the given document to the index """
-#        return super(BrubeckSearch, self).index(doc, self._index, doc_type, id)
-#
-#    def search(self, query, body=None, doc_types=[], **query_params):
-#        """ Returns a SearchQueryset matching the given query """
-#        if not doc_types:
-#            doc_types = ['space', 'property', 'implication', 'trait']
-#        return super(BrubeckSearch, self).search(query, body=None,
-#            indexes=[self._index], doc_types=doc_types, **query_params)
-#
-#    def delete(self, doc_type, id):
-#        """ Deletes a document from the index """
-#        return super(BrubeckSearch, self).delete(self._index, doc_type, id)
-#
-#    def refresh(self):
-#        """ Refreshes the index """
-#        return super(BrubeckSearch, self).refresh(indexes=[self._index])
-#
-#
-#client = BrubeckSearch()
-#logger = logging.getLogger(__name__)
-#
-#
-#def index_revision(sender, instance, created, **kwargs):
-#    if 'test' in sys.argv:
-#        # No indexing, no message
-#        pass
-#    elif settings.DEBUG:
-#        logger.debug('Skipping indexing %s because DEBUG is on' % instance)
-#    else:
-#        s = instance.page.snippet
-#        name = s.object.name
-#        doc = {
-#            'name': name() if callable(name) else name,
-#            'text': s.current_text(),
-#        }
-#        log = client.index(doc, s.content_type.name, id=s.object_id)
-#        logger.debug('Indexed revision %s: %s' % (instance.id, log))
-#
-#
-## Bulk index manipulation seems to error out after several documents.
-## It seems to happen fairly consistently after ~1406 API calls. This is
-## (hopefully) an issue with Bonsai limiting query rates that shouldn't be
-## a problem on the live site (at least, not any time soon)
-#def _update_indices():
-#    from brubeck.models import Space, Property, Trait, Implication
-#    from brubeck.search import BrubeckSearch
-#
-#    client = BrubeckSearch()
-#
-#    for cls in [Space, Property, Trait, Implication]:
-#        for obj in cls.objects.all():
-#            r = client.get(cls.__name__.lower(), obj.id)
-#            text = obj.snippets.all()[0].current_text()
-#            if not r['exists'] or r['_source']['text'] != text:
-#                doc = {
-#                    'name': obj.name() if callable(obj.name) else obj.name,
-#                    'text': text
-#                }
-#                client.index(doc, cls.__name__.lower(), obj.id)
-#                logger.debug('Indexed: %s' % doc)
-#
-#
-#def _clear_indices():
-#    size = client.search('name:*')['hits']['total']
-#    logger.debug('Clearing %s indexed documents' % size)
-#    for r in client.search('name:*', size=size)['hits']['hits']:
-#        log = client.delete(r['_type'], r['_id'])
-#        logger.debug('Deleted indexed revision: %s' % log)
+# Provides full text search over the current description (and name) of every
+# object, using an SQLite FTS5 index kept on local disk at the
+# BRUBECK_SEARCH_INDEX setting (there is no text search if it isn't set). The
+# index is updated once a change to a snippet's current revision, or to the
+# name of the object it describes, has been committed, and can be rebuilt from
+# scratch with the `rebuild_search_index` command.
+import logging
+import re
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.paginator import Paginator, Page
+from django.db import transaction
+from django.db.models import Q
+
+
+logger = logging.getLogger(__name__)
+
+
+# Relative weights of matches in an object's name and its description
+NAME_WEIGHT, TEXT_WEIGHT = 10.0, 1.0
+
+_LINK = re.compile(r'\[([^\]]*)\]\([^)]*\)')  # [text](url)
+_MATH = re.compile(r'\\[()\[\]]')             # \( \) \[ \]
+_COMMAND = re.compile(r'\\([a-zA-Z]+)')       # \sigma
+_MARKUP = re.compile(r'[*_`#>{}^$\\|]+')
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+# Each thread's connections (by path), and the ids of the snippets it has
+# changed since they were last indexed
+_local = threading.local()
+
+
+def index_path():
+    return getattr(settings, 'BRUBECK_SEARCH_INDEX', None)
+
+
+def plain_text(text):
+    """ Strips markdown and MathJax markup, leaving the words to be indexed
+        (so that \\(\\sigma\\)-compact is indexed as "sigma-compact")
+    """
+    text = _LINK.sub(r'\1', text)
+    text = _MATH.sub(' ', text)
+    text = _COMMAND.sub(r'\1', text)
+    return _MARKUP.sub(' ', text)
+
+
+def _connect():
+    """ Gets this thread's connection to the index, creating the table on
+        first use, or None if there is no index. Raises an OperationalError
+        if SQLite was built without FTS5.
+    """
+    path = index_path()
+    if not path:
+        return None
+    connections = _local.__dict__.setdefault('connections', {})
+    if path not in connections:
+        db = sqlite3.connect(path)
+        try:
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS documents USING "
+                "fts5(name, text, tokenize='unicode61 remove_diacritics 1')")
+        except sqlite3.OperationalError:
+            db.close()
+            raise
+        connections[path] = db
+    return connections[path]
+
+
+def _match(query):
+    """ Converts user input into an FTS query matching all of its words """
+    words = _WORD.findall(plain_text(query))
+    return ' '.join('"%s"' % w.replace('"', '""') for w in words)
+
+
+class LocalSearch(object):
+    """ The index holds one row per Snippet, keyed by the Snippet's id """
+    def index(self, snippet):
+        """ Adds (or replaces) the given snippet in the index """
+        db = _connect()
+        if db is None:
+            return
+        name = snippet.object.name if snippet.object else ''
+        name = name() if callable(name) else name
+        with db:
+            db.execute('DELETE FROM documents WHERE rowid = ?', (snippet.pk,))
+            db.execute('INSERT INTO documents (rowid, name, text) '
+                'VALUES (?, ?, ?)', (snippet.pk, plain_text(unicode(name)),
+                    plain_text(snippet.current_text())))
+
+    def delete(self, id):
+        db = _connect()
+        if db is not None:
+            with db:
+                db.execute('DELETE FROM documents WHERE rowid = ?', (id,))
+
+    def clear(self):
+        db = _connect()
+        if db is not None:
+            with db:
+                db.execute('DELETE FROM documents')
+
+    def count(self, query):
+        match = _match(query)
+        if not match:
+            return 0
+        try:
+            db = _connect()
+            if db is None:
+                return 0
+            return db.execute('SELECT count(*) FROM documents '
+                'WHERE documents MATCH ?', (match,)).fetchone()[0]
+        except sqlite3.OperationalError as e:
+            logger.error('Error searching for %r: %s' % (query, e))
+            return 0
+
+    def search(self, query, offset=0, limit=10):
+        """ Gets the ids of the best matching Snippets, best first """
+        match = _match(query)
+        if not match:
+            return []
+        try:
+            db = _connect()
+            if db is None:
+                return []
+            return [row[0] for row in db.execute('SELECT rowid FROM '
+                'documents WHERE documents MATCH ? ORDER BY '
+                'bm25(documents, ?, ?) LIMIT ? OFFSET ?',
+                (match, NAME_WEIGHT, TEXT_WEIGHT, limit, offset))]
+        except sqlite3.OperationalError as e:
+            logger.error('Error searching for %r: %s' % (query, e))
+            return []
+
+
+client = LocalSearch()
+
+
+class SearchPaginator(Paginator):
+    """ Pages through search results, fetching only the requested page """
+    def __init__(self, query, per_page, **kwargs):
+        self.query = query
+        super(SearchPaginator, self).__init__([], per_page, **kwargs)
+
+    def page(self, number):
+        from brubeck.models import Snippet, prefetch_objects
+
+        number = self.validate_number(number)
+        ids = client.search(self.query, offset=(number - 1) * self.per_page,
+            limit=self.per_page)
+        snippets = Snippet.objects.select_related('revision').in_bulk(ids)
+        return Page(prefetch_objects([snippets[id] for id in ids
+            if id in snippets]), number, self)
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = client.count(self.query)
+        return self._count
+    count = property(_get_count)
+
+
+def _pending():
+    return _local.__dict__.setdefault('pending', set())
+
+
+def _changed(id):
+    """ Notes that a snippet has changed, indexing it straight away unless
+        that would be before the change is committed
+    """
+    if index_path():
+        _pending().add(id)
+        if not transaction.is_managed():
+            flush()
+
+
+def flush(**kwargs):
+    """ Indexes (or removes) every snippet changed on this thread since the
+        last flush, as they are now. Run when a request finishes, after its
+        transaction is committed.
+    """
+    from brubeck.models import Snippet
+
+    ids = _pending()
+    if not ids:
+        return
+    _local.pending = set()
+    snippets = Snippet.objects.select_related('revision').in_bulk(list(ids))
+    for id in sorted(ids):
+        try:
+            if id in snippets:
+                client.index(snippets[id])
+            else:
+                client.delete(id)
+        except Exception as e:
+            logger.error('Error indexing snippet %s: %s' % (id, e))
+
+
+def discard(**kwargs):
+    """ Forgets the changed snippets, as their transaction was rolled back """
+    _local.pending = set()
+
+
+def index_snippet(sender, instance, created, raw, **kwargs):
+    """ Re-indexes a snippet whenever it is saved (so when its current
+        revision changes).
+    """
+    if not raw:
+        # A Snippet shares its id with its Document
+        _changed(instance.pk)
+
+
+def unindex_snippet(sender, instance, **kwargs):
+    _changed(instance.pk)
+
+
+def note_rename(sender, instance, raw, **kwargs):
+    """ Notes whether a Space or Property is being renamed, as the traits (and
+        implications) named after it then need re-indexing too
+    """
+    instance._renamed = bool(index_path() and instance.pk and not raw and
+        sender.objects.filter(pk=instance.pk).exclude(name=instance.name)
+        .exists())
+
+
+def _described(model, ids):
+    """ The ids of the Snippets describing objects of `model` """
+    from brubeck.models import Snippet
+
+    ct = ContentType.objects.get_for_model(model)
+    return Snippet.objects.filter(content_type__pk=ct.id,
+        object_id__in=ids).values_list('id', flat=True)
+
+
+def reindex_object(sender, instance, created, raw, **kwargs):
+    """ Re-indexes the snippets describing a Space, Property or Implication
+        when it is edited, as its name (or formulae) may have changed
+    """
+    from brubeck.models import Space, Property, Trait, Implication
+
+    if created or raw or not index_path():
+        return
+    snippets = list(_described(sender, [instance.pk]))
+    if getattr(instance, '_renamed', False):
+        # Traits are named after their space and property, and implications
+        # after their properties
+        field = 'space' if isinstance(instance, Space) else 'property'
+        traits = Trait.objects.filter(**{field: instance})
+        snippets.extend(_described(Trait, traits.values('id')))
+        if isinstance(instance, Property):
+            pid = '%s=' % instance.pk
+            implications = Implication.objects.filter(
+                Q(antecedent__contains=pid) | Q(consequent__contains=pid))
+            snippets.extend(_described(Implication,
+                                       implications.values('id')))
+    for id in snippets:
+        _changed(id)
+
+
+def rebuild_index():
+    """ Re-indexes every Snippet """
+    from brubeck.models import Snippet
+
+    client.clear()
+    for snippet in Snippet.objects.select_related('revision').iterator():
+        client.index(snippet)
@@ -1,55 +1,97 @@
-# Defines Sitemaps which can be used to construct a sitemap.xml file
-# TODO: Split into sitemap index. Set changefreq, etc.
+# Defines Sitemaps which can be used to construct a sitemap.xml file. These
+# are split into fixed-size pages and served through the (cached) sitemap
+# index in brubeck.views.sitemaps
+# TODO: Set changefreq, etc.
 from django.contrib.sitemaps import Sitemap
 from django.core.urlresolvers import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, utc
 
+from brubeck import utils
 from brubeck.models import Space, Property, Trait, Implication
 
 
-class SpaceSitemap(Sitemap):
+class ObjectSitemap(Sitemap):
+    """ Lists a page for each object of `model`. Items are dicts holding only
+        the columns needed to reverse their urls and the last time their
+        description changed.
+    """
+    limit = 1000
+    model = None
+    url_name = None
+    fields = ('slug',)
+
     def items(self):
-        return Space.objects.all()
+        qs = utils.select_from_snippets(self.model.objects.order_by('id'),
+            last_touched='d.last_touched')
+        return qs.values(*self.fields + ('last_touched',))
 
+    def url_kwargs(self, item):
+        return {'slug': item['slug']}
 
-class PropertySitemap(Sitemap):
-    def items(self):
-        return Property.objects.all()
+    def location(self, item):
+        return reverse(self.url_name, kwargs=self.url_kwargs(item))
 
+    def lastmod(self, item):
+        touched = item['last_touched']
+        # Some database backends return extra selections as strings
+        if isinstance(touched, basestring):
+            touched = parse_datetime(touched)
+            if touched and is_naive(touched):
+                touched = make_aware(touched, utc)
+        return touched
 
-class TraitSitemap(Sitemap):
-    def items(self):
-        return Trait.objects.all()
 
+class SpaceSitemap(ObjectSitemap):
+    model = Space
+    url_name = 'brubeck:space'
 
-class ImplicationSitemap(Sitemap):
-    def items(self):
-        return Implication.objects.all()
+
+class PropertySitemap(ObjectSitemap):
+    model = Property
+    url_name = 'brubeck:property'
 
 
-class _EditMixin(object):
-    def location(self, object):
-        return object.get_edit_url()
+class TraitSitemap(ObjectSitemap):
+    model = Trait
+    url_name = 'brubeck:trait'
+    fields = ('space__slug', 'property__slug')
 
+    def url_kwargs(self, item):
+        return {'space': item['space__slug'],
+                'property': item['property__slug']}
 
-class EditSpaceSitemap(SpaceSitemap, _EditMixin):
-    pass
 
+class ImplicationSitemap(ObjectSitemap):
+    model = Implication
+    url_name = 'brubeck:implication'
+    fields = ('id',)
 
-class EditPropertySitemap(PropertySitemap, _EditMixin):
-    pass
+    def url_kwargs(self, item):
+        return {'id': item['id']}
 
 
-class EditTraitSitemap(TraitSitemap, _EditMixin):
-    pass
+class EditSpaceSitemap(SpaceSitemap):
+    url_name = 'brubeck:edit_space'
 
 
-class EditImplicationSitemap(ImplicationSitemap, _EditMixin):
-    pass
+class EditPropertySitemap(PropertySitemap):
+    url_name = 'brubeck:edit_property'
+
+
+class EditTraitSitemap(TraitSitemap):
+    url_name = 'brubeck:edit_trait'
+
+
+class EditImplicationSitemap(ImplicationSitemap):
+    url_name = 'brubeck:edit_implication'
 
 
 class TraitProofSitemap(TraitSitemap):
-    def location(self, object):
-        return object.get_proof_url()
+    url_name = 'brubeck:prove_trait'
+
+    def url_kwargs(self, item):
+        return {'s': item['space__slug'], 'p': item['property__slug']}
 
 
 class ViewSitemap(Sitemap):
@@ -1,5 +1,4 @@
 from django import template
-from django.db.models.loading import get_model
 from django.utils.safestring import mark_safe
 
 import markdown
@@ -12,62 +11,6 @@ def get(d, k):
     return d.get(k, '')
 
 
-@register.simple_tag
-def contradicts_tag(cx, s, p, t):
-    if s == 144:
-        return 'class="missing"'
-
-    # Compensate for renumbering
-    p = {
-        5: 11,
-        6: 12,
-        7: 13,
-        8: 14,
-        11: 5,
-        12: 6,
-        13: 7,
-        14: 8,
-        34: 35,
-        35: 34,
-        59: 60,
-        60: 61
-    }.get(p, p)
-
-    try:
-        cxv = cx[s][p]
-    except:
-        return ''
-    if t == '':
-        if cxv in ['na', '']:
-            return ''
-        elif cxv in [0, '0']:
-            return 'class="no"'
-        else:
-            return 'class="yes"'
-    # Otherwise t is a trait and we can look up:
-    matches = (t.value.name == 'True' and cxv == '1') or \
-              (t.value.name == 'False' and cxv == '0') or \
-              (t.value.name == 'False' and cxv == 'na')
-    if not matches:
-        if cxv in ['na', '']:
-            return 'class="extra"'
-        return 'class="error %s"' % cxv
-    return ''
-
-
-@register.assignment_tag
-def lookup_document(doc):
-    """ Looks up an object from its corresponding elasticsearch document """
-    model = get_model('brubeck', doc['_type'])
-    try:
-        return model.objects.get(id=doc['_id'])
-    except model.DoesNotExist:
-        # This may occur if a trait has been deleted but not purged from the
-        # index
-        from brubeck.search import client
-        client.delete(doc['_type'], doc['_id'])
-
-
 @register.assignment_tag
 def get_properties():
     """ Adds the complete list of Properties to the template context. """
@@ -91,6 +34,13 @@ def columns(l, num):
     return _columns
 
 
+@register.filter
+def rendered(revision):
+    """ Displays a Revision using the html stored when it was saved """
+    from brubeck.models.snippets import rendered_html
+    return rendered_html(revision)
+
+
 def _escape(string, chars):
     for c in chars:
         string = string.replace(c, '\\' + c)
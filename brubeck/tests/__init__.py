@@ -1,5 +1,6 @@
 from brubeck.logic.tests import *
 
+from .commands import *
+from .search import *
 from .simple import *
 from .views import *
-#from .search import *
@@ -0,0 +1,289 @@
+# Tests brubeck's management commands
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from brubeck.benchmark import Benchmark
+from brubeck.export import Snapshot
+from brubeck.logic.formula.utils import human_to_formula
+from brubeck.management.commands.import_traits import Command
+from brubeck.logic.matrix import TraitMatrix, UNKNOWN
+from brubeck.models import Space, Property, Trait, Implication, Value, \
+    Snippet, Revision
+
+
+class RenderRevisionsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        space = Space.objects.create(name='Space')
+        self.snippet = Snippet.objects.create(object=space)
+
+    def test_rendered_on_save(self):
+        """ Tests that new revisions store their rendered html """
+        self.snippet.add_revision(text='Some *text*', user=self.user)
+        revision = Revision.objects.get()
+        assert '<em>text</em>' in revision.html
+        self.assertEqual(self.snippet.current_html(), revision.html)
+
+    def test_backfill(self):
+        """ Tests that the command fills in html for older revisions, in
+            shards if requested
+        """
+        for i in range(5):
+            self.snippet.add_revision(text='Text %s' % i, user=self.user)
+        Revision.objects.update(html='')
+        call_command('render_revisions', shard=0, shards=2, batch_size=2)
+        for r in Revision.objects.all():
+            self.assertEqual(bool(r.html), r.id % 2 == 0)
+        call_command('render_revisions', shard=1, shards=2, batch_size=2)
+        assert not Revision.objects.filter(html='').exists()
+        self.assertEqual(Revision.objects.get(text='Text 0').html,
+            '<p>Text 0</p>')
+
+
+class ExportTest(TestCase):
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.space = Space.objects.create(name='Space')
+        self.other = Space.objects.create(name='Other', fully_defined=False)
+        self.A = Property.objects.create(name='A')
+        self.B = Property.objects.create(name='B')
+        self.C = Property.objects.create(name='C')
+        self.implication = Implication.objects.create(
+            antecedent=human_to_formula('A + ~C'),
+            consequent=human_to_formula('B'))
+        Trait.objects.create(space=self.space, property=self.A,
+            value=Value.objects.get(name='True'))
+        Trait.objects.create(space=self.space, property=self.C,
+            value=Value.objects.get(name='False'))
+        self.path = os.path.join(tempfile.mkdtemp(), 'export.npz')
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_round_trip(self):
+        """ Tests that an export loads back into equivalent objects """
+        call_command('export_database', self.path)
+        snapshot = Snapshot.load(self.path)
+
+        self.assertEqual([s.name for s in snapshot.spaces], ['Space', 'Other'])
+        assert not snapshot.spaces[1].fully_defined
+        self.assertEqual([p.slug for p in snapshot.properties],
+            ['a', 'b', 'c'])
+        self.assertEqual(snapshot.matrix.get(self.space.id, self.B.id),
+            Value.TRUE)  # Added by the prover
+        self.assertEqual(snapshot.matrix.get(self.space.id, self.C.id),
+            Value.FALSE)
+        self.assertEqual(snapshot.matrix.get(self.other.id, self.A.id),
+            UNKNOWN)
+        i = snapshot.implications[0]
+        self.assertEqual(i.id, self.implication.id)
+        self.assertEqual(i.name(), self.implication.name())
+
+    def test_aligned(self):
+        """ Tests that traits of spaces and properties read after the rows
+            and columns are left out, rather than filling the wrong cells
+        """
+        matrix = TraitMatrix.from_ids([self.other.id], [self.A.id, self.C.id])
+        self.assertEqual(matrix.values.tolist(), [[UNKNOWN, UNKNOWN]])
+        matrix = TraitMatrix.from_ids([self.space.id], [self.C.id])
+        self.assertEqual(matrix.values.tolist(), [[Value.FALSE]])
+
+    def test_download(self):
+        """ Tests that the written export is served by the api """
+        with override_settings(BRUBECK_EXPORT_PATH=self.path):
+            url = '/brubeck/api/export/'
+            self.assertEqual(self.client.get(url).status_code, 404)
+            call_command('export_database')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, open(self.path, 'rb').read())
+
+
+class BenchmarkTest(TestCase):
+    fixtures = ['values.json']
+
+    def test_scenarios(self):
+        """ Tests that the benchmark builds its data and reports on each
+            scenario requested
+        """
+        benchmark = Benchmark(spaces=5, properties=6, implications=4,
+            samples=2)
+        with override_settings(BRUBECK_SEARCH_INDEX=os.path.join(
+                tempfile.mkdtemp(), 'index.sqlite3')):
+            results = benchmark.run(['formula_search'])
+        self.assertEqual([r['scenario'] for r in results],
+            ['setup', 'trait_insert', 'formula_search'])
+        self.assertEqual(Space.objects.count(), 5)
+        self.assertEqual(Implication.objects.count(), 4)
+        for r in results:
+            assert r['queries'] > 0
+            assert r['seconds'] >= 0
+            assert 0 <= r['peak_rss_growth_kb'] <= r['process_peak_rss_kb']
+        peaks = [r['process_peak_rss_kb'] for r in results]
+        self.assertEqual(peaks, sorted(peaks))
+        self.assertEqual(results[1]['traits'], Trait.objects.count())
+
+
+class ImportTraitsTest(TestCase):
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.space = Space.objects.create(name='Space')
+        self.other = Space.objects.create(name='Other')
+        self.A, self.B, self.C = [Property.objects.create(name=name)
+                                  for name in 'ABC']
+        Implication.objects.create(antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B'))
+        self.implication = Implication.objects.create(
+            antecedent=human_to_formula('B'),
+            consequent=human_to_formula('C'))
+        self.path = tempfile.mktemp()
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _import(self, content, **options):
+        with open(self.path, 'w') as f:
+            f.write(content)
+        call_command('import_traits', self.path, **options)
+
+    def _check(self, content):
+        """ Runs the command directly, so that errors aren't turned into
+            SystemExits
+        """
+        with open(self.path, 'w') as f:
+            f.write(content)
+        Command().handle(self.path, format='csv', user='brubeck',
+            dry_run=False)
+
+    def test_grid(self):
+        """ Tests that a grid imports, with its consequences derived and
+            proven as the Prover would
+        """
+        self._import(',A,B,C\nSpace,+,,\nother,,,False\n')
+        self.assertEqual(Trait.objects.count(), 6)
+        for space, value in [(self.space, Value.TRUE),
+                             (self.other, Value.FALSE)]:
+            self.assertEqual(set(space.trait_set.values_list('value_id',
+                flat=True)), set([value]))
+        B = self.space.trait_set.get(property=self.B)
+        C = self.space.trait_set.get(property=self.C)
+        self.assertEqual(C.snippet.revision.text,
+            't%s,i%s,' % (B.id, self.implication.id))
+        assert C.snippet.automatically_added()
+        assert not self.space.trait_set.get(property=self.A).snippet\
+            .automatically_added()
+
+    def test_contradiction(self):
+        """ Tests that nothing is saved if the file contradicts what is known
+        """
+        Trait.objects.create(space=self.other, property=self.A,
+            value=Value.objects.get(name='True'))
+        count = Trait.objects.count()
+        for content in ['space,property,value\nSpace,A,+\nSpace,C,-\n',
+                        'space,property,value\nother,C,-\n',
+                        'space,property,value\nNowhere,C,-\n']:
+            self.assertRaises(CommandError, self._check, content)
+        self.assertEqual(Trait.objects.count(), count)
+
+    def test_rows(self):
+        """ Tests that blank rows are skipped and short ones are reported by
+            line
+        """
+        self._import('space,property,value\n\nSpace,A,+\n,,\n')
+        self.assertEqual(self.space.trait_set.count(), 3)
+        try:
+            self._check('space,property,value\nother,A,+\nother,B\n')
+        except CommandError as e:
+            assert 'Line 3' in str(e)
+        else:
+            self.fail('The short row was accepted')
+
+    def test_converses(self):
+        """ Tests that only converses involving the imported properties are
+            re-checked
+        """
+        D, E = [Property.objects.create(name=name) for name in 'DE']
+        unrelated = Implication.objects.create(
+            antecedent=human_to_formula('D'), consequent=human_to_formula('E'))
+        Implication.objects.update(open_converse=True)
+        self._import('space,property,value\nSpace,C,+\nSpace,B,-\n')
+        self.assertEqual(Implication.objects.get(id=unrelated.id)
+            .open_converse, True)
+        self.assertEqual(Implication.objects.get(id=self.implication.id)
+            .open_converse, False)
+
+    def test_json(self):
+        """ Tests JSON imports, skipping traits that are already known """
+        Trait.objects.create(space=self.space, property=self.C,
+            value=Value.objects.get(name='True'))
+        self._import(json.dumps([
+            {'space': 'space', 'property': 'c', 'value': 'True'},
+            {'space': 'other', 'property': 'b', 'value': 'True',
+             'description': 'Because'}]), format='json')
+        self.assertEqual(self.other.trait_set.get(property=self.B)
+            .description, 'Because')
+        self.assertEqual(self.space.trait_set.count(), 1)
+        self.assertEqual(self.other.trait_set.count(), 2)
+
+
+class RedundantImplicationsTest(TestCase):
+    fixtures = ['values.json']
+
+    def setUp(self):
+        for name in 'ABCD':
+            Property.objects.create(name=name)
+        self.implications = [Implication.objects.create(
+            antecedent=human_to_formula(a), consequent=human_to_formula(c))
+            for a, c in [('A', 'B'), ('B', 'C'), ('A', 'C'), ('A + D', 'B'),
+                         ('~C', '~A'), ('A | B', 'C'), ('A', 'B')]]
+
+    def _redundant(self):
+        return list(Implication.objects.filter(redundant=True)
+            .order_by('id').values_list('id', flat=True))
+
+    def test_marking(self):
+        """ Tests that derivable implications are marked, keeping the oldest
+            of equivalent ones, and skipped by the prover
+        """
+        i = self.implications
+        call_command('find_redundant_implications', dry_run=True)
+        self.assertEqual(self._redundant(), [])
+        call_command('find_redundant_implications')
+        self.assertEqual(self._redundant(),
+            [i[2].id, i[3].id, i[4].id, i[5].id, i[6].id])
+
+        space = Space.objects.create(name='Space')
+        Trait.objects.create(space=space, property=Property.objects.get(
+            name='A'), value=Value.objects.get(name='True'))
+        self.assertEqual(space.trait_set.count(), 3)
+        for t in space.trait_set.exclude(property__name='A'):
+            assert t.snippet.revision.text.endswith('i%s,' % i[0].id) or \
+                t.snippet.revision.text.endswith('i%s,' % i[1].id)
+
+        # Deleting an implication may make others necessary again, but not
+        # those that follow without it
+        i[1].delete()
+        self.assertEqual(self._redundant(), [i[3].id, i[4].id, i[6].id])
+
+    def test_edit(self):
+        """ Tests that editing an implication only unmarks those that were
+            derived from it
+        """
+        i = self.implications
+        call_command('find_redundant_implications')
+        i[0].consequent = human_to_formula('D')
+        i[0].save()
+        # A => C and A + D => B don't follow from A => D, but the others
+        # follow from them
+        self.assertEqual(self._redundant(), [i[4].id, i[5].id, i[6].id])
@@ -1,38 +1,150 @@
-# Tests functionality related to bonsai elasticsearch
+# Tests the local full text search index
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.utils import override_settings
 
-from brubeck.search import BrubeckSearch
+from brubeck.logic.formula.utils import human_to_formula
+from brubeck.models import Space, Property, Trait, Implication, Value, \
+    Snippet
+from brubeck import search
+from brubeck.search import SearchPaginator, client, plain_text
 
 
 class SearchTest(TestCase):
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.settings = override_settings(
+            BRUBECK_SEARCH_INDEX=os.path.join(self.dir, 'index.sqlite3'))
+        self.settings.enable()
+        search.discard()
+        self.user = User.objects.create(username='user')
+
+    def tearDown(self):
+        search.discard()
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    def _describe(self, obj, text):
+        snippet = Snippet.objects.create(object=obj)
+        snippet.add_revision(text=text, user=self.user)
+        search.flush()  # As if committed
+        return snippet
+
+    def test_plain_text(self):
+        """ Tests that markup is stripped before indexing """
+        text = plain_text(r'A \(\sigma\)-*compact* [space](/spaces/s/)')
+        self.assertEqual(text.split(), ['A', 'sigma', '-', 'compact', 'space'])
+
     def test_indexing(self):
-        """ Tests that documents are stored and deleted properly in the index
+        """ Tests that snippets are (re-)indexed as they are revised """
+        space = Space.objects.create(name='Long line')
+        snippet = self._describe(space, 'Not *metrizable*')
+        self.assertEqual(client.search('metrizable'), [snippet.pk])
+        self.assertEqual(client.search('line'), [snippet.pk])
+
+        snippet.add_revision(text='Locally homeomorphic to R', user=self.user)
+        # Only indexed once the change is committed
+        self.assertEqual(client.search('homeomorphic'), [])
+        search.flush()
+        self.assertEqual(client.search('metrizable'), [])
+        self.assertEqual(client.search('homeomorphic'), [snippet.pk])
+
+        snippet.delete()
+        search.flush()
+        self.assertEqual(client.search('homeomorphic'), [])
+
+    def test_renaming(self):
+        """ Tests that renamed objects are re-indexed, along with the traits
+            and implications named after them
         """
-        client = BrubeckSearch()
+        space = Space.objects.create(name='Long line')
+        p = Property.objects.create(name='Compact')
+        q = Property.objects.create(name='Connected')
+        trait = Trait.objects.create(space=space, property=p,
+            value=Value.objects.get(name='True'))
+        implication = Implication.objects.create(
+            antecedent=human_to_formula('~Compact'),
+            consequent=human_to_formula('Connected'))
+        snippets = [self._describe(obj, 'Text')
+                    for obj in [space, p, trait, implication]]
+        self.assertEqual(sorted(client.search('compact')),
+                         [s.pk for s in snippets[1:]])
 
-        doc = {
-            'id': 1,
-            'type': 'bonsai-test-document',
-            'name': 'test-name'
-        }
+        space.name = 'Sorgenfrey line'
+        space.save()
+        p.name = 'Paracompact'
+        p.save()
+        search.flush()
+        self.assertEqual(client.search('compact'), [])
+        self.assertEqual(sorted(client.search('paracompact')),
+                         [s.pk for s in snippets[1:]])
+        self.assertEqual(sorted(client.search('sorgenfrey')),
+                         [snippets[0].pk, snippets[2].pk])
 
-        # Delete the document (in case it already exists from partial test)
-        client.delete(doc['type'], doc['id'])
+        Property.objects.create(name='Hausdorff')
+        implication.consequent = human_to_formula('Hausdorff')
+        implication.save()
+        search.flush()
+        self.assertEqual(client.search('connected'), [])
+        self.assertEqual(client.search('hausdorff'), [snippets[3].pk])
 
-        # Verify that the document does not exist
-        assert not client.get(doc['type'], doc['id'])['exists']
+    def test_ranking(self):
+        """ Tests that matching names rank above matching descriptions, and
+            that results are paged
+        """
+        compact = self._describe(Property.objects.create(name='Compact'),
+            'Every open cover has a finite subcover')
+        others = [self._describe(Space.objects.create(name='Space %s' % i),
+            'A compact space') for i in range(3)]
+        paginator = SearchPaginator('compact', 2)
+        self.assertEqual(paginator.count, 4)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(paginator.page(1).object_list[0], compact)
+        self.assertEqual(set(paginator.page(1).object_list +
+            paginator.page(2).object_list), set([compact] + others))
 
-        # Add it and test that it now does exist
-        client.index(doc, doc['type'], doc['id'])
-        client.refresh()
-        assert client.get(doc['type'], doc['id'])['exists']
+    def test_rebuild(self):
+        """ Tests that the index can be rebuilt from scratch """
+        snippet = self._describe(Space.objects.create(name='Space'), 'Text')
+        client.clear()
+        call_command('rebuild_search_index')
+        self.assertEqual(client.search('text'), [snippet.pk])
 
-        # Search for it
-        assert client.search('name:%s' % doc['name'], doc_types=[doc['type']])[
-               'hits']['total'] == 1
+    def test_view(self):
+        self._describe(Space.objects.create(name='Cantor set'), 'Perfect')
+        response = self.client.get(reverse('brubeck:search'),
+            {'q': 'perfect'})
+        self.assertContains(response, 'Cantor set')
 
-        # Delete it
-        client.delete(doc['type'], doc['id'])
+    def test_rollback(self):
+        """ Tests that changes rolled back are never indexed """
+        snippet = Snippet.objects.create(object=Space.objects.create(
+            name='Space'))
+        snippet.add_revision(text='Rolled back', user=self.user)
+        search.discard()
+        search.flush()
+        self.assertEqual(client.search('rolled'), [])
 
-        # And make sure it was deleted
-        assert not client.get(doc['type'], doc['id'])['exists']
+    def test_disabled(self):
+        """ Tests that nothing is indexed without a path for the index, and
+            that search still works without a usable index
+        """
+        with override_settings(BRUBECK_SEARCH_INDEX=None):
+            self._describe(Space.objects.create(name='Cantor set'),
+                'Perfect')
+            self.assertEqual(client.search('perfect'), [])
+        self.assertEqual(client.search('perfect'), [])
+        # SQLite can't open a directory, as if it had no FTS5
+        with override_settings(BRUBECK_SEARCH_INDEX=self.dir):
+            self.assertEqual(client.search('perfect'), [])
+            response = self.client.get(reverse('brubeck:search'),
+                {'q': 'perfect'})
+        self.assertEqual(response.status_code, 200)
@@ -4,7 +4,9 @@ from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
 
+from brubeck.logic.matrix import TraitMatrix
 from brubeck.models import Space, Property, Trait, Implication, Value, ValueSet
+from brubeck.utils import compare_to_counterexamples
 
 
 class SmokeTests(TestCase):
@@ -75,5 +77,16 @@ class SmokeTests(TestCase):
         admin.save()
 
         self.client.login(username='admin', password='pass')
-        response = self.client.get(url, {'start': 1, 'end': 2})
+        response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['rows']),
+            Space.defined_objects.count())
+
+    def test_table_comparison(self):
+        """ Checks the comparison with the Counterexamples table, in which
+            space 1 has properties 1 and 2
+        """
+        matrix = TraitMatrix([1, 1000], [1, 2], [[0, Value.FALSE],
+                                                 [Value.TRUE, 0]])
+        self.assertEqual(compare_to_counterexamples(matrix).tolist(),
+            [['yes', 'error 1'], ['missing', 'missing']])
@@ -1,12 +1,28 @@
 # Tests the core brubeck views
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import F
+from django.template.loader import render_to_string
 from django.test import TestCase
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
 
 from brubeck.logic.formula.utils import human_to_formula
+from brubeck.logic import similarity
+from brubeck.logic.similarity import SimilarityIndex
+from brubeck.mining import mine
 from brubeck.models import Space, Property, Trait, Implication, Value, \
-    Profile, Revision
+    Profile, Revision, Snippet, Version
 
 
 class RegistrationTest(TestCase):
@@ -154,23 +170,67 @@ class CRUDTest(TestCase):
         self.assertEqual(space.snippets.all()[0].revision.id, 1)
 
 
-#class SitemapTest(TestCase):
-#    """ Tests sitemap configuration """
-#    fixtures = ['values.json']
-#
-#    def setUp(self):
-#        s = Space.objects.create(name='space')
-#        p = Property.objects.create(name='property')
-#        Trait.objects.create(space=s, property=p,
-#           value=Value.objects.all()[0])
-#
-#    def test_sitemap(self):
-#        from django.contrib.sitemaps.views import sitemap
-#        from django.http import HttpRequest
-#
-#        from brubeck.sitemaps import sitemap as brubeck_sitemap
-#
-#        sitemap(HttpRequest(), brubeck_sitemap)
+class SitemapTest(TestCase):
+    """ Tests sitemap configuration """
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.cache = tempfile.mkdtemp()
+        user = User.objects.create(username='user')
+        s = Space.objects.create(name='space')
+        p = Property.objects.create(name='property')
+        t = Trait.objects.create(space=s, property=p,
+            value=Value.objects.all()[0])
+        for obj in [s, p, t]:
+            Snippet.objects.create(object=obj).add_revision(text='',
+                user=user)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache)
+
+    def test_sitemap(self):
+        with override_settings(BRUBECK_SITEMAP_CACHE=self.cache):
+            response = self.client.get(reverse('brubeck:sitemap'))
+            self.assertContains(response, 'sitemap-trait.xml')
+
+            url = reverse('brubeck:sitemap_section',
+                kwargs={'section': 'prove_trait'})
+            response = self.client.get(url)
+            self.assertContains(response, Trait.objects.get()
+                .get_proof_url())
+            assert '<lastmod>' in response.content
+
+            # Served from disk while nothing changes ...
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(url).content,
+                    response.content)
+            # ... and regenerated when it does
+            Trait.objects.all().delete()
+            self.assertNotContains(self.client.get(url), '/proof/')
+            self.assertEqual(len(os.listdir(self.cache)), 2)
+
+            # Other hosts' copies are left alone
+            self.client.get(url, HTTP_HOST='other.example.com')
+            self.assertEqual(len(os.listdir(self.cache)), 3)
+            self.client.get(url)
+            self.assertEqual(len(os.listdir(self.cache)), 3)
+
+    def test_concurrent_cleanup(self):
+        """ Tests that a stale copy removed by another worker is ignored """
+        with override_settings(BRUBECK_SITEMAP_CACHE=self.cache):
+            url = reverse('brubeck:sitemap')
+            self.client.get(url)
+            Trait.objects.all().delete()
+            remove = os.remove
+            def raced(path):
+                remove(path)
+                remove(path)
+            os.remove = raced
+            try:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            finally:
+                os.remove = remove
 
 
 #class SearchViewTest(TestCase):
@@ -205,3 +265,541 @@ class CRUDTest(TestCase):
 #    def test_both(self):
 #        response = self.client.get(self.url, {'q': 'compact + connected'})
 #        self.assertTemplateUsed(response, 'brubeck/search/search.html')
+
+
+class DetailQueryTest(TestCase):
+    """ Checks that detail pages take a fixed number of queries, however many
+        traits they list
+    """
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username='user')
+        self.space = self._create(Space, name='Space')
+        self.property = self._create(Property, name='Property')
+        self.other = self._create(Property, name='Other')
+        self.implication = self._create(Implication,
+            antecedent=human_to_formula('Property'),
+            consequent=human_to_formula('Other'))
+        self.dir = tempfile.mkdtemp()
+        self.settings = override_settings(BRUBECK_SIMILARITY_INDEX=
+            os.path.join(self.dir, 'similarity.npz'))
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    def _create(self, model, **kwargs):
+        obj = model.objects.create(**kwargs)
+        Snippet.objects.create(object=obj).add_revision(text='',
+            user=self.user)
+        return obj
+
+    def _add_traits(self, n):
+        T, F = Value.objects.get(name='True'), Value.objects.get(name='False')
+        for i in range(n):
+            count = Trait.objects.count()
+            s = self._create(Space, name='S%s' % count)
+            p = self._create(Property, name='P%s' % count)
+            self._create(Trait, space=self.space, property=p, value=T)
+            # Implies Other, which the trait's page lists
+            self._create(Trait, space=s, property=self.property, value=T)
+            # A counterexample to the converse of the implication
+            cx = self._create(Space, name='C%s' % count)
+            self._create(Trait, space=cx, property=self.other, value=T)
+            self._create(Trait, space=cx, property=self.property, value=F)
+            # And a space where Other is unknown
+            self._create(Space, name='U%s' % count)
+
+    def test_query_counts(self):
+        added = 0
+        for n in [2, 30]:
+            self._add_traits(n)
+            added += n
+            similarity.rebuild()
+            # The similar spaces are read from the index alone
+            with self.assertNumQueries(4):
+                response = self.client.get(self.space.get_absolute_url())
+            assert response.context['similar']
+            with self.assertNumQueries(5):
+                response = self.client.get(self.other.get_absolute_url())
+            # Unknown in Space and each U space
+            self.assertEqual(response.context['unknown_extra'], added - 2)
+            with self.assertNumQueries(12):
+                response = self.client.get(
+                    self.implication.get_absolute_url())
+            self.assertEqual(response.context['reverse_extra'],
+                             max(added - 3, 0))
+            trait = Trait.objects.filter(property=self.property)[0]
+            with self.assertNumQueries(7):
+                self.client.get(trait.get_absolute_url())
+
+
+class AdminTest(TestCase):
+    """ Checks that admin changelists take a fixed number of queries """
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User(username='admin', is_staff=True, is_superuser=True)
+        self.user.set_password('pass')
+        self.user.save()
+        self.client.login(username='admin', password='pass')
+        self.space = Space.objects.create(name='Space')
+
+    def _add_traits(self, n):
+        T = Value.objects.get(name='True')
+        for i in range(n):
+            p = Property.objects.create(name='P%s' % Property.objects.count())
+            t = Trait.objects.create(space=self.space, property=p, value=T)
+            Snippet.objects.create(object=t).add_revision(
+                text='Description', user=self.user)
+
+    def test_changelists(self):
+        for n in [2, 20]:
+            self._add_traits(n)
+            with self.assertNumQueries(4):
+                response = self.client.get('/admin/brubeck/trait/')
+            self.assertContains(response, 'Description',
+                count=Trait.objects.count())
+            self.assertEqual(response.context['cl'].result_list[0]
+                .last_editor, 'admin')
+            with self.assertNumQueries(4):
+                response = self.client.get('/admin/brubeck/profile/')
+            self.assertEqual(response.context['cl'].result_list[0]
+                .revision_count, Revision.objects.count())
+
+
+class ContributeTest(TestCase):
+    """ Tests the pages listing things that need work """
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.space = Space.objects.create(name='Space')
+        self.A = Property.objects.create(name='A')
+        self.B = Property.objects.create(name='B')
+        self.implication = Implication.objects.create(
+            antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B'))
+
+    def test_open_converses(self):
+        """ Tests that the open converse list tracks counterexamples as they
+            are added and removed
+        """
+        url = reverse('brubeck:needing_counterexamples')
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['object_list']),
+            [self.implication])
+
+        # A space with B but not A is a counterexample to the converse
+        Trait.objects.create(space=self.space, property=self.B,
+            value=Value.objects.get(name='True'))
+        t = Trait.objects.create(space=self.space, property=self.A,
+            value=Value.objects.get(name='False'))
+        self.assertEqual(Implication.objects.get().open_converse, False)
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['object_list']), [])
+
+        t.delete()
+        self.assertEqual(Implication.objects.get().open_converse, True)
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['object_list']),
+            [self.implication])
+
+        # As does changing a trait's value
+        t = Trait.objects.create(space=self.space, property=self.A,
+            value=Value.objects.get(name='True'))
+        self.assertEqual(Implication.objects.get().open_converse, True)
+        t.value = Value.objects.get(name='False')
+        t.save()
+        self.assertEqual(Implication.objects.get().open_converse, False)
+        t.value = Value.objects.get(name='True')
+        t.save()
+        self.assertEqual(Implication.objects.get().open_converse, True)
+
+    def test_check_converses(self):
+        """ Tests that implications never checked are left out (rather than
+            checked while listing them) until the command checks them
+        """
+        url = reverse('brubeck:needing_counterexamples')
+        Implication.objects.update(open_converse=None)
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['object_list']), [])
+        self.assertEqual(Implication.objects.get().open_converse, None)
+        call_command('check_converses')
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['object_list']),
+            [self.implication])
+
+
+class ApiTest(TestCase):
+    """ Tests the JSON api """
+    fixtures = ['values.json']
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username='user')
+        self.space = self._create(Space, name='Space')
+        T = Value.objects.get(name='True')
+        for i in range(5):
+            p = Property.objects.create(name='P%s' % i)
+            self._create(Trait, text='Trait %s' % i, space=self.space,
+                property=p, value=T)
+
+    def _create(self, model, text='', **kwargs):
+        """ Creates an object along with its describing snippet """
+        obj = model.objects.create(**kwargs)
+        Snippet.objects.create(object=obj).add_revision(text=text,
+            user=self.user)
+        return obj
+
+    def test_traits(self):
+        """ Tests that traits stream in a fixed number of queries per batch
+            and can be paged through with `after`
+        """
+        from brubeck.views import api
+
+        api.TRAIT_BATCH_SIZE = 2
+        try:
+            response = self.client.get('/brubeck/api/traits/')
+            # 2 queries for each of 3 batches (the ContentType is cached)
+            with self.assertNumQueries(6):
+                traits = json.loads(response.content)
+        finally:
+            api.TRAIT_BATCH_SIZE = 500
+        self.assertEqual(len(traits), 5)
+        self.assertEqual(traits[0]['value'], 'True')
+        self.assertEqual(traits[0]['description'], 'Trait 0')
+        assert not traits[0]['auto']
+
+        response = self.client.get('/brubeck/api/traits/',
+            {'after': traits[1]['id'], 'limit': 2})
+        self.assertEqual([t['id'] for t in json.loads(response.content)],
+            [t['id'] for t in traits[2:4]])
+
+        # The older positional parameters
+        for params, expected in [({'start': 2, 'end': 4}, traits[2:4]),
+                                 ({'start': 3}, traits[3:]),
+                                 ({'end': 1}, traits[:1]),
+                                 ({'start': 9, 'end': 12}, [])]:
+            response = self.client.get('/brubeck/api/traits/', params)
+            self.assertEqual([t['id'] for t in json.loads(response.content)],
+                [t['id'] for t in expected])
+
+    def test_conditional_get(self):
+        """ Tests that unchanged api responses are answered with a 304 """
+        url = '/brubeck/api/spaces/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        assert response.has_header('Last-Modified')
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self._create(Space, name='Another space')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_edits(self):
+        """ Tests that edits which keep the number of rows change the ETag,
+            and that deletions move Last-Modified
+        """
+        def validators(url):
+            response = self.client.get(url)
+            return response['ETag'], response['Last-Modified']
+
+        space = Space.objects.all()[0]
+        etag, modified = validators('/brubeck/api/spaces/')
+        space.name = 'Renamed'
+        space.save()
+        self.assertNotEqual(validators('/brubeck/api/spaces/')[0], etag)
+
+        trait = Trait.objects.all()[0]
+        etag, modified = validators('/brubeck/api/traits/')
+        trait.value = Value.objects.exclude(id=trait.value_id)[0]
+        trait.save()
+        self.assertNotEqual(validators('/brubeck/api/traits/')[0], etag)
+
+        # Last-Modified has a resolution of a second
+        Version.objects.update(modified=F('modified') - timedelta(seconds=2))
+        etag, modified = validators('/brubeck/api/traits/')
+        Trait.objects.all()[0].delete()
+        self.assertNotEqual(validators('/brubeck/api/traits/'),
+                            (etag, modified))
+
+    def test_complete(self):
+        """ Tests completion of the last atom of a partial formula, only
+            checking the Version stamps once the tries are built
+        """
+        url = '/brubeck/api/complete/'
+        Property.objects.create(name=u'\u010cech complete', slug='cech')
+        self.client.get(url, {'q': 'P'})
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'q': 'P1 + not p'})
+        self.assertEqual(json.loads(response.content),
+            ['not P0', 'not P1', 'not P2', 'not P3', 'not P4'])
+        for q, completions in [('~cec', [u'~\u010cech complete']),
+                               ('P2 | P3=f', ['P3=False']),
+                               ('Q', [])]:
+            response = self.client.get(url, {'q': q})
+            self.assertEqual(json.loads(response.content), completions)
+
+        # Saving a property rebuilds the tries
+        Property.objects.create(name='Compact')
+        response = self.client.get(url, {'q': 'c'})
+        self.assertEqual(json.loads(response.content),
+            ['Compact', u'\u010cech complete'])
+        # As does a rename by another process, which bumps the stamp without
+        # any signal reaching this one
+        Property.objects.filter(name='Compact').update(name='Closed')
+        Version.bump('property')
+        response = self.client.get(url, {'q': 'c'})
+        self.assertEqual(json.loads(response.content),
+            ['Closed', u'\u010cech complete'])
+
+    def test_complete_widget(self):
+        """ Tests that the autocomplete widget splits formulae where the
+            server does, keeping the operators to rejoin them with
+        """
+        from brubeck import completion
+
+        script = render_to_string(
+            'brubeck/includes/formula_autocomplete/js.html')
+        split = re.compile(re.search(r'val\.split\( /(.*)/ \)',
+                                     script).group(1))
+        for q in ['P1 + not p', 'P2 | P3=f', 'P1|P2 +  ~P']:
+            parts = split.split(q)
+            self.assertEqual(parts[-1],
+                             completion._SEPARATOR.split(q)[-1].strip())
+            self.assertEqual(parts[1::2], re.findall('[+|]', q))
+
+    def test_hypothesize(self):
+        """ Tests deriving the consequences of assumptions without saving """
+        url = '/brubeck/api/hypothesize/'
+        A, B, C = [Property.objects.create(name=n) for n in 'ABC']
+        i1 = Implication.objects.create(antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B'))
+        i2 = Implication.objects.create(antecedent=human_to_formula('B'),
+            consequent=human_to_formula('~C'))
+        traits = Trait.objects.count()
+
+        response = self.client.get(url, {'q': 'A'})
+        self.assertEqual(json.loads(response.content), {
+            'assumptions': [{'property_id': A.id, 'value': 'True'}],
+            'derived': [
+                {'property_id': B.id, 'value': 'True',
+                 'proof': {'properties': [A.id], 'implication': i1.id}},
+                {'property_id': C.id, 'value': 'False',
+                 'proof': {'properties': [B.id], 'implication': i2.id}}],
+            'contradiction': None})
+
+        response = json.loads(self.client.get(url, {'q': 'A + C'}).content)
+        # Which implication fails depends on the order of propagation
+        assert response['contradiction']['implication'] in [i1.id, i2.id]
+        self.assertEqual(Trait.objects.count(), traits)
+
+        for q in ['', 'A | B', 'A + ~A', 'Nonexistent']:
+            response = self.client.get(url, {'q': q})
+            self.assertEqual(response.status_code, 400)
+            assert 'error' in json.loads(response.content)
+
+    def test_implies(self):
+        """ Tests implication queries through chains of simple implications,
+            including contrapositives
+        """
+        A, B, C, D = [Property.objects.create(name=n) for n in 'ABCD']
+        P0 = Property.objects.get(name='P0')
+        i1 = Implication.objects.create(antecedent=human_to_formula('A'),
+            consequent=human_to_formula('B + C'))
+        i2 = Implication.objects.create(antecedent=human_to_formula('C | D'),
+            consequent=human_to_formula('~P0'))
+        Implication.objects.create(antecedent=human_to_formula('A + B'),
+            consequent=human_to_formula('D'))
+        url = '/brubeck/api/implies/'
+
+        response = self.client.get(url, {'p': 'A', 'q': '~P0'})
+        self.assertEqual(json.loads(response.content), {'implies': True,
+            'chain': [{'implication': i1.id, 'property_id': C.id,
+                       'value': 'True'},
+                      {'implication': i2.id, 'property_id': P0.id,
+                       'value': 'False'}]})
+        response = self.client.get(url, {'p': 'P0', 'q': '~A'})
+        self.assertEqual([step['implication'] for step in
+            json.loads(response.content)['chain']], [i2.id, i1.id])
+        # A + B => D isn't a simple implication
+        for p, q in [('A', 'D'), ('B', 'A')]:
+            response = self.client.get(url, {'p': p, 'q': q})
+            self.assertEqual(json.loads(response.content),
+                {'implies': False, 'chain': []})
+        response = self.client.get(url, {'p': 'A + B', 'q': 'C'})
+        self.assertEqual(response.status_code, 400)
+
+        # New implications are added to the closure as they are saved
+        Implication.objects.create(antecedent=human_to_formula('B'),
+            consequent=human_to_formula('D'))
+        response = self.client.get(url, {'p': 'A', 'q': 'D'})
+        assert json.loads(response.content)['implies']
+
+        response = self.client.get(reverse('brubeck:implies'),
+            {'p': 'A', 'q': '~P0'})
+        self.assertEqual(len(response.context['chain']), 2)
+        self.assertContains(response, i2.name())
+
+    def test_descriptions(self):
+        """ Tests that descriptions are fetched in one query per model """
+        for i in range(3):
+            self._create(Space, text='Space %s' % i, name='Space %s' % i)
+        # One query to version the data, then one each for the spaces and
+        # their snippets (the ContentType is cached after the first request)
+        self.client.get('/brubeck/api/spaces/')
+        with self.assertNumQueries(3):
+            response = self.client.get('/brubeck/api/spaces/')
+        spaces = json.loads(response.content)
+        self.assertEqual(len(spaces), 4)
+        self.assertEqual(spaces[-1]['description'], 'Space 2')
+
+        # One query for each type of object, and one for their snippets
+        with self.assertNumQueries(8):
+            response = self.client.get('/brubeck/browse/')
+        self.assertContains(response, 'Trait 4')
+
+    def test_prover_header(self):
+        """ Tests that the optional middleware summarizes the prover's work """
+        middleware = settings.MIDDLEWARE_CLASSES + (
+            'brubeck.middleware.ProverProfileMiddleware',)
+        user = User(username='staff')
+        user.set_password('pass')
+        user.save()
+        client = Client()
+        client.login(username='staff', password='pass')
+        with override_settings(MIDDLEWARE_CLASSES=middleware):
+            response = client.get('/brubeck/api/spaces/')
+            assert not response.has_header('X-Brubeck-Prover')
+            # Only staff may ask for a recording
+            response = client.get('/brubeck/api/spaces/',
+                HTTP_X_BRUBECK_PROFILE='1')
+            assert not response.has_header('X-Brubeck-Prover')
+            user.is_staff = True
+            user.save()
+            response = client.get('/brubeck/api/spaces/',
+                HTTP_X_BRUBECK_PROFILE='1')
+        assert response['X-Brubeck-Prover'].startswith(
+            'GET /brubeck/api/spaces/')
+
+    def test_prover_exception(self):
+        """ Tests that a failed request doesn't leave its recording on """
+        from brubeck.logic.profiling import current
+        from brubeck.middleware import ProverProfileMiddleware
+
+        middleware = ProverProfileMiddleware()
+        request = RequestFactory().get('/', HTTP_X_BRUBECK_PROFILE='1')
+        request.user = User(is_staff=True)
+        debug = connection.use_debug_cursor
+        middleware.process_request(request)
+        assert current() is not None
+        middleware.process_exception(request, ValueError())
+        assert current() is None
+        self.assertEqual(connection.use_debug_cursor, debug)
+
+
+class SuggestionsTest(TestCase):
+    """ Tests implications mined from the trait matrix """
+    fixtures = ['values.json']
+
+    def test_suggestions(self):
+        T, F = Value.objects.get(name='True'), Value.objects.get(name='False')
+        A, B, C = [Property.objects.create(name=n) for n in 'ABC']
+        for i, traits in enumerate([[(A, T), (B, T), (C, T)],
+                                    [(A, T), (B, T), (C, F)],
+                                    [(A, T), (B, T)],
+                                    [(A, F), (B, F), (C, T)],
+                                    [(A, T)],
+                                    [(B, F)]]):
+            space = Space.objects.create(name='Space %s' % i)
+            for p, v in traits:
+                Trait.objects.create(space=space, property=p, value=v)
+
+        candidates = mine(min_support=2, max_size=1)
+        self.assertEqual([(c.antecedent, c.consequent, c.support, c.settles)
+                          for c in candidates],
+            [([(A.id, Value.TRUE)], (B.id, Value.TRUE), 3, 2)])
+
+        # The page only shows what was last mined, and once a suggestion is
+        # an implication, there is nothing left to suggest
+        url = reverse('brubeck:suggested_implications')
+        tmp = tempfile.mkdtemp()
+        try:
+            with override_settings(BRUBECK_SUGGESTIONS_PATH=os.path.join(
+                    tmp, 'suggestions.json')):
+                self.assertEqual(self.client.get(url).context['suggestions'],
+                                 [])
+                call_command('mine_implications', min_support=2, max_size=1)
+                response = self.client.get(url)
+                self.assertEqual(
+                    response.context['suggestions'][0]['antecedent'], 'A')
+                self.assertContains(response,
+                    '?antecedent=A&amp;consequent=B')
+                Implication.objects.create(
+                    antecedent=human_to_formula('A'),
+                    consequent=human_to_formula('B'))
+                self.assertEqual(self.client.get(url).context['suggestions'],
+                                 [])
+        finally:
+            shutil.rmtree(tmp)
+
+
+class SimilarityTest(TestCase):
+    """ Tests finding similar spaces """
+    fixtures = ['values.json']
+
+    def setUp(self):
+        T, F = Value.objects.get(name='True'), Value.objects.get(name='False')
+        properties = [Property.objects.create(name='P%s' % i)
+                      for i in range(10)]
+        # Space i has the first i properties and not the rest
+        self.spaces = [Space.objects.create(name='Space %s' % i)
+                       for i in range(4)]
+        for i, space in enumerate(self.spaces):
+            for j, p in enumerate(properties):
+                Trait.objects.create(space=space, property=p,
+                                     value=T if j < i else F)
+        self.unknown = Space.objects.create(name='Unknown')
+        Trait.objects.create(space=self.unknown, property=properties[0],
+                             value=F)
+
+    def test_index(self):
+        index = SimilarityIndex.from_database()
+        s = self.spaces
+        self.assertEqual(index.nearest(s[1].id, k=3), [(s[0].id, 1, 9),
+            (s[2].id, 1, 9), (self.unknown.id, 1, 0)])
+        self.assertEqual([index.space_ids[i] for i in index.all_nearest(2)[0]],
+            [self.unknown.id, s[1].id])
+        literals = [(Property.objects.get(name=n).id, Value.TRUE)
+                    for n in ['P0', 'P1', 'P2']]
+        self.assertEqual(index.closest_to(literals, k=2),
+            [(s[3].id, 0, 3), (s[2].id, 1, 2)])
+
+    def test_pages(self):
+        """ Tests that pages show similar spaces once the index is built """
+        url = self.spaces[0].get_absolute_url()
+        tmp = tempfile.mkdtemp()
+        try:
+            with override_settings(BRUBECK_SIMILARITY_INDEX=os.path.join(
+                    tmp, 'similarity.npz')):
+                assert 'similar' not in self.client.get(url).context
+                call_command('rebuild_similarity_index')
+                response = self.client.get(url)
+                self.assertEqual(response.context['similar'][0][0],
+                                 self.unknown)
+                self.assertContains(response, self.unknown.get_absolute_url())
+                response = self.client.get(reverse('brubeck:search'),
+                    {'q': 'P8 + P9'})
+        finally:
+            shutil.rmtree(tmp)
+        # Nothing is known to be P8 or P9, but Unknown isn't known not to be
+        self.assertEqual(response.context['closest'][0], (self.unknown, 0, 0))
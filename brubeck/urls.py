@@ -22,18 +22,31 @@ urlpatterns += patterns('brubeck.views.api',
     url(r'^api/properties/$', 'properties'),
     url(r'^api/traits/$', 'traits'),
     url(r'^api/theorems/$', 'theorems'),
+    url(r'^api/export/$', 'export', name='export'),
+    url(r'^api/complete/$', 'complete', name='complete'),
+    url(r'^api/hypothesize/$', 'hypothesize', name='hypothesize'),
+    url(r'^api/implies/$', 'implies', name='api_implies'),
+)
+
+urlpatterns += patterns('brubeck.views.sitemaps',
+    url(r'^sitemap\.xml$', 'index', name='sitemap'),
+    url(r'^sitemap-(?P<section>\w+)\.xml$', 'section',
+        name='sitemap_section'),
 )
 
 urlpatterns += patterns('brubeck.views',
     # Misc views
     url(r'^browse/$', 'browse', name='browse'),
     url(r'^search/$', 'search', name='search'),
+    url(r'^implies/$', 'implies', name='implies'),
     url(r'^contribute/$', TemplateView.as_view(
         template_name='brubeck/contribute/home.html'), name='contribute'),
     url(r'^contribute/descriptions/$', 'needing_descriptions',
         name='needing_descriptions'),
     url(r'^contribute/counterexamples/$', 'reversal_counterexamples',
         name='needing_counterexamples'),
+    url(r'^contribute/implications/$', 'suggested_implications',
+        name='suggested_implications'),
     url(r'^register/$', 'register', name='register'),
     url(r'^profiles/$', 'profiles', name='profiles'),
     url(r'^profiles/([-\w]+)/$', 'profile', name='profile'),
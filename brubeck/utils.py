@@ -1,26 +1,287 @@
+import csv
 import logging
+import operator
+import os
 
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+from django.utils.datastructures import SortedDict
+
+from brubeck.logic.matrix import TraitMatrix, evaluate
+from brubeck.logic.saturation import Saturation, invalidate
 from brubeck.models.snippets import Snippet
-from brubeck.models.core import Space
+from brubeck.models.core import Space, Value
 
 
 logger = logging.getLogger(__name__)
 
 
-def check_consistency():
-    """ Checks the entire database for consistency. """
-    from brubeck.models import Implication
+# Codes for the entries of the table from Counterexamples in Topology
+CX_MISSING, CX_BLANK, CX_NA, CX_NO, CX_YES = range(5)
+_CX_CODES = {'': CX_BLANK, 'na': CX_NA, '0': CX_NO, '1': CX_YES}
+
+# Properties which are numbered differently in Counterexamples than in the
+# database
+_CX_RENUMBERING = {
+    5: 11, 6: 12, 7: 13, 8: 14,
+    11: 5, 12: 6, 13: 7, 14: 8,
+    34: 35, 35: 34,
+    59: 60, 60: 61
+}
+
+_counterexamples = None
+
+# Selects a column from the (first) snippet describing each row of a table
+_SNIPPET_SQL = """
+    SELECT %(column)s FROM brubeck_snippet s
+    INNER JOIN brubeck_document d ON d.id = s.document_ptr_id
+    LEFT OUTER JOIN brubeck_revision r ON r.id = d.revision_id
+    LEFT OUTER JOIN auth_user u ON u.id = r.user_id
+    WHERE s.content_type_id = %%s AND s.object_id = %(table)s.id
+    ORDER BY s.document_ptr_id LIMIT 1
+"""
+
+
+class ConsistencyReport(object):
+    """ The problems found by `check_consistency`:
+        - counterexamples: (Implication, [Space ids]) for every implication
+          that fails somewhere
+        - contradictions: ids of Traits whose value isn't one of the values
+          their Property can take
+        - unsupported: ids of automatically added Traits whose proof cites a
+          missing Implication, or a Trait missing from the same Space
+    """
+    def __init__(self, counterexamples, contradictions, unsupported):
+        self.counterexamples = counterexamples
+        self.contradictions = contradictions
+        self.unsupported = unsupported
+
+    def __len__(self):
+        return len(self.counterexamples) + len(self.contradictions) + \
+            len(self.unsupported)
+
+    def as_dict(self):
+        return {
+            'counterexamples': [{'implication': i.id, 'spaces': spaces}
+                                for i, spaces in self.counterexamples],
+            'contradictions': self.contradictions,
+            'unsupported': self.unsupported
+        }
+
+
+def _find_counterexamples(args):
+    """ Finds the rows where each (id, antecedent, consequent) of compiled
+        formulae fails. Module level, so it can run in a worker process.
+    """
+    values, rules = args
+    found = []
+    for id, antecedent, consequent in rules:
+        holds, _ = evaluate(antecedent, values)
+        _, fails = evaluate(consequent, values)
+        rows = np.flatnonzero(holds & fails)
+        if len(rows):
+            found.append((id, rows))
+    return found
+
+
+def check_consistency(processes=1):
+    """ Checks the entire database for consistency, returning a
+        ConsistencyReport. Implications are evaluated against every space at
+        once, split across `processes` worker processes if more than one.
+    """
+    from brubeck.models import Property, Trait, Implication
+
+    matrix = TraitMatrix.from_database()
+    implications = dict((i.id, i) for i in Implication.objects.all())
+    rules = [(i.id, matrix.compile(i.antecedent), matrix.compile(i.consequent))
+             for i in implications.values()]
+    if processes > 1 and len(rules) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_find_counterexamples, [(matrix.values,
+                rules[n::processes]) for n in range(processes)])
+        finally:
+            pool.close()
+            pool.join()
+        found = sum(results, [])
+    else:
+        found = _find_counterexamples((matrix.values, rules))
+    counterexamples = [(implications[id],
+        [int(matrix.space_ids[r]) for r in rows]) for id, rows in sorted(found)]
+
+    value_sets = dict(Value.objects.values_list('id', 'value_set_id'))
+    property_sets = dict(Property.objects.values_list('id', 'values_id'))
+    traits = {}
+    contradictions = []
+    for id, space, property, value in Trait.objects.values_list('id',
+            'space_id', 'property_id', 'value_id'):
+        traits[id] = space
+        if value_sets[value] != property_sets[property]:
+            contradictions.append(id)
 
-    errors = []
-    for i in Implication.objects.all():
-        cx = i.counterexamples()
-        if cx.exists():
-            errors.append((i, cx))
-    if errors:
-        logger.error('Found implications with counterexamples.' % errors)
+    ct = ContentType.objects.get_for_model(Trait)
+    unsupported = []
+    for id, proof in Snippet.objects.filter(content_type=ct).exclude(
+            proof_agent='').exclude(proof_agent=Snippet.USER).values_list(
+            'object_id', 'revision__text'):
+        if id not in traits:
+            continue  # The snippet of a deleted trait
+        for step in (proof or '').split(',')[:-1]:
+            kind, ref = step[0], int(step[1:])
+            if kind == 't' and traits.get(ref) != traits[id] or \
+                    kind == 'i' and ref not in implications:
+                unsupported.append(id)
+                break
+
+    report = ConsistencyReport(counterexamples, sorted(contradictions),
+        sorted(unsupported))
+    if report:
+        logger.error('Found %s consistency problem(s): %s' % (len(report),
+            report.as_dict()))
     else:
         logger.debug('No errors found.')
-    return errors
+    return report
+
+
+def find_redundant_implications():
+    """ Finds the implications which can be derived from the others. The
+        newest are checked first, so that the oldest of several equivalent
+        implications is kept. Returns a list of (Implication, ids of the
+        implications it was derived from), in id order.
+    """
+    from brubeck.models import Implication
+
+    implications = list(Implication.objects.order_by('-id'))
+    saturation = Saturation(implications)
+    redundant = []
+    for i in implications:
+        if saturation.follows(i) is not None:
+            saturation.disabled.add(i.id)
+            redundant.append(i)
+
+    # An implication may only have been derivable using ones found to be
+    # redundant later, so check again against those that are left. Enabling
+    # one can't stop any other from being derived.
+    found = []
+    for i in reversed(redundant):
+        used = saturation.follows(i)
+        if used is None:
+            saturation.disabled.discard(i.id)
+        else:
+            found.append((i, used))
+    return [(i, sorted(used)) for i, used in found]
+
+
+def recheck_redundant_implications(changed=None):
+    """ Unmarks the implications marked redundant which no longer follow
+        from the others, after one was deleted or `changed` (an Implication
+        with new, unsaved formulae) was edited. The rest stay marked, so
+        `find_redundant_implications` needn't be run again. As there, the
+        oldest are checked first, and each one unmarked may be used to derive
+        the others. Returns the ids unmarked.
+    """
+    from brubeck.models import Implication, Version
+
+    implications = [changed if changed and i.id == changed.id else i
+                    for i in Implication.objects.order_by('id')]
+    saturation = Saturation(implications)
+    redundant = [i for i in implications if i.redundant]
+    saturation.disabled.update(i.id for i in redundant)
+    unmarked = []
+    for i in redundant:
+        if saturation.follows(i) is None:
+            saturation.disabled.discard(i.id)
+            unmarked.append(i.id)
+    if unmarked:
+        Implication.objects.filter(id__in=unmarked).update(redundant=False)
+        # So that every process rebuilds its Saturation with them
+        Version.bump('implication')
+        invalidate()
+        logger.info('Unmarked %s redundant implication(s): %s' % (
+            len(unmarked), unmarked))
+    return unmarked
+
+
+def select_from_snippets(qs, **columns):
+    """ Adds columns from the snippet describing each object to a queryset,
+        using correlated subqueries rather than a lookup per object. Each
+        keyword maps a new attribute name to an SQL expression over the
+        aliases `s` (snippet), `d` (document), `r` (revision) and `u` (user).
+    """
+    table = qs.model._meta.db_table
+    ct = ContentType.objects.get_for_model(qs.model)
+    select = SortedDict((name, _SNIPPET_SQL % {'table': table, 'column': sql})
+        for name, sql in sorted(columns.items()))
+    return qs.extra(select=select, select_params=[ct.id] * len(select))
+
+
+def data_version(*models):
+    """ Fingerprints the data shown for `models` along with the descriptions,
+        from the Version stamps that every write to them replaces. Returns the
+        fingerprint and the time of the latest change (None if never stamped).
+    """
+    from brubeck.models import Version
+
+    names = [m.__name__.lower() for m in models] + ['document']
+    stamps = Version.stamps(*names)
+    modified = [m for s, m in stamps if m is not None]
+    return '-'.join('%s:%s' % (name, s) for name, (s, m) in
+        zip(names, stamps)), max(modified) if modified else None
+
+
+def get_counterexamples_table():
+    """ Loads the table from Counterexamples in Topology bundled with brubeck
+        (once per process) as an array of codes, indexed by space and property
+        number. Rows for spaces that aren't in the book are CX_MISSING.
+    """
+    global _counterexamples
+    if _counterexamples is None:
+        path = os.path.join(os.path.dirname(__file__), 'counterexamples.csv')
+        with open(path, 'rb') as f:
+            rows = [r for r in csv.reader(f)][1:]  # Skip the header row
+        table = np.empty((len(rows) + 1, max(len(r) for r in rows)),
+            dtype=np.int8)
+        table.fill(CX_MISSING)
+        for r in rows:
+            table[int(r[0]), 1:] = [_CX_CODES[c.strip()] for c in r[1:]]
+        _counterexamples = table
+    return _counterexamples
+
+
+def compare_to_counterexamples(matrix):
+    """ Compares a TraitMatrix with the table from Counterexamples in
+        Topology, returning an array of css classes for each of its entries:
+        - yes / no: unknown here, but known there
+        - extra: known here, but not there
+        - error 0 / error 1: known differently there
+        - missing: the space isn't in the book
+    """
+    table = get_counterexamples_table()
+    cols = np.array([_CX_RENUMBERING.get(p, p) for p in matrix.property_ids],
+        dtype=np.intp).reshape(-1)
+    rows = matrix.space_ids
+    ref = np.full(matrix.values.shape, CX_BLANK, dtype=np.int8)
+    in_rows = rows < table.shape[0]
+    in_cols = cols < table.shape[1]
+    ref[np.ix_(in_rows, in_cols)] = table[np.ix_(rows[in_rows],
+                                                 cols[in_cols])]
+    ref[~in_rows, :] = CX_MISSING
+
+    values = matrix.values
+    unknown = values == 0
+    matches = ((values == Value.TRUE) & (ref == CX_YES)) | \
+              ((values == Value.FALSE) & np.in1d(ref, [CX_NO, CX_NA])
+                  .reshape(ref.shape))
+    return np.select([
+        ref == CX_MISSING,
+        unknown & (ref == CX_NO),
+        unknown & (ref == CX_YES),
+        unknown | matches,
+        (ref == CX_NA) | (ref == CX_BLANK),
+        ref == CX_NO,
+    ], ['missing', 'no', 'yes', '', 'extra', 'error 0'], 'error 1')
 
 
 def get_incomplete_snippets():
@@ -35,18 +296,57 @@ def traits_needing_descriptions(obj):
     from django.contrib.contenttypes.models import ContentType
     from brubeck.models import Trait
 
-    return Snippet.objects.filter(
+    blank = Snippet.objects.filter(
         content_type=ContentType.objects.get_for_model(Trait),
-        object_id__in=[t.id for t in obj.trait_set.all()],
         revision__text=''
-    )
+    ).values('object_id')
+    return with_related(obj.trait_set.filter(id__in=blank))
+
+
+def with_related(traits):
+    """ Joins in everything needed to display (and link to) each of a
+        queryset of Traits
+    """
+    return traits.select_related('space', 'property', 'value')
 
 
 def get_open_converses():
-    """ Finds implications with open converses. """
+    """ Finds implications with open converses, as recorded when they and the
+        traits they involve are saved. Those never checked (saved before this
+        was recorded) are left out until the `check_converses` command is
+        run.
+    """
+    from brubeck.models.provable import Implication
+
+    return Implication.objects.exclude(reverses=True).filter(
+        open_converse=True).order_by('id')
+
+
+def check_converses(implications):
+    """ Records whether the converse of each of `implications` has any known
+        counterexample, taking a query for each. Returns the number found to
+        be open.
+    """
     from brubeck.models.provable import Implication
-    return filter(lambda i: not i.converse().counterexamples().exists(),
-        Implication.objects.exclude(reverses=True))
+
+    found = {True: [], False: []}
+    for i in implications:
+        found[not i.converse().counterexamples().exists()].append(i.id)
+    for open, ids in found.items():
+        if ids:
+            Implication.objects.filter(id__in=ids).update(open_converse=open)
+    return len(found[True])
+
+
+def implications_mentioning(property_ids):
+    """ The implications whose formulae may involve any of `property_ids`
+        (this may include a few others, e.g. some with property 12 for 2)
+    """
+    from brubeck.models.provable import Implication
+
+    return Implication.objects.filter(reduce(operator.or_,
+        [Q(antecedent__contains='%s=' % p) | Q(consequent__contains='%s=' % p)
+         for p in property_ids]))
 
 
 def get_unknown_spaces(property):
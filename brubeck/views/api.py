@@ -1,8 +1,24 @@
 import json
+import os
 
-from django.http import HttpResponse
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, Http404
+from django.views.decorators.http import condition
+from django.views.static import serve
 
-from brubeck.models import Space, Property, Trait, Implication
+from brubeck import completion, utils
+from brubeck.export import export_path
+from brubeck.forms import ImpliesForm
+from brubeck.logic import Formula, Prover
+from brubeck.logic.formula.utils import human_to_formula
+from brubeck.logic.saturation import Contradiction
+from brubeck.models import Space, Property, Trait, Implication, Value, \
+    Snippet, prefetch_snippets
+
+
+# Number of traits fetched per query while streaming the traits endpoint
+TRAIT_BATCH_SIZE = 500
 
 
 class JsonResponse(HttpResponse):
@@ -11,47 +27,129 @@ class JsonResponse(HttpResponse):
         super(JsonResponse, self).__init__(json.dumps(val), *args, **kwargs)
 
 
-def _description(obj):
-    return obj.snippets.get().revision.text
+class JsonStreamResponse(HttpResponse):
+    """ Streams an iterable of objects as a JSON array, encoding each object
+        only as it is written out.
+    """
+    def __init__(self, items, *args, **kwargs):
+        kwargs.update({'mimetype': 'application/json'})
+        super(JsonStreamResponse, self).__init__(self._encode(items), *args,
+            **kwargs)
+
+    def _encode(self, items):
+        sep = '['
+        for item in items:
+            yield sep + json.dumps(item)
+            sep = ','
+        yield '[]' if sep == '[' else ']'
+
+
+def conditional(model):
+    """ Lets clients revalidate an api view cheaply. A matching ETag or
+        Last-Modified gets a 304 before any serialization happens. Both come
+        from the Version stamps of `model` and of the descriptions, which
+        every write replaces (deletions included).
+    """
+    def version(request):
+        if not hasattr(request, '_data_version'):
+            request._data_version = utils.data_version(model)
+        return request._data_version
 
+    def etag(request, *args, **kwargs):
+        return version(request)[0]
 
+    def last_modified(request, *args, **kwargs):
+        return version(request)[1]
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+@conditional(Space)
 def spaces(request):
     spaces = [{
         'id': s.id,
         'name': s.name,
         'slug': s.slug,
         'fully_defined': s.fully_defined,
-        'description': _description(s)
-    } for s in Space.objects.all()]
+        'description': s.description
+    } for s in prefetch_snippets(Space.objects.all())]
     return JsonResponse(spaces)
 
 
+@conditional(Property)
 def properties(request):
     properties = [{
         'id': p.id,
         'name': p.name,
         'slug': p.slug,
-        'description': _description(p)
-    } for p in Property.objects.all()]
+        'description': p.description
+    } for p in prefetch_snippets(Property.objects.all())]
     return JsonResponse(properties)
 
 
+def _int_param(request, name, default=None):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _iter_traits(after, limit):
+    """ Yields serialized traits with id > `after` in id order, fetching each
+        batch (with values and current snippets) in two queries.
+    """
+    ct = ContentType.objects.get_for_model(Trait)
+    while limit is None or limit > 0:
+        size = TRAIT_BATCH_SIZE if limit is None else \
+            min(limit, TRAIT_BATCH_SIZE)
+        batch = list(Trait.objects.filter(id__gt=after).order_by('id')
+            .values_list('id', 'space_id', 'property_id', 'value__name')[:size])
+        if not batch:
+            return
+        snippets = {}
+        for object_id, text, agent in Snippet.objects.filter(content_type=ct,
+                object_id__in=[t[0] for t in batch]).order_by('-pk')\
+                .values_list('object_id', 'revision__text', 'proof_agent'):
+            # Mirrors `snippets[0]`, which returns the first snippet created
+            snippets[object_id] = (text, agent)
+        for id, space_id, property_id, value in batch:
+            text, agent = snippets.get(id, ('', ''))
+            yield {
+                'id': id,
+                'space_id': space_id,
+                'property_id': property_id,
+                'value': value,
+                'description': text or '',
+                'auto': bool(agent) and agent != Snippet.USER
+            }
+        after = batch[-1][0]
+        if limit is not None:
+            limit -= len(batch)
+        if len(batch) < size:
+            return
+
+
+@conditional(Trait)
 def traits(request):
-    start = request.GET.get('start', 0)
-    end = request.GET.get('end', None)
-    if end:
-        qs = Trait.objects.all()[start:end]
-    else:
-        qs = Trait.objects.all()[start:]
-    traits = [{
-        'id': t.id,
-        'space_id': t.space_id,
-        'property_id': t.property_id,
-        'value': t.value.name,
-        'description': _description(t),
-        'auto': t.snippets[0].automatically_added()
-    } for t in qs]
-    return JsonResponse(traits)
+    """ Streams all traits in id order. Clients can page through the table by
+        passing `limit` and then the id of the last trait received as `after`.
+        The older `start` and `end` (positions in the table) are still
+        accepted.
+    """
+    after = _int_param(request, 'after', 0)
+    limit = _int_param(request, 'limit')
+    start, end = _int_param(request, 'start', 0), _int_param(request, 'end')
+    if end is not None and 'limit' not in request.GET:
+        limit = max(end - start, 0)
+    if start > 0 and 'after' not in request.GET:
+        # Continue from the trait just before the start
+        before = list(Trait.objects.order_by('id')
+            .values_list('id', flat=True)[start - 1:start])
+        if before:
+            after = before[0]
+        else:
+            limit = 0  # Past the end
+    return JsonStreamResponse(_iter_traits(after, limit))
 
 
 def get_prep_value(formula):
@@ -64,11 +162,87 @@ def get_prep_value(formula):
     return '%s=%s' % (p, v)
 
 
+@conditional(Implication)
 def theorems(request):
     theorems = [{
         'id': t.id,
         'antecedent': get_prep_value(t.antecedent),
         'consequent': get_prep_value(t.consequent),
-        'description': _description(t)
-    } for t in Implication.objects.all()]
+        'description': t.description
+    } for t in prefetch_snippets(Implication.objects.all())]
     return JsonResponse(theorems)
+
+
+def complete(request):
+    """ Completes the last atom of the partial formula in `q` """
+    return JsonResponse(completion.complete(request.GET.get('q', '')))
+
+
+def _proof(steps):
+    return {
+        'properties': [id for kind, id in steps if kind == 't'],
+        'implication': [id for kind, id in steps if kind == 'i'][0]
+    }
+
+
+def hypothesize(request):
+    """ Derives what follows from the conjunction of atoms in `q` (e.g.
+        `compact + ~discrete`), without saving anything. Each derived trait
+        comes with the properties and implication proving it. Inconsistent
+        assumptions give a `contradiction`, with the proof of its last step.
+    """
+    assumptions = {}
+    try:
+        q = request.GET.get('q', '').strip()
+        if not q:
+            raise ValidationError('No assumptions given')
+        formula = human_to_formula(q)
+        atoms = formula.sub if getattr(formula, 'operator', None) == \
+            Formula.AND else [formula]
+        for a in atoms:
+            if not a.is_atom():
+                raise ValidationError('Assumptions must be joined with "+"')
+            if assumptions.setdefault(a.property, a.value) != a.value:
+                raise ValidationError('Conflicting assumptions for %s' %
+                                      a._property)
+    except ValidationError as e:
+        return JsonResponse({'error': u' '.join(e.messages)}, status=400)
+
+    try:
+        derived, contradiction = Prover.hypothesize(assumptions), None
+    except Contradiction as e:
+        derived, contradiction = e.derived, _proof(e.steps)
+    names = dict(Value.objects.values_list('id', 'name'))
+    return JsonResponse({
+        'assumptions': [{'property_id': p, 'value': names[v]}
+                        for p, v in sorted(assumptions.items())],
+        'derived': [{'property_id': p, 'value': names[v],
+                     'proof': _proof(steps)} for p, v, steps in derived],
+        'contradiction': contradiction
+    })
+
+
+def implies(request):
+    """ Answers whether the atom `p` implies the atom `q`, with the chain of
+        implications proving it
+    """
+    form = ImpliesForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors}, status=400)
+    chain = form.chain()
+    return JsonResponse({
+        'implies': chain is not None,
+        'chain': [{'implication': i.id, 'property_id': f.property,
+                   'value': f._value.name} for i, f in chain or []]
+    })
+
+
+def export(request):
+    """ Serves the snapshot written by the `export_database` command """
+    path = export_path()
+    if not os.path.exists(path):
+        raise Http404
+    response = serve(request, os.path.basename(path),
+        document_root=os.path.dirname(path))
+    response['Content-Disposition'] = 'attachment; filename=brubeck.npz'
+    return response
@@ -4,7 +4,6 @@ from django.contrib import messages
 from django.contrib.auth import login
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.urlresolvers import reverse
-from django.db.models.query_utils import Q
 from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
@@ -12,10 +11,14 @@ from django.views.decorators.cache import cache_page
 from django.views.generic import ListView
 from django.views.generic.edit import FormView
 
-from brubeck import forms, utils
+from brubeck import forms, mining, utils
 from brubeck.logic import Prover
+from brubeck.logic.formula import atomize
+from brubeck.logic.matrix import TraitMatrix
+from brubeck.logic.similarity import get_index
 from brubeck.models import Space, Property, Trait, Implication, Profile, \
-    Snippet
+    Value, prefetch_snippets
+from brubeck.search import SearchPaginator
 
 
 def _force_login(request, user):
@@ -38,41 +41,41 @@ register = RegistrationView.as_view()
 
 
 def table(request):
-    """ Prepares a table of all available traits """
-    # This page is *very* slow to load. Only display it for superusers.
+    """ Compares all current traits to the table from Counterexamples in
+        Topology
+    """
     if not request.user.is_superuser:
         raise Http404
 
-    # Get the table from counterexamples to compare to
-    import urllib2
-    f = urllib2.urlopen(
-        'https://s3.amazonaws.com/jdabbs.com/counterexamples.csv').read()
-    cx = [row.split(',') for row in f.split('\n')]
-
-    # And a list of all current traits
-    try:
-        start = int(request.GET['start'])
-    except Exception:
-        start = 1
-    try:
-        end = int(request.GET['end'])
-    except Exception:
-        end = 143
-    end = min(end, 143)
-    traits = {}
-    spaces = Space.defined_objects.filter(id__in=range(start, end + 1))
-    for s in spaces:
-        traits[s.id] = {}
-    properties = Property.objects.all()
-    for t in Trait.objects.filter(space__in=spaces):
-        traits[t.space.id][t.property.id] = t
-    return TemplateResponse(request, 'brubeck/list/table.html', locals())
+    spaces = list(Space.defined_objects.order_by('id'))
+    properties = list(Property.objects.order_by('id'))
+    matrix = TraitMatrix.from_database(spaces=Space.defined_objects.all())
+    classes = utils.compare_to_counterexamples(matrix)
+    values = dict((v.id, v) for v in Value.objects.all())
+
+    rows = []
+    for i, s in enumerate(spaces):
+        cells = []
+        for j, p in enumerate(properties):
+            cell = {'class': classes[i, j], 'space': s, 'property': p}
+            value = values.get(matrix.values[i, j])
+            if value:
+                cell.update({
+                    'url': reverse('brubeck:trait',
+                        kwargs={'space': s.slug, 'property': p.slug}),
+                    'title': u'%s: %s' % (s, atomize(p, value)),
+                    'display': value.table_display()
+                })
+            cells.append(cell)
+        rows.append((s, cells))
+    return TemplateResponse(request, 'brubeck/list/table.html', {
+        'properties': properties,
+        'rows': rows
+    })
 
 
 def search(request):
     """ Allows a user to search the database """
-    # TODO: searching by text may be slow. Should it be AJAXy? Factored into
-    #       a separate view?
     # TODO: the template inheritance for the two different column types is
     #       messy. It might be easier to actually use different templates for
     #       the different result types (space only, text only, space & text)
@@ -84,10 +87,7 @@ def search(request):
             results = form.search()
             # Pre-process the results for the template
             if 'text' in results:
-                text_paginator = Paginator(Snippet.objects.filter(
-                    Q(revision__text__icontains=results['text']) |
-                    Q(title=results['text'])
-                ).order_by('-revision__id'), 10)
+                text_paginator = SearchPaginator(results['text'], 10)
                 text_page = request.GET.get('text_page', 1)
                 try:
                     text_page = text_paginator.page(text_page)
@@ -115,6 +115,11 @@ def search(request):
                     'formula_page': formula_page,
                     'formula_paginator': formula_paginator,
                 })
+                index = get_index()
+                if not formula_paginator.count and 'f_literals' in results \
+                        and index is not None:
+                    context['closest'] = index.with_spaces(
+                        index.closest_to(results['f_literals']))
             else:
                 context['formula_error'] = results.get('f_errors', [''])[0]
     else:
@@ -123,15 +128,49 @@ def search(request):
     return TemplateResponse(request, 'brubeck/search/search.html', context)
 
 
+def implies(request):
+    """ Answers whether one property implies another, through a chain of
+        implications between single properties
+    """
+    context = {}
+    if 'p' in request.GET:
+        form = forms.ImpliesForm(request.GET)
+        if form.is_valid():
+            link = lambda f: f.__unicode__(lookup=True, link=True)
+            chain = form.chain()
+            context.update({
+                'p': link(form.cleaned_data['p']),
+                'q': link(form.cleaned_data['q']),
+                'implied': chain is not None,
+                'chain': [(i, link(f)) for i, f in chain or []]
+            })
+    else:
+        form = forms.ImpliesForm()
+    context['form'] = form
+    return TemplateResponse(request, 'brubeck/implies.html', context)
+
+
 needing_descriptions = ListView.as_view(
     paginate_by=42,
     queryset=utils.get_incomplete_snippets().order_by('content_type'),
     template_name='brubeck/contribute/descriptions.html')
 
-reversal_counterexamples = ListView.as_view(
-    paginate_by=42,
-    queryset=utils.get_open_converses(),
-    template_name='brubeck/contribute/counterexamples.html')
+
+def suggested_implications(request):
+    """ Lists implications that hold wherever the database can tell, ranked
+        by how many unknown traits they would settle
+    """
+    return TemplateResponse(request, 'brubeck/contribute/implications.html',
+        {'suggestions': mining.suggestions()})
+
+
+class OpenConversesView(ListView):
+    paginate_by = 42
+    template_name = 'brubeck/contribute/counterexamples.html'
+
+    def get_queryset(self):
+        return utils.get_open_converses()
+reversal_counterexamples = OpenConversesView.as_view()
 
 
 def proof(request, s, p):
@@ -154,10 +193,13 @@ def browse(request):
     """
     LIMIT = 5
     return TemplateResponse(request, 'brubeck/browse.html', {
-        'spaces': Space.objects.order_by('-id')[:LIMIT],
-        'properties': Property.objects.order_by('-id')[:LIMIT],
-        'traits': Trait.objects.order_by('-id')[:LIMIT],
-        'implications': Implication.objects.order_by('-id')[:LIMIT]
+        'spaces': prefetch_snippets(Space.objects.order_by('-id')[:LIMIT]),
+        'properties': prefetch_snippets(
+            Property.objects.order_by('-id')[:LIMIT]),
+        'traits': prefetch_snippets(utils.with_related(
+            Trait.objects.order_by('-id'))[:LIMIT]),
+        'implications': prefetch_snippets(
+            Implication.objects.order_by('-id')[:LIMIT])
     })
 
 
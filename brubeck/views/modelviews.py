@@ -7,9 +7,10 @@ from django.views.generic.edit import CreateView, UpdateView
 from django.views.generic.list import ListView
 
 from brubeck import utils, forms
-from brubeck.logic import Prover
+from brubeck.logic import Prover, bitmaps
+from brubeck.logic.similarity import get_index
 from brubeck.models import Space, Property, Trait, Implication, Snippet,\
-    Revision
+    Revision, prefetch_snippets
 
 _get_name = lambda m: m.__name__.lower()
 
@@ -25,7 +26,8 @@ class ModelViewMixin(object):
 class GetObjectMixin(ModelViewMixin):
     def get_object(self, queryset=None):
         if self.model == Trait:
-            return get_object_or_404(Trait, space__slug=self.kwargs['space'],
+            return get_object_or_404(Trait.objects.select_related('space',
+                'property', 'value'), space__slug=self.kwargs['space'],
                 property__slug=self.kwargs['property'])
         elif self.model == Implication:
             return get_object_or_404(Implication, id=self.kwargs['id'])
@@ -41,6 +43,7 @@ class List(ModelViewMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super(List, self).get_context_data(**kwargs)
+        prefetch_snippets(context['object_list'])
         context['plural_name'] = self.model._meta.verbose_name_plural
         context['create_name'] = 'brubeck:create_%s' %\
                                  self.model.__name__.lower()
@@ -52,12 +55,16 @@ def list(request, model):
 
 
 class Detail(GetObjectMixin, DetailView):
-    """ Generates a view for detailing one of the core objects """
+    """ Generates a view for detailing one of the core objects. Each section
+        of the page is loaded with a fixed number of queries, no matter how
+        many traits are involved.
+    """
     def get_context_data(self, **kwargs):
         context = super(Detail, self).get_context_data(**kwargs)
+        context['snippets'] = self.object.snippets.select_related('revision')
 
         # Add paginated list of related traits
-        paginator = Paginator(self.object.traits(), 40)
+        paginator = Paginator(utils.with_related(self.object.traits()), 40)
         page = self.request.GET.get('page', 1)
         try:
             traits = paginator.page(page)
@@ -69,21 +76,28 @@ class Detail(GetObjectMixin, DetailView):
                         'is_paginated': paginator.num_pages > 1})
 
         # Add reversal information for Implications
-        if self.model == Implication:
+        if self.model == Implication and not self.object.reverses:
             cx = self.object.converse().counterexamples()
             if self.request.GET.get('counterexamples', None) != 'all':
-                context['reverse_extra'] = max(cx.count() - 3, 0)
-                cx = cx[:3]
+                cx, context['reverse_extra'] = _first(cx)
             context['reverse'] = cx
 
         # Add unknown space information for Properties
         if self.model == Property:
             spaces = utils.get_unknown_spaces(self.object)
             if self.request.GET.get('unknown', None) != 'all':
-                context['unknown_extra'] = max(spaces.count() - 3, 0)
-                spaces = spaces[:3]
+                spaces, context['unknown_extra'] = _first(spaces)
             context['unknown'] = spaces
 
+        # Add the most similar spaces for Spaces
+        index = get_index() if self.model == Space else None
+        if index is not None:
+            try:
+                context['similar'] = index.with_spaces(
+                    index.nearest(self.object.id))
+            except KeyError:
+                pass  # Added since the index was built
+
         # Add "traits needing descriptions" for Spaces or Properties
         if self.model in [Space, Property]:
             context['traits_needing_descriptions'] =\
@@ -91,6 +105,14 @@ class Detail(GetObjectMixin, DetailView):
         return context
 
 
+def _first(qs, n=3):
+    """ The first `n` objects of `qs` and the number of others, from one
+        query
+    """
+    objects = tuple(qs)  # `list` is a view here
+    return objects[:n], max(len(objects) - n, 0)
+
+
 def detail(request, model, **kwargs):
     return Detail.as_view(model=model)(request, **kwargs)
 
@@ -135,7 +157,9 @@ class Create(ModelViewMixin, CreateView):
         initial = kwargs.get('initial', {})
         initial.update({
             'space': self.request.GET.get('space', ''),
-            'property': self.request.GET.get('property', '')
+            'property': self.request.GET.get('property', ''),
+            'antecedent': self.request.GET.get('antecedent', ''),
+            'consequent': self.request.GET.get('consequent', '')
         })
         kwargs['initial'] = initial
         return kwargs
@@ -187,16 +211,19 @@ class Delete(GetObjectMixin, DetailView):
         object = self.get_object()
 
         o_count = 0
-        if 'confirm' in self.request.POST and self.request.user.is_superuser:
-            orphans = utils.get_orphans(object)
-            o_count = len(orphans)
-            for o in orphans:
-                o.delete()
-            object.delete()
-
-        old = Trait.objects.count()
-        Prover._add_proofs()
-        new = Trait.objects.count()
+        # The bitmap index is written once, after everything is recovered
+        with bitmaps.batch():
+            if 'confirm' in self.request.POST and \
+                    self.request.user.is_superuser:
+                orphans = utils.get_orphans(object)
+                o_count = len(orphans)
+                for o in orphans:
+                    o.delete()
+                object.delete()
+
+            old = Trait.objects.count()
+            Prover._add_proofs()
+            new = Trait.objects.count()
         messages.warning(self.request,
             '%s proof(s) deleted. %s automatically recovered.' %
             (o_count + 1, new - old))
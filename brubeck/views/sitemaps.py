@@ -0,0 +1,79 @@
+# Serves the sitemap index and its pages, keeping a copy of each generated
+# page on disk until the data it lists changes.
+import glob
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib.sitemaps import views
+from django.http import Http404, HttpResponse
+
+from brubeck import utils
+from brubeck.sitemaps import sitemap
+
+
+def _cache_dir():
+    return getattr(settings, 'BRUBECK_SITEMAP_CACHE',
+        os.path.join(tempfile.gettempdir(), 'brubeck-sitemaps'))
+
+
+def _site(request):
+    """ Fingerprints the host and scheme the urls of a page are built for """
+    return hashlib.md5('%s|%s' % (request.get_host(),
+        request.is_secure())).hexdigest()[:12]
+
+
+def _version(sitemaps):
+    """ Fingerprints the data a page of the sitemap depends on """
+    models = [getattr(sitemaps[section], 'model', None)
+              for section in sorted(sitemaps)]
+    return hashlib.md5(utils.data_version(*filter(None, models))[0]) \
+        .hexdigest()
+
+
+def _cached(request, name, sitemaps, render):
+    """ Serves the cached file for `name` if it is still current. Otherwise
+        the page is rendered, written out, and any stale copies removed.
+    """
+    directory = _cache_dir()
+    # Pages for other hosts are built from the same data but aren't stale
+    prefix = os.path.join(directory, '%s-%s-' % (name, _site(request)))
+    path = '%s%s.xml' % (prefix, _version(sitemaps))
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return HttpResponse(f.read(), content_type='application/xml')
+
+    response = render()
+    response.render()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(response.content)
+    for stale in glob.glob(prefix + '*.xml'):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass  # Removed by another worker
+    os.rename(tmp, path)
+    return response
+
+
+def index(request):
+    """ Lists each page of each section of the sitemap """
+    return _cached(request, 'index', sitemap, lambda: views.index(request,
+        sitemap, sitemap_url_name='brubeck:sitemap_section'))
+
+
+def section(request, section):
+    """ Renders one page of a section of the sitemap """
+    if section not in sitemap:
+        raise Http404
+    try:
+        page = int(request.GET.get('p', 1))
+    except ValueError:
+        raise Http404
+    maps = {section: sitemap[section]}
+    return _cached(request, '%s-%s' % (section, page), maps,
+        lambda: views.sitemap(request, maps, section=section))
@@ -13,7 +13,7 @@ setup(
     packages=find_packages(exclude=['tests.*', 'tests']),
     include_package_data=True,  # declarations in MANIFEST.in
 
-    install_requires=['Django >=1.4'],
+    install_requires=['Django >=1.4', 'numpy'],
 
     classifiers=[
         'Environment :: Web Environment',